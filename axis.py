@@ -0,0 +1,98 @@
+import numpy as np
+
+# Sorted lookups on one axis (time, temperature) of a DSC trace. The sort order, minimum and maximum are worked
+# out once, after which nearest-sample, bounds and range queries are binary searches instead of scans. Time and
+# interpolated temperatures already increase, so their sorted order is the rows themselves and range queries
+# return slices of the original data rather than filtered copies.
+
+
+class AxisIndex():
+    def __init__(self, values, labels=None, sort=True):
+        self.values = np.asarray(values, dtype=float)
+        self.labels = np.arange(len(self.values)) if labels is None else np.asarray(labels)
+        if len(self.labels) != len(self.values):
+            raise ValueError("values and labels must have the same length")
+        # NaNs compare false, so a column holding any is never taken as increasing
+        self.increasing = bool(np.all(self.values[1:] >= self.values[:-1]))
+        self.order = None
+        self.sorted = None
+        if self.increasing:
+            self.sorted = self.values
+        elif sort:
+            # stable, so equal values keep row order and the first of them is found first like idxmin does
+            order = np.argsort(self.values, kind="stable")
+            self.order = order[~np.isnan(self.values[order])]
+            self.sorted = self.values[self.order]
+        if self.sorted is not None:
+            self.min = float(self.sorted[0]) if len(self.sorted) else np.nan
+            self.max = float(self.sorted[-1]) if len(self.sorted) else np.nan
+        else:
+            self.min = float(np.nanmin(self.values)) if len(self.values) else np.nan
+            self.max = float(np.nanmax(self.values)) if len(self.values) else np.nan
+
+    def __len__(self):
+        return len(self.values)
+
+    def bounds(self):
+        return self.min, self.max
+
+    def contains(self, value):
+        return self.min <= value <= self.max
+
+    def row(self, position):
+        return position if self.order is None else int(self.order[position])
+
+    def nearest_row(self, value):
+        # Row of the sample closest to value, the earliest row on ties
+        if self.sorted is None:
+            return int(np.nanargmin(np.abs(self.values - value)))
+        if len(self.sorted) == 0:
+            raise ValueError("No samples to search")
+        above = int(np.searchsorted(self.sorted, value, side="left"))
+        candidates = []
+        if above > 0:
+            below = int(np.searchsorted(self.sorted, self.sorted[above - 1], side="left"))
+            candidates.append((value - self.sorted[below], self.row(below)))
+        if above < len(self.sorted):
+            candidates.append((self.sorted[above] - value, self.row(above)))
+        return min(candidates)[1]
+
+    def nearest(self, value):
+        # Label of the sample closest to value, what (series - value).abs().idxmin() gives
+        return self.labels[self.nearest_row(value)]
+
+    def between(self, start, end):
+        # Positions [first, last) of the sorted values strictly between start and end
+        first = int(np.searchsorted(self.sorted, start, side="right"))
+        last = int(np.searchsorted(self.sorted, end, side="left"))
+        return first, max(first, last)
+
+    def rows_between(self, start, end):
+        # Rows strictly between start and end in row order, a slice when the axis increases
+        if self.sorted is None:
+            return np.flatnonzero((self.values > start) & (self.values < end))
+        first, last = self.between(start, end)
+        if self.order is None:
+            return slice(first, last)
+        return np.sort(self.order[first:last])
+
+    def select(self, frame, start, end):
+        # The rows of frame (or series) strictly between start and end, as select_between_range returns them but
+        # without copying when the axis increases
+        return frame.iloc[self.rows_between(start, end)]
+
+
+def series_axis(series, sort=True):
+    # A Series is searched by its index labels, a plain array (such as a Channels column) by row position
+    if hasattr(series, "index"):
+        return AxisIndex(series.to_numpy(dtype=float), series.index.to_numpy(), sort=sort)
+    return AxisIndex(series, sort=sort)
+
+
+def axis_key(series):
+    # Identifies a column by its buffer and labels, pandas hands out a new Series for every column lookup. An
+    # AxisIndex keeps its values alive, so a cached key cannot be reused by another array while the index is kept.
+    values = series.to_numpy() if hasattr(series, "to_numpy") else np.asarray(series)
+    index = getattr(series, "index", None)
+    labels = (index[0], index[-1]) if index is not None and len(index) else (None, None)
+    return (values.__array_interface__["data"][0], values.strides, values.dtype.str, len(values)) + labels
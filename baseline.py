@@ -0,0 +1,103 @@
+import numpy as np
+
+# Baseline fits of cp = m * T + b. Errors are reported the same way the old minimize objective did,
+# sqrt(sum(residual ** 2)), with each squared residual scaled by its weight when weights are given.
+
+
+def as_arrays(temp, cp, weights=None):
+    temp = np.asarray(temp, dtype=float)
+    cp = np.asarray(cp, dtype=float)
+    if weights is None:
+        weights = np.ones(len(temp))
+    else:
+        weights = np.asarray(weights, dtype=float)
+    if not (len(temp) == len(cp) == len(weights)):
+        raise ValueError("temp, cp and weights must have the same length")
+    return temp, cp, weights
+
+
+def solve_weighted(temp, cp, weights):
+    total = np.sum(weights)
+    if total <= 0:
+        raise ValueError("Weights must sum to a positive value")
+    temp_mean = np.sum(weights * temp) / total
+    cp_mean = np.sum(weights * cp) / total
+    dx = temp - temp_mean
+    sxx = np.sum(weights * dx * dx)
+    # repeated temperatures leave float noise rather than an exact zero, the same relative test fit_baselines uses
+    if not sxx > 1e-12 * total * np.max(np.abs(temp)) ** 2:
+        raise ValueError("At least two distinct temperatures are needed to fit a baseline")
+    m = np.sum(weights * dx * (cp - cp_mean)) / sxx
+    b = cp_mean - m * temp_mean
+    return m, b
+
+
+def fit_baseline(temp, cp, weights=None):
+    temp, cp, weights = as_arrays(temp, cp, weights)
+    m, b = solve_weighted(temp, cp, weights)
+    residual = cp - (m * temp + b)
+    return np.array([m, b]), float(np.sqrt(np.sum(weights * residual * residual)))
+
+
+def robust_weights(residual, loss, tuning):
+    # Median absolute deviation scale, 0.6745 makes it consistent with the standard deviation of normal noise
+    scale = np.median(np.abs(residual - np.median(residual))) / 0.6745
+    if scale == 0:
+        return np.ones(len(residual))
+    u = residual / (tuning * scale)
+    if loss == "huber":
+        return np.minimum(1, 1 / np.maximum(np.abs(u), 1e-12))
+    if loss == "bisquare":
+        return np.where(np.abs(u) < 1, np.square(1 - np.square(u)), 0)
+    raise ValueError("loss must be 'huber' or 'bisquare'")
+
+
+def fit_baseline_robust(temp, cp, weights=None, loss="huber", tuning=None, max_iterations=50, tol=1e-10):
+    # Iteratively reweighted least squares starting from the ordinary fit
+    temp, cp, weights = as_arrays(temp, cp, weights)
+    if tuning is None:
+        tuning = 1.345 if loss == "huber" else 4.685
+    m, b = solve_weighted(temp, cp, weights)
+    robust = np.ones(len(temp))
+    for i in range(0, max_iterations):
+        robust = robust_weights(cp - (m * temp + b), loss, tuning)
+        if np.count_nonzero(weights * robust) < 2:
+            break
+        new_m, new_b = solve_weighted(temp, cp, weights * robust)
+        converged = abs(new_m - m) <= tol * max(1, abs(m)) and abs(new_b - b) <= tol * max(1, abs(b))
+        m, b = new_m, new_b
+        if converged:
+            break
+    residual = cp - (m * temp + b)
+    return np.array([m, b]), float(np.sqrt(np.sum(weights * residual * residual))), weights * robust
+
+
+def fit_baselines(temp, cp, windows, weights=None):
+    # Fits every (start, end) index window, end inclusive, from prefix sums so each window costs O(1).
+    # Returns an (N x 2) array of [m, b] and N errors; windows with fewer than two distinct temperatures are NaN.
+    temp, cp, weights = as_arrays(temp, cp, weights)
+    windows = np.asarray(windows, dtype=int).reshape(-1, 2)
+    if len(windows) and (windows.min() < 0 or windows.max() >= len(temp)):
+        raise IndexError("Baseline window outside of data")
+    # centring keeps the prefix sums from cancelling for temperatures far from zero
+    offset = np.mean(temp) if len(temp) else 0
+    x = temp - offset
+    sums = np.zeros((6, len(temp) + 1))
+    for row, values in enumerate((weights, weights * x, weights * cp, weights * x * x, weights * x * cp,
+                                  weights * cp * cp)):
+        np.cumsum(values, out=sums[row, 1:])
+    starts = windows[:, 0]
+    ends = windows[:, 1] + 1
+    s, sx, sy, sxx, sxy, syy = sums[:, ends] - sums[:, starts]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denominator = s * sxx - sx * sx
+        m = (s * sxy - sx * sy) / denominator
+        b_centred = (sy - m * sx) / s
+        sse = syy - 2 * m * sxy - 2 * b_centred * sy + m * m * sxx + 2 * m * b_centred * sx + b_centred * b_centred * s
+    degenerate = ~(np.abs(denominator) > 1e-12 * np.maximum(s * sxx, 1e-300))
+    m[degenerate] = np.nan
+    b_centred[degenerate] = np.nan
+    params = np.column_stack((m, b_centred - m * offset))
+    errors = np.sqrt(np.maximum(sse, 0))
+    errors[degenerate] = np.nan
+    return params, errors
@@ -0,0 +1,300 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from cache import cache_from_args, content_hash
+from model import DSCModel
+from store import default_store_path, store_from_args
+
+result_fields = ["file", "name", "segment", "status", "message", "t_g", "width", "stp", "enthalpy", "width_2", "max",
+                 "ratio", "error", "guess_error", "linear_error", "nfev", "njev", "fit_source", "import_s", "region_s",
+                 "interpolate_s", "baseline_s", "tg_fit_s", "total_s", "file_hash", "attempts"]
+tg_parameters = ["t_g", "width", "stp", "enthalpy", "width_2", "max", "ratio"]
+
+
+def expand_inputs(inputs, pattern="*"):
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, pattern))
+        else:
+            matches = glob.glob(item) or [item]
+        files.extend(sorted(match for match in matches if os.path.isfile(match)))
+    # a file named twice is only fitted once
+    return list(dict.fromkeys(files))
+
+
+# temperature margin kept inside each segment's span when a multi-cycle file is fitted segment by segment
+segment_margin = 5.
+
+
+def configure_model(model, options):
+    for key in ["interpolation_start", "interpolation_end", "interpolation_step_size"]:
+        if options.get(key) is not None:
+            setattr(model, key, options[key])
+
+
+def fit_file(file, options=None, segment=None):
+    # Runs the automatic guessers and fits for one file, never raises so a bad file only produces a failed row.
+    # With a segment from split_file only that heat or cool of the program is fitted, from the rows split_file
+    # already read rather than by importing the file again.
+    options = options or {}
+    row = {"file": file, "name": os.path.basename(file), "status": "ok", "message": ""}
+    if segment is not None:
+        row["segment"] = segment_label(segment)
+    stage = "import"
+    start = time.perf_counter()
+    last = start
+    try:
+        cache = cache_from_args(options.get("no_cache", False), options.get("rebuild_cache", False),
+                                options.get("cache_dir"))
+        model = DSCModel(file, cache=cache, store=store_from_args(options.get("store")),
+                         rows=None if segment is None else segment.get("rows"))
+        row["name"] = model.imported.name
+        if segment is not None:
+            model.file_hash = segment.get("file_hash")
+            model.accept_segment(segment, options.get("segment_margin", segment_margin))
+        configure_model(model, options)
+        last = record_stage(row, "import_s", last)
+
+        stage = "region"
+        if segment is None:
+            model.guess_interest_region()
+        model.accept_interest_region()
+        last = record_stage(row, "region_s", last)
+
+        stage = "interpolate"
+        model.interpolate()
+        last = record_stage(row, "interpolate_s", last)
+
+        stage = "baseline"
+        if not model.guess_linear_region():
+            raise ValueError("No linear region found")
+        model.fit_linear_model(robust=options.get("robust_baseline", False))
+        row["linear_error"] = float(model.lin_model_error)
+        last = record_stage(row, "baseline_s", last)
+
+        stage = "tg_fit"
+        if not model.guess_tg_region():
+            raise ValueError("No glass transition region found")
+        if options.get("auto_guess", True):
+            row["guess_error"] = float(model.guess_fit_parameters().fun)
+        model.fit_tg_model(method=options.get("method", "trf"))
+        for name, value in zip(tg_parameters, model.gaus_model.x):
+            row[name] = float(value)
+        row["error"] = float(model.gaus_model.fun)
+        row["nfev"] = int(model.gaus_model.nfev)
+        row["njev"] = int(model.gaus_model.njev)
+        row["fit_source"] = model.gaus_model.get("source", "fit")
+        # the parameters stay in the row, but a fit that found no transition is not reported as ok
+        problem = model.check_tg_fit()
+        if problem is not None:
+            raise ValueError(problem)
+        record_stage(row, "tg_fit_s", last)
+    except Exception as error:
+        row["status"] = "failed"
+        row["message"] = "%s: %s: %s" % (stage, type(error).__name__, error)
+    row["total_s"] = time.perf_counter() - start
+    return row
+
+
+def split_file(file, options=None):
+    # The heat and cool segments of a multi-cycle file that options["cycles"] ("heat", "cool" or "all") asks for,
+    # or a failed row when the file cannot be read. The file is imported (and hashed for a fit store) once here,
+    # each segment carries its own rows, so fitting a file costs one import however many segments it has.
+    options = options or {}
+    kinds = {"heat": ["heat"], "cool": ["cool"]}.get(options.get("cycles"), ["heat", "cool"])
+    try:
+        cache = cache_from_args(options.get("no_cache", False), options.get("rebuild_cache", False),
+                                options.get("cache_dir"))
+        model = DSCModel(file, cache=cache)
+        segments = [dict(segment, rows=model.segment_rows(segment))
+                    for segment in model.split_cycles(options.get("min_rate", 1.)) if segment["kind"] in kinds]
+        file_hash = content_hash(file) if segments and options.get("store") else None
+    except Exception as error:
+        return [], {"file": file, "name": os.path.basename(file), "status": "failed",
+                    "message": "cycles: %s: %s" % (type(error).__name__, error)}
+    if not segments:
+        return [], {"file": file, "name": os.path.basename(file), "status": "failed",
+                    "message": "cycles: No %s segments found" % " or ".join(kinds)}
+    for segment in segments:
+        segment["file_hash"] = file_hash
+    return segments, None
+
+
+def segment_label(segment):
+    return "%s %d" % (segment["kind"], segment["number"])
+
+
+def record_stage(row, key, last):
+    now = time.perf_counter()
+    row[key] = now - last
+    return now
+
+
+class ResultWriter():
+    # Writes one row per fitted file as soon as it is available, as CSV or as JSON lines. With append an existing
+    # table is continued, keeping the columns of its header; a header missing some of result_fields (a table
+    # written by an older version) is extended first, so no column of a new row is dropped.
+    def __init__(self, output, format="csv", append=False):
+        if format not in ["csv", "json"]:
+            raise ValueError("format must be 'csv' or 'json'")
+        self.format = format
+        self.output = output
+        fields = result_fields
+        if append and isinstance(output, str) and format == "csv" and os.path.exists(output):
+            fields = extend_header(output)
+        mode = "a" if append else "w"
+        self.file = open(output, mode, newline="", encoding="utf-8") if isinstance(output, str) else output
+        if format == "csv":
+            self.writer = csv.DictWriter(self.file, fieldnames=fields, extrasaction="ignore")
+            if not append or self.file.tell() == 0:
+                self.writer.writeheader()
+
+    def write(self, row):
+        if self.format == "csv":
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if isinstance(self.output, str):
+            self.file.close()
+
+
+def extend_header(output):
+    # The columns of an existing CSV table plus any of result_fields it lacks, rewriting the table when some are
+    # missing so its earlier rows line up with the new header
+    with open(output, newline="", encoding="utf-8") as existing:
+        reader = csv.DictReader(existing)
+        fields = list(reader.fieldnames or [])
+        missing = [field for field in result_fields if field not in fields]
+        if not fields or not missing:
+            return fields or result_fields
+        rows = list(reader)
+    fields += missing
+    temp_path = output + ".tmp"
+    with open(temp_path, "w", newline="", encoding="utf-8") as extended:
+        writer = csv.DictWriter(extended, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(temp_path, output)
+    return fields
+
+
+def run_batch(files, writer, workers=None, options=None, verbose=False):
+    if (options or {}).get("cycles"):
+        return run_cycles(files, writer, workers, options, verbose)
+    rows = []
+    if workers == 1:
+        for file in files:
+            rows.append(handle_row(fit_file(file, options), writer, verbose))
+        return rows
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fit_file, file, options): file for file in files}
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+            except Exception as error:
+                # the worker itself died, e.g. out of memory
+                row = {"file": futures[future], "name": os.path.basename(futures[future]), "status": "failed",
+                       "message": "worker: %s: %s" % (type(error).__name__, error)}
+            rows.append(handle_row(row, writer, verbose))
+    return rows
+
+
+def run_cycles(files, writer, workers=None, options=None, verbose=False):
+    # Splits every file into its heats and cools, then fits all segments of all files concurrently. Rows are
+    # streamed as they finish and returned in file order, each file's segments in the order they were run.
+    order = {file: position for position, file in enumerate(files)}
+    rows = []
+    if workers == 1:
+        for file in files:
+            segments, failed = split_file(file, options)
+            if failed is not None:
+                rows.append(handle_row(failed, writer, verbose))
+            for segment in segments:
+                rows.append(handle_row(fit_file(file, options, segment), writer, verbose))
+        return rows
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        splits = {executor.submit(split_file, file, options): file for file in files}
+        fits = {}
+        for future in as_completed(splits):
+            file = splits[future]
+            try:
+                segments, failed = future.result()
+            except Exception as error:
+                segments, failed = [], {"file": file, "name": os.path.basename(file), "status": "failed",
+                                        "message": "worker: %s: %s" % (type(error).__name__, error)}
+            if failed is not None:
+                rows.append((order[file], -1, handle_row(failed, writer, verbose)))
+            # a file's segments start fitting as soon as it is split, while other files are still being split
+            for segment in segments:
+                fits[executor.submit(fit_file, file, options, segment)] = (file, segment)
+        for future in as_completed(fits):
+            file, segment = fits[future]
+            try:
+                row = future.result()
+            except Exception as error:
+                row = {"file": file, "name": os.path.basename(file), "segment": segment_label(segment),
+                       "status": "failed", "message": "worker: %s: %s" % (type(error).__name__, error)}
+            rows.append((order[file], segment["start"], handle_row(row, writer, verbose)))
+    return [row for _, _, row in sorted(rows, key=lambda item: item[:2])]
+
+
+def handle_row(row, writer, verbose=False):
+    writer.write(row)
+    if verbose:
+        label = row["file"] + (" [%s]" % row["segment"] if row.get("segment") else "")
+        if row["status"] == "ok":
+            print("%s: Tg %5.2f error %5.5f (%5.2f s)" % (label, row["t_g"], row["error"], row["total_s"]))
+        else:
+            print("%s: %s" % (label, row["message"]))
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="+", help="DSC files, directories or glob patterns to fit")
+    parser.add_argument("-o", "--output", type=str, default="results.csv", help="File to stream results to")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv", help="CSV rows or JSON lines")
+    parser.add_argument("-p", "--pattern", type=str, default="*", help="File pattern used inside directories")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("-is", "--interpolation_start", type=float, help="Temperature at start of interpolation")
+    parser.add_argument("-ie", "--interpolation_end", type=float, help="Temperature at end of interpolation")
+    parser.add_argument("-ss", "--step_size", type=float, help="Interpolation step size")
+    parser.add_argument("-m", "--method", choices=["trf", "dogbox", "lm", "minimize"], default="trf",
+                        help="Tg fitting method")
+    parser.add_argument("-rb", "--robust_baseline", help="Fit the linear region with robust reweighting",
+                        action="store_true")
+    parser.add_argument("--fixed-guesses", help="Start every Tg fit from the fixed guesses instead of searching",
+                        action="store_true")
+    parser.add_argument("--store", nargs="?", const=default_store_path, default=None,
+                        help="Reuse and record fits in this SQLite fit store (default location without a path)")
+    parser.add_argument("--cycles", nargs="?", const="all", choices=["heat", "cool", "all"], default=None,
+                        help="Split multi-cycle files and fit every heat, cool or both (default without a value)")
+    parser.add_argument("-v", "--verbose", help="Print a line per finished file", action="store_true")
+    parser.add_argument("--no-cache", help="Parse DSC files without using the parsed-file cache", action="store_true")
+    parser.add_argument("--rebuild-cache", help="Re-parse DSC files and replace their cache entries",
+                        action="store_true")
+    args = parser.parse_args()
+
+    files = expand_inputs(args.inputs, args.pattern)
+    options = {"interpolation_start": args.interpolation_start, "interpolation_end": args.interpolation_end,
+               "interpolation_step_size": args.step_size, "method": args.method,
+               "robust_baseline": args.robust_baseline, "auto_guess": not args.fixed_guesses,
+               "no_cache": args.no_cache, "rebuild_cache": args.rebuild_cache, "store": args.store,
+               "cycles": args.cycles}
+    writer = ResultWriter(args.output, args.format)
+    try:
+        rows = run_batch(files, writer, workers=args.workers, options=options, verbose=args.verbose)
+    finally:
+        writer.close()
+    failed = sum(1 for row in rows if row["status"] != "ok")
+    print("Fitted %d %s, %d failed, results in %s" % (len(rows) - failed, "segments" if args.cycles else "files",
+                                                     failed, args.output))
@@ -0,0 +1,529 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+
+import baseline
+import fitting
+import processing
+import synthetic
+from model import DSCModel
+
+# °C a Tg fitted by bench_suite may be off the generated one, the model's step sits about .25 °C below the
+# generator's erf midpoint
+tg_tolerance = .5
+
+
+def time_call(function, *args, repeat=3, **kwargs):
+    best = float("inf")
+    result = None
+    for i in range(0, repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_import(files, repeat=3):
+    rows = []
+    for file in files:
+        legacy_time, legacy = time_call(processing.import_dsc_data_legacy, file, repeat=repeat)
+        fast_time, fast = time_call(processing.import_dsc_data, file, repeat=repeat)
+        rows.append({"file": file, "rows": len(fast.data_frame), "legacy_rows": len(legacy.data_frame),
+                     "legacy_s": legacy_time, "columnar_s": fast_time, "speedup": legacy_time / fast_time})
+    return rows
+
+
+def bench_kernels(sizes, repeat=3, magic_number=17.72432):
+    rows = []
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        temps = np.linspace(30, 160, size)
+        baseline = 0.002 * temps + 1
+        guesses = [80, 3, 2, 85, 2, .2, .1]
+        reference_time, reference = time_call(processing.evaluate_tg_model_reference, temps, baseline, guesses,
+                                              magic_number, repeat=repeat)
+        kernel_time, kernel = time_call(processing.evaluate_tg_model, temps, baseline, guesses, magic_number,
+                                        repeat=repeat)
+        gaussian = rng.random(size)
+        inverse = processing.inverse_cumulative_gaussian(gaussian, processing.cp_heading)[processing.cp_heading]
+        equal = (np.allclose(reference[0], kernel[0], rtol=1e-10, atol=1e-12)
+                 and np.allclose(reference[1], kernel[1]) and np.allclose(reference[2], kernel[2])
+                 and np.allclose(inverse, processing.inverse_cumulative_gaussian_array(gaussian)))
+        rows.append({"points": size, "reference_s": reference_time, "kernel_s": kernel_time,
+                     "speedup": reference_time / kernel_time, "equal": equal})
+    return rows
+
+
+def bench_resample(sizes, repeat=3, start=30, end=160, step_size=.25):
+    rows = []
+    rng = np.random.default_rng(0)
+    max_step = int((end - start) / step_size)
+    for size in sizes:
+        temps = np.linspace(start - 5, end + 5, size) + rng.normal(0, .001, size)
+        temps.sort()
+        cps = 0.002 * temps + 1 + rng.normal(0, .001, size)
+        frame = pd.DataFrame({processing.temp_heading: temps, processing.cp_heading: cps})
+        legacy_time, legacy = time_call(processing.interp_temp_cp, frame, start, step_size, max_step, repeat=repeat)
+        resample_time, resampled = time_call(processing.resample_temp_cp, temps, cps, start, step_size, max_step,
+                                             repeat=repeat)
+        rows.append({"points": size, "steps": max_step, "legacy_s": legacy_time, "resample_s": resample_time,
+                     "speedup": legacy_time / resample_time,
+                     "max_difference": float(np.max(np.abs(legacy[processing.cp_heading].to_numpy() - resampled[1])))})
+    return rows
+
+
+def minimize_baseline(temps, cps):
+    frame = pd.DataFrame({processing.temp_heading: temps, processing.cp_heading: cps})
+
+    def objective_function(mb):
+        return np.sqrt(((mb[0] * frame[processing.temp_heading] + mb[1]) - frame[processing.cp_heading]).pow(2).sum())
+
+    fit = minimize(objective_function, np.array([1, 1], dtype=float))
+    return fit.x, fit.fun
+
+
+def bench_baseline(sizes, repeat=3, windows=200):
+    rows = []
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        temps = np.linspace(30, 160, size)
+        cps = 0.002 * temps + 1 + rng.normal(0, .001, size)
+        minimize_time, minimized = time_call(minimize_baseline, temps, cps, repeat=repeat)
+        exact_time, exact = time_call(baseline.fit_baseline, temps, cps, repeat=repeat)
+        robust_time, robust = time_call(baseline.fit_baseline_robust, temps, cps, repeat=repeat)
+        starts = rng.integers(0, size // 2, windows)
+        window_list = np.column_stack((starts, starts + size // 4))
+        batched_time, batched = time_call(baseline.fit_baselines, temps, cps, window_list, repeat=repeat)
+        rows.append({"points": size, "minimize_s": minimize_time, "exact_s": exact_time, "robust_s": robust_time,
+                     "batched_s": batched_time, "windows": windows, "speedup": minimize_time / exact_time,
+                     "minimize_error": float(minimized[1]), "exact_error": exact[1]})
+    return rows
+
+
+def synthetic_transition(size, rng, noise=.002, truth=(80, 3, .4, 84, 4, .05, .2)):
+    temps = np.linspace(50, 120, size)
+    linear_model = 0.004 * temps + 1.2
+    observed = processing.evaluate_tg_model(temps, linear_model, truth, fitting.magic_number)[0]
+    return temps, observed + rng.normal(0, noise, size), linear_model
+
+
+def bench_tg_fit(sizes, repeat=1, guesses=(78, 1, 1, 82, 1, 1, 0)):
+    rows = []
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        temps, observed, linear_model = synthetic_transition(size, rng)
+        workspace = fitting.ModelWorkspace(temps, observed, linear_model)
+        for method in ["minimize", "trf", "lm"]:
+            if method == "minimize":
+                wall_time, fit = time_call(fitting.fit_tg_minimize, workspace, list(guesses), repeat=repeat)
+            else:
+                wall_time, fit = time_call(fitting.fit_tg_least_squares, workspace, list(guesses), method=method,
+                                           repeat=repeat)
+            row = {"points": size}
+            row.update(fitting.fit_statistics(fit))
+            row["t_g"] = float(fit.x[0])
+            rows.append(row)
+    return rows
+
+
+def bench_guesses(sizes, tgs=(40, 80, 120, 160)):
+    # Fits the same transitions from the fixed guesses and from fitting.initial_guesses, the search's own time
+    # is part of guess_s
+    rows = []
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        for tg in tgs:
+            truth = (tg, 3, .4, tg + 4, 4, .05, .2)
+            temps = np.linspace(tg - 35, tg + 35, size)
+            linear_model = 0.004 * temps + 1.2
+            observed = processing.evaluate_tg_model(temps, linear_model, truth, fitting.magic_number)[0]
+            workspace = fitting.ModelWorkspace(temps, observed + rng.normal(0, .002, size), linear_model)
+            fixed = fitting.fit_tg_least_squares(workspace, fitting.fixed_guesses)
+            guess = fitting.initial_guesses(workspace)
+            searched = fitting.fit_tg_least_squares(workspace, guess.x)
+            rows.append({"points": size, "tg_truth": tg, "fixed_nfev": int(fixed.nfev), "fixed_error": float(fixed.fun),
+                         "fixed_tg": float(fixed.x[0]), "fixed_fit_s": fixed.wall_time, "guess_s": guess.wall_time,
+                         "guess_error": float(guess.fun), "auto_nfev": int(searched.nfev),
+                         "auto_error": float(searched.fun), "auto_tg": float(searched.x[0]),
+                         "auto_fit_s": searched.wall_time})
+    return rows
+
+
+def evaluations_per_second(function, guesses, seconds=.2):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        function(guesses)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def bench_workspace(sizes, seconds=.2):
+    rows = []
+    rng = np.random.default_rng(0)
+    guesses = [79, 2.5, .5, 83, 3, .04, .1]
+    for size in sizes:
+        temps, observed, linear_model = synthetic_transition(size, rng)
+        workspace = fitting.ModelWorkspace(temps, observed, linear_model)
+
+        def reference(guesses):
+            full_model = processing.evaluate_tg_model_reference(temps, linear_model, guesses, fitting.magic_number)[0]
+            return np.sqrt(np.sum(np.square(observed - full_model)))
+
+        def kernels(guesses):
+            full_model = processing.evaluate_tg_model(temps, linear_model, guesses, fitting.magic_number)[0]
+            return np.sqrt(np.sum(np.square(observed - full_model)))
+
+        rows.append({"points": size, "reference_per_s": evaluations_per_second(reference, guesses, seconds),
+                     "kernels_per_s": evaluations_per_second(kernels, guesses, seconds),
+                     "workspace_per_s": evaluations_per_second(workspace.error, guesses, seconds),
+                     "jacobian_per_s": evaluations_per_second(workspace.jacobian, guesses, seconds),
+                     "equal": bool(np.isclose(workspace.error(guesses), reference(guesses)))})
+    return rows
+
+
+def bench_batch(sizes, repeat=3, points=560):
+    # sizes are the number of parameter sets, evaluated over a transition of points temperatures
+    rows = []
+    rng = np.random.default_rng(0)
+    temps, observed, linear_model = synthetic_transition(points, rng)
+    workspace = fitting.ModelWorkspace(temps, observed, linear_model)
+    for size in sizes:
+        parameters = np.array([79, 2.5, .5, 83, 3, .04, .1]) + rng.normal(0, .3, (size, 7))
+
+        def loop(parameters):
+            models = []
+            errors = []
+            for guesses in parameters:
+                # one model curve and error at a time, as a caller of DSCModel.apply_model gets them
+                models.append(workspace.evaluate(guesses).copy())
+                errors.append(workspace.error(guesses))
+            return np.array(models), np.array(errors)
+
+        loop_time, (loop_models, loop_errors) = time_call(loop, parameters, repeat=repeat)
+        batch_time, (batch_models, batch_errors) = time_call(workspace.evaluate_batch, parameters, repeat=repeat)
+        errors_time, _ = time_call(workspace.evaluate_batch, parameters, return_models=False, repeat=repeat)
+        rows.append({"parameter_sets": size, "points": points, "loop_per_s": size / loop_time,
+                     "batch_per_s": size / batch_time, "errors_only_per_s": size / errors_time,
+                     "speedup": loop_time / batch_time,
+                     "equal": bool(np.array_equal(loop_models, batch_models) and
+                                   np.array_equal(loop_errors, batch_errors))})
+    # a single parameter set scored as a batch of one gives the error a fit reports for it
+    for guesses in parameters[:3]:
+        if workspace.evaluate_batch(guesses[None])[1][0] != workspace.error(guesses):
+            raise AssertionError("evaluate_batch and error disagree for %s" % guesses)
+    return rows
+
+
+def bench_render(sizes, repeat=3):
+    # Draws a trace of each size on an off-screen canvas plotted whole and through render.DecimatedLine, and
+    # times re-decimating a 1% zoom
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    import render
+
+    rows = []
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        x = np.linspace(0, 100, size)
+        y = np.cumsum(rng.normal(0, 1, size))
+
+        def draw(decimate):
+            figure = Figure(figsize=(10, 5), dpi=100)
+            FigureCanvasAgg(figure)
+            axes = figure.add_subplot(1, 1, 1)
+            line = render.DecimatedLine(axes, x, y) if decimate else axes.plot(x, y)[0]
+            figure.canvas.draw()
+            return axes, line
+
+        full_time, (full_axes, full_line) = time_call(draw, False, repeat=repeat)
+        decimated_time, (axes, line) = time_call(draw, True, repeat=repeat)
+        # what every prompt or pan pays once the trace is on screen
+        full_redraw_time, _ = time_call(full_axes.figure.canvas.draw, repeat=repeat)
+        redraw_time, _ = time_call(axes.figure.canvas.draw, repeat=repeat)
+        zoom_time, _ = time_call(axes.set_xlim, 50, 51, repeat=repeat)
+        rows.append({"points": size, "full_s": full_time, "decimated_s": decimated_time,
+                     "full_redraw_s": full_redraw_time, "redraw_s": redraw_time, "zoom_s": zoom_time,
+                     "drawn_points": len(line.line.get_xdata()), "redraw_speedup": full_redraw_time / redraw_time})
+    return rows
+
+
+heavy_modules = ["pandas", "scipy.optimize", "scipy.signal", "scipy.stats", "matplotlib.pyplot"]
+import_probe = """
+import json, sys, time
+start = time.perf_counter()
+import %s
+print(json.dumps({"import_s": time.perf_counter() - start, "loaded": [name for name in %r if name in sys.modules]}))
+"""
+
+
+def bench_imports(modules, repeat=3):
+    # Imports each module in a fresh interpreter and reports the best time and which heavy dependencies it pulled
+    # in, then times a fit-only main.py run on a small synthetic export
+    rows = []
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in modules:
+        runs = [json.loads(subprocess.run([sys.executable, "-c", import_probe % (module, heavy_modules)],
+                                          capture_output=True, text=True, cwd=directory, check=True).stdout)
+                for i in range(0, repeat)]
+        rows.append({"module": module, "import_s": min(run["import_s"] for run in runs),
+                     "loaded": " ".join(runs[0]["loaded"]) or "-"})
+    with tempfile.TemporaryDirectory(prefix="tgfinder_bench_") as data_dir:
+        path = os.path.join(data_dir, "synthetic.txt")
+        truth = synthetic.generate_dsc_file(path, rows=20000, seed=0)
+        command = [sys.executable, os.path.join(directory, "main.py"), "-f", path, "--no-cache",
+                   "-is", str(truth["start_temp"] + 5), "-ss", ".25",
+                   "-s", str(int((truth["end_temp"] - truth["start_temp"] - 10) / .25)),
+                   "-fs", str(truth["linear_window"][0]), "-fe", str(truth["linear_window"][1]),
+                   "-ts", str(truth["tg_window"][0]), "-te", str(truth["tg_window"][1])]
+        run_time, _ = time_call(subprocess.run, command, capture_output=True, check=True, repeat=repeat)
+        rows.append({"module": "main.py fit run", "import_s": run_time, "loaded": "-"})
+    return rows
+
+
+def bench_segment(sizes, repeat=1):
+    rows = []
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        trace = np.cumsum(rng.normal(0, 1, size))
+        legacy_time, legacy = time_call(processing.bin_first_deriv_legacy, trace, repeat=repeat)
+        engine_time, engine = time_call(processing.bin_first_deriv, trace, repeat=repeat)
+        rows.append({"points": size, "legacy_s": legacy_time, "engine_s": engine_time,
+                     "speedup": legacy_time / engine_time, "changes": len(engine[1]),
+                     "equal": engine[1] == legacy[1] and bool(np.array_equal(engine[0], legacy[0]))})
+    return rows
+
+
+def bench_lookups(sizes, repeat=3, queries=100):
+    # Nearest-sample, bounds and range lookups on an increasing axis, by scanning the column and through an
+    # AxisIndex built once
+    from axis import series_axis
+
+    rows = []
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        series = pd.Series(np.linspace(0, 200, size) + rng.uniform(0, 1e-3, size).cumsum())
+        frame = pd.DataFrame({"temp": series, "cp": rng.normal(0, 1, size)})
+        values = rng.uniform(0, 200, queries)
+
+        def scan():
+            return [((series - value).abs().idxmin(), series.min() <= value <= series.max(),
+                     len(frame[(frame["temp"] > value - 10) & (frame["temp"] < value + 10)])) for value in values]
+
+        def indexed(axis):
+            return [(axis.nearest(value), axis.contains(value), len(axis.select(frame, value - 10, value + 10)))
+                    for value in values]
+
+        build_time, axis = time_call(series_axis, series, repeat=repeat)
+        scan_time, scanned = time_call(scan, repeat=repeat)
+        indexed_time, found = time_call(indexed, axis, repeat=repeat)
+        view = axis.select(frame, 50, 150)
+        rows.append({"points": size, "queries": queries, "build_s": build_time, "scan_s": scan_time,
+                     "indexed_s": indexed_time, "speedup": scan_time / indexed_time,
+                     "equal": scanned == [(int(a), b, c) for a, b, c in found],
+                     "zero_copy": bool(np.shares_memory(view["temp"].to_numpy(), frame["temp"].to_numpy()))})
+    return rows
+
+
+def timed(row, key, function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    row[key] = time.perf_counter() - start
+    return result
+
+
+def bench_suite(sizes, data_dir=None, seed=0, method="trf"):
+    # Generates a synthetic export per size and times each DSCModel stage on it along the unattended path: the
+    # region, linear window, Tg window and fit guesses are all found automatically, only the interpolation range
+    # comes from the generator. The guessed region has to cover the generator's region to within a partition, the
+    # guessed Tg window has to contain the generated Tg and the fit has to recover it to within tg_tolerance.
+    rows = []
+    directory = data_dir or tempfile.mkdtemp(prefix="tgfinder_bench_")
+    for size in sizes:
+        path = os.path.join(directory, "synthetic_%d.txt" % size)
+        row = {"rows": size}
+        truth = timed(row, "generate_s", synthetic.generate_dsc_file, path, rows=size, seed=seed)
+        row["file_bytes"] = os.path.getsize(path)
+        model = timed(row, "import_s", DSCModel, path)
+        timed(row, "region_guess_s", model.guess_interest_region)
+        row["region_guess"] = [int(model.region_start_index), int(model.region_end_index)]
+        row["region_truth"] = truth["region"]
+        if model.region_start_index > truth["region"][0] + 10 or model.region_end_index < truth["region"][1] - 10:
+            raise AssertionError("Guessed region %s does not cover the generated region %s" % (
+                row["region_guess"], truth["region"]))
+        timed(row, "region_s", model.accept_interest_region)
+        model.interpolation_start = truth["start_temp"] + 5
+        model.interpolation_end = truth["end_temp"] - 5
+        timed(row, "interpolation_s", model.interpolate)
+        if not timed(row, "linear_guess_s", model.guess_linear_region):
+            raise AssertionError("No linear region found in the %d row export" % size)
+        timed(row, "baseline_s", model.fit_linear_model)
+        if not timed(row, "tg_guess_s", model.guess_tg_region):
+            raise AssertionError("No glass transition region found in the %d row export" % size)
+        temps = model.interped[processing.temp_heading]
+        row["tg_window"] = [float(temps[model.tg_region_start]), float(temps[model.tg_region_end])]
+        if not row["tg_window"][0] < truth["tg"] < row["tg_window"][1]:
+            raise AssertionError("Guessed Tg window %s does not contain the generated Tg %s" % (
+                row["tg_window"], truth["tg"]))
+        timed(row, "guesses_s", model.guess_fit_parameters)
+        timed(row, "tg_fit_s", model.fit_tg_model, method=method)
+        row["tg_error"] = float(model.gaus_model.fun)
+        row["tg_fitted"] = float(model.gaus_model.x[0])
+        row["tg_truth"] = truth["tg"]
+        row["nfev"] = int(model.gaus_model.nfev)
+        if abs(row["tg_fitted"] - truth["tg"]) > tg_tolerance:
+            raise AssertionError("Fitted Tg %5.3f is more than %s from the generated Tg %s" % (
+                row["tg_fitted"], tg_tolerance, truth["tg"]))
+        if data_dir is None:
+            os.remove(path)
+        rows.append(row)
+    if data_dir is None:
+        os.rmdir(directory)
+    return rows
+
+
+def bench_memory(sizes, seed=0, method="trf"):
+    # Peak and retained memory (tracemalloc, which numpy reports its buffers to) of one DSCModel taken from
+    # import to Tg fit on a synthetic export of each size, using the generator's known region and windows
+    import tracemalloc
+
+    rows = []
+    directory = tempfile.mkdtemp(prefix="tgfinder_memory_")
+    for size in sizes:
+        path = os.path.join(directory, "synthetic_%d.txt" % size)
+        truth = synthetic.generate_dsc_file(path, rows=size, seed=seed)
+        row = {"rows": size}
+        tracemalloc.start()
+        model = DSCModel(path)
+        row["import_mb"] = tracemalloc.get_traced_memory()[0] / 1e6
+        model.region_start_index, model.region_end_index = truth["region"]
+        model.accept_interest_region()
+        model.interpolation_start = truth["start_temp"] + 5
+        model.interpolation_end = truth["end_temp"] - 5
+        model.interpolate()
+        temps = model.interped[processing.temp_heading]
+        model.linear_start_index, model.linear_end_index = (model.most_close_index(value, temps)
+                                                            for value in truth["linear_window"])
+        model.fit_linear_model()
+        model.tg_region_start, model.tg_region_end = (model.most_close_index(value, temps)
+                                                      for value in truth["tg_window"])
+        model.tg_guess = truth["tg"] + 2
+        model.enthalpy_guess = truth["overshoot_temp"]
+        model.fit_tg_model(method=method)
+        row["retained_mb"], row["peak_mb"] = (value / 1e6 for value in tracemalloc.get_traced_memory())
+        tracemalloc.stop()
+        row["samples_mb"] = size * 3 * 8 / 1e6
+        row["tg_fitted"] = float(model.gaus_model.x[0])
+        del model
+        os.remove(path)
+        rows.append(row)
+    os.rmdir(directory)
+    return rows
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def write_report(path, stage, rows):
+    report = {"stage": stage, "commit": git_commit(), "created": datetime.datetime.now().isoformat(),
+              "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+              "machine": platform.machine(), "results": rows}
+    with open(path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2)
+
+
+def compare_reports(old_path, new_path, key="rows"):
+    # Ratio new / old of every timing ("_s") field for rows with the same size
+    with open(old_path, "r", encoding="utf-8") as old_file:
+        old = json.load(old_file)
+    with open(new_path, "r", encoding="utf-8") as new_file:
+        new = json.load(new_file)
+    old_rows = {row[key]: row for row in old["results"] if key in row}
+    rows = []
+    for row in new["results"]:
+        if row.get(key) not in old_rows:
+            continue
+        compared = {key: row[key]}
+        for field, value in row.items():
+            previous = old_rows[row[key]].get(field)
+            if field.endswith("_s") and isinstance(value, float) and isinstance(previous, float) and previous > 0:
+                compared[field + "_ratio"] = value / previous
+        rows.append(compared)
+    return rows
+
+
+def print_rows(rows):
+    for row in rows:
+        print(", ".join(key + "=" + (("%.5f" % value) if isinstance(value, float) else str(value))
+                        for key, value in row.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("stage", choices=["import", "kernels", "resample", "baseline", "tgfit", "workspace", "batch",
+                                          "guesses", "segment", "render", "imports", "lookups", "memory", "suite",
+                                          "compare"],
+                        help="Stage to benchmark, or compare two reports")
+    parser.add_argument("files", nargs="*",
+                        help="DSC files to benchmark against, modules to import, or the old and new report")
+    parser.add_argument("-n", "--sizes", type=int, nargs="+",
+                        help="Number of points for synthetic stages (rows for the suite)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Best of this many runs is reported")
+    parser.add_argument("--report", type=str, help="Also write the results as a JSON report to this file")
+    parser.add_argument("--data-dir", type=str, help="Keep the suite's synthetic exports in this directory")
+    args = parser.parse_args()
+    sizes = args.sizes or {"suite": [10000, 100000, 1000000, 10000000],
+                           "batch": [100, 1000, 10000],
+                           "render": [100000, 1000000, 5000000],
+                           "lookups": [10000, 100000, 1000000],
+                           "memory": [100000, 1000000, 5000000]}.get(args.stage, [500, 2000, 8000])
+
+    if args.stage == "import":
+        rows = bench_import(args.files, repeat=args.repeat)
+    elif args.stage == "kernels":
+        rows = bench_kernels(sizes, repeat=args.repeat)
+    elif args.stage == "resample":
+        rows = bench_resample(sizes, repeat=args.repeat)
+    elif args.stage == "baseline":
+        rows = bench_baseline(sizes, repeat=args.repeat)
+    elif args.stage == "tgfit":
+        rows = bench_tg_fit(sizes, repeat=args.repeat)
+    elif args.stage == "workspace":
+        rows = bench_workspace(sizes)
+    elif args.stage == "batch":
+        rows = bench_batch(sizes, repeat=args.repeat)
+    elif args.stage == "guesses":
+        rows = bench_guesses(sizes)
+    elif args.stage == "render":
+        rows = bench_render(sizes, repeat=args.repeat)
+    elif args.stage == "imports":
+        rows = bench_imports(args.files or ["processing", "fitting", "model", "pipeline", "main", "batch",
+                                            "controller"], repeat=args.repeat)
+    elif args.stage == "lookups":
+        rows = bench_lookups(sizes, repeat=args.repeat)
+    elif args.stage == "memory":
+        rows = bench_memory(sizes)
+    elif args.stage == "segment":
+        rows = bench_segment(sizes, repeat=args.repeat)
+    elif args.stage == "suite":
+        rows = bench_suite(sizes, data_dir=args.data_dir)
+    else:
+        rows = compare_reports(args.files[0], args.files[1])
+    print_rows(rows)
+    if args.report:
+        write_report(args.report, args.stage, rows)
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import processing
+
+default_cache_dir = os.environ.get("TGFINDER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tgfinder"))
+default_max_bytes = 2 * 1024 ** 3
+cache_version = 1
+
+
+def content_hash(file, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(file, "rb") as data_file:
+        block = data_file.read(block_size)
+        while block:
+            digest.update(block)
+            block = data_file.read(block_size)
+    return digest.hexdigest()
+
+
+class DSCCache():
+    # Parsed DSC exports are stored as a .npy array of the body plus a .json sidecar with the header values.
+    # Entries are keyed by the absolute path; size and mtime are checked first and the content hash decides
+    # whether a touched but unchanged file can still use its entry.
+    def __init__(self, cache_dir=default_cache_dir, max_bytes=default_max_bytes, rebuild=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.rebuild = rebuild
+        self.hits = 0
+        self.misses = 0
+
+    def entry_paths(self, file):
+        key = hashlib.sha1(os.path.abspath(file).encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + ".npy", base + ".json"
+
+    def load(self, file, verbose=False):
+        array_path, meta_path = self.entry_paths(file)
+        stat = os.stat(file)
+        meta = None if self.rebuild else self.read_meta(meta_path)
+        if meta is not None and os.path.exists(array_path):
+            if meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+                return self.hit(file, array_path, meta_path, meta, verbose)
+            if meta["size"] == stat.st_size and meta["hash"] == content_hash(file):
+                meta["mtime_ns"] = stat.st_mtime_ns
+                self.write_meta(meta_path, meta)
+                return self.hit(file, array_path, meta_path, meta, verbose)
+        self.misses += 1
+        if verbose:
+            print("Cache miss for " + file + ", parsing...")
+        data = processing.import_dsc_data(file, verbose=verbose)
+        self.store(file, stat, data, array_path, meta_path)
+        return data
+
+    def hit(self, file, array_path, meta_path, meta, verbose=False):
+        self.hits += 1
+        if verbose:
+            print("Loading " + file + " from cache...")
+        os.utime(meta_path)
+        data = processing.DSCDataFrame(file)
+        data.name = meta["name"]
+        data.sample_mass = meta["sample_mass"]
+        data.create_data_frame(np.load(array_path, mmap_mode="r"), meta["headers"], copy=False)
+        return data
+
+    def store(self, file, stat, data, array_path, meta_path):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        meta = {"version": cache_version, "path": os.path.abspath(file), "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns, "hash": content_hash(file), "name": data.name,
+                "sample_mass": data.sample_mass, "headers": list(data.data_frame.columns)}
+        temp_path = array_path + ".tmp.npy"
+        np.save(temp_path, np.ascontiguousarray(data.data_frame.to_numpy(dtype=float)))
+        os.replace(temp_path, array_path)
+        self.write_meta(meta_path, meta)
+        self.evict()
+
+    def read_meta(self, meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != cache_version:
+            return None
+        return meta
+
+    def write_meta(self, meta_path, meta):
+        temp_path = meta_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(temp_path, meta_path)
+
+    def entries(self):
+        # (last used, total bytes, paths) for every cache entry, least recently used first
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.cache_dir, name)
+            array_path = meta_path[:-len(".json")] + ".npy"
+            paths = [path for path in (array_path, meta_path) if os.path.exists(path)]
+            try:
+                last_used = os.stat(meta_path).st_mtime
+                size = sum(os.stat(path).st_size for path in paths)
+            except OSError:
+                continue
+            entries.append((last_used, size, paths))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        for last_used, size, paths in entries:
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def clear(self):
+        for last_used, size, paths in self.entries():
+            for path in paths:
+                os.remove(path)
+
+
+def cache_from_args(no_cache=False, rebuild_cache=False, cache_dir=None):
+    if no_cache:
+        return None
+    return DSCCache(cache_dir=cache_dir or default_cache_dir, rebuild=rebuild_cache)
@@ -0,0 +1,62 @@
+import numpy as np
+
+temp_heading = "Temperature (°C)"
+cp_heading = "Heat Capacity (mJ/°C)"
+time_heading = "Time (min)"
+# Channels are looked up with the DSC export's column headings, so code written against the DataFrames keeps
+# working unchanged
+channel_names = {time_heading: "time", temp_heading: "temp", cp_heading: "cp"}
+
+
+class Channels():
+    # One contiguous float array per channel of a trace. Regions, fit windows and transition ranges are Spans,
+    # row ranges over these arrays, so cutting them never copies samples.
+    __slots__ = ("time", "temp", "cp")
+
+    def __init__(self, time=None, temp=None, cp=None):
+        self.time = None if time is None else np.ascontiguousarray(time, dtype=float)
+        self.temp = None if temp is None else np.ascontiguousarray(temp, dtype=float)
+        self.cp = None if cp is None else np.ascontiguousarray(cp, dtype=float)
+        lengths = {len(values) for values in (self.time, self.temp, self.cp) if values is not None}
+        if len(lengths) > 1:
+            raise ValueError("Channels must have the same length")
+
+    def __len__(self):
+        return next((len(values) for values in (self.time, self.temp, self.cp) if values is not None), 0)
+
+    def __getitem__(self, heading):
+        values = getattr(self, channel_names[heading])
+        if values is None:
+            raise KeyError(heading)
+        return values
+
+    def span(self, start, stop):
+        return Span(self, start, stop)
+
+    def nbytes(self):
+        return sum(values.nbytes for values in (self.time, self.temp, self.cp) if values is not None)
+
+
+class Span():
+    # Rows [start, stop) of a Channels, every channel read through it is a view of the full array
+    __slots__ = ("channels", "start", "stop")
+
+    def __init__(self, channels, start, stop):
+        self.channels = channels
+        self.start = min(max(int(start), 0), len(channels))
+        self.stop = min(max(int(stop), self.start), len(channels))
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, heading):
+        return self.channels[heading][self.start:self.stop]
+
+
+def frame_channels(frame, sample_mass=1.):
+    # Copies time, temperature and mass-normalised cp out of an imported DSC frame. The columns are copied even
+    # when they could be viewed, a view would keep the whole parsed body (every column of the export) alive.
+    columns = frame.columns
+    return Channels(np.array(frame[time_heading], dtype=float) if time_heading in columns else None,
+                    np.array(frame[temp_heading], dtype=float),
+                    frame[cp_heading].to_numpy(dtype=float) / sample_mass)
@@ -1,19 +1,24 @@
 import argparse
 import threading
 
-import matplotlib.pyplot as plt
-
+from cache import cache_from_args
+from lazy import lazy_import
 from model import DSCModel
+from render import NullPlot, TracePlot
+from store import default_store_path, store_from_args
+
+plt = lazy_import("matplotlib.pyplot")
 
 parser = argparse.ArgumentParser()
 
 parser.add_argument("-f", "--file", type=str, help="DSC file to parsed")
 parser.add_argument("-v", "--version", type=bool, help="Current Tgmon version")
-args = parser.parse_args()
-file = args.file
-print_version = args.version
-if print_version:
-    print("Version 20200421")
+parser.add_argument("--no-cache", help="Parse the DSC file without using the parsed-file cache", action="store_true")
+parser.add_argument("--rebuild-cache", help="Re-parse the DSC file and replace its cache entry", action="store_true")
+parser.add_argument("--store", nargs="?", const=default_store_path, default=None,
+                    help="Reuse and record fits in this SQLite fit store (default location without a path)")
+parser.add_argument("--no-plot", help="Only prompt on the console, matplotlib is never imported",
+                    action="store_true")
 
 temp_heading = "Temperature (°C)"
 cp_heading = "Heat Capacity (mJ/°C)"
@@ -22,23 +27,36 @@ modes = "Intial Region"
 
 
 class GTPMain():
-    def __init__(self):
+    def __init__(self, args):
 
-        self.model = DSCModel(file)
+        self.model = DSCModel(args.file, cache=cache_from_args(args.no_cache, args.rebuild_cache),
+                              store=store_from_args(args.store))
         self.model.guess_interest_region()
+        self.plotting = not args.no_plot
+        if not self.plotting:
+            self.plot = NullPlot()
+            self.run_model()
+            return
+        self.plot = TracePlot(plt.figure())
         self.query_thread = threading.Thread(target=self.run_model)
         self.query_thread.start()
         self.draw_intial_region()
         plt.show()
 
+    def redraw(self):
+        # console-only runs never import matplotlib, so there is nothing to draw
+        if self.plotting:
+            plt.draw()
+
     def draw_intial_region(self):
 
-        plt.clf()
-        plt.title("DSC data with initial guesses")
-        plt.plot(self.model.time_data, self.model.cp_data)
-        plt.plot(
+        self.plot.title("DSC data with initial guesses")
+        self.plot.trace("data", self.model.time_data, self.model.cp_data)
+        self.plot.markers(
+            "guesses",
             [self.model.time_data[self.model.region_start_index], self.model.time_data[self.model.region_end_index]],
-            [self.model.cp_data[self.model.region_start_index], self.model.cp_data[self.model.region_end_index]], "g^")
+            [self.model.cp_data[self.model.region_start_index], self.model.cp_data[self.model.region_end_index]])
+        self.plot.keep("data", "guesses")
 
     def run_model(self):
         self.query_initial_regions()
@@ -60,17 +78,22 @@ class GTPMain():
         if end != "":
             self.model.region_end_index = self.model.most_close_index(end, series=self.model.time_data)
         self.draw_intial_region()
-        plt.draw()
+        self.redraw()
         accept = input("Accept region Y/N?")
         if accept.upper() != "Y":
             self.query_initial_regions()
         else:
-            self.model.accept_interest_region()
-            plt.clf()
-            plt.title("Region of interest for " + self.model.imported.name)
-            plt.plot(self.model.temp_data, self.model.cp_data, label=self.model.imported.name)
-            plt.legend()
-            plt.draw()
+            try:
+                self.model.accept_interest_region()
+            except ValueError as error:
+                print(error)
+                self.query_initial_regions()
+                return
+            self.plot.title("Region of interest for " + self.model.imported.name)
+            self.plot.trace("data", self.model.temp_data, self.model.cp_data, label=self.model.imported.name)
+            self.plot.keep("data")
+            self.plot.legend()
+            self.redraw()
 
     def query_interpolations(self):
         print("Interpolation  defaults (leave blank to accept): ")
@@ -87,11 +110,12 @@ class GTPMain():
         if step_size != "":
             self.model.interpolation_step_size = float(step_size)
         self.model.interpolate()
-        plt.clf()
-        plt.title("Interpolated DSC Data")
-        plt.plot(self.model.interped[temp_heading], self.model.interped[cp_heading], label=self.model.imported.name)
-        plt.legend()
-        plt.draw()
+        self.plot.title("Interpolated DSC Data")
+        self.plot.trace("data", self.model.interped[temp_heading], self.model.interped[cp_heading],
+                        label=self.model.imported.name)
+        self.plot.keep("data")
+        self.plot.legend()
+        self.redraw()
         accept = input("Accept interpolation Y/N?")
         if accept.upper() != "Y":
             self.query_interpolations()
@@ -115,13 +139,12 @@ class GTPMain():
                             temp_heading])
 
     def query_linear_region(self):
-        plt.title("Select linear region")
-        plt.plot([self.model.interped[temp_heading][self.model.linear_start_index],
-                  self.model.interped[temp_heading][self.model.linear_end_index]],
-                 [self.model.interped[cp_heading][self.model.linear_start_index],
-                  self.model.interped[cp_heading][self.model.linear_end_index]], "g^", label="Linear region guesses")
-        plt.legend()
-        plt.draw()
+        self.plot.title("Select linear region")
+        self.draw_interped_markers("linear", self.model.linear_start_index, self.model.linear_end_index,
+                                   label="Linear region guesses")
+        self.plot.keep("data", "linear")
+        self.plot.legend()
+        self.redraw()
         print("Linear fit region guesses (leave blank to accept):")
         print("Start %5.2f (°C)" % self.model.interped[temp_heading][self.model.linear_start_index])
         print("End %5.2f (°C)" % self.model.interped[temp_heading][self.model.linear_end_index])
@@ -131,21 +154,16 @@ class GTPMain():
         end = self.handle_input("Linear fit end (°C)->", self.model.interped[temp_heading])
         if end != "":
             self.model.linear_end_index = self.model.most_close_index(end, series=self.model.interped[temp_heading])
-        plt.clf()
-        plt.plot([self.model.interped[temp_heading][self.model.linear_start_index],
-                  self.model.interped[temp_heading][self.model.linear_end_index]],
-                 [self.model.interped[cp_heading][self.model.linear_start_index],
-                  self.model.interped[cp_heading][self.model.linear_end_index]], "g^")
-        plt.plot(self.model.interped[temp_heading], self.model.interped[cp_heading])
-        plt.draw()
+        self.draw_interped_markers("linear", self.model.linear_start_index, self.model.linear_end_index)
+        self.redraw()
 
         print("Applying linear fit....")
         self.model.fit_linear_model()
         self.model.print_linear_fit()
-        plt.plot(self.model.interped[temp_heading], self.model.apply_lin_model(self.model.interped[temp_heading]),
-                 label="Linear Fit")
-        plt.legend()
-        plt.draw()
+        self.plot.trace("linear_fit", self.model.interped[temp_heading],
+                        self.model.apply_lin_model(self.model.interped[temp_heading]), label="Linear Fit")
+        self.plot.legend()
+        self.redraw()
         accept = input("Accept linear fit Y/N?")
         if accept.upper() != "Y":
             self.query_linear_region()
@@ -168,16 +186,14 @@ class GTPMain():
 
     def query_tg_region(self):
 
-        plt.clf()
-        plt.title("Select Glass Transition Region")
-        plt.plot(self.model.interped[temp_heading], self.model.interped[cp_heading], label=self.model.imported.name)
-
-        plt.plot([self.model.interped[temp_heading][self.model.tg_region_start],
-                  self.model.interped[temp_heading][self.model.tg_region_end]],
-                 [self.model.interped[cp_heading][self.model.tg_region_start],
-                  self.model.interped[cp_heading][self.model.tg_region_end]], "g^", label="TG Region Guesses")
-        plt.legend()
-        plt.draw()
+        self.plot.title("Select Glass Transition Region")
+        self.plot.trace("data", self.model.interped[temp_heading], self.model.interped[cp_heading],
+                        label=self.model.imported.name)
+        self.draw_interped_markers("tg", self.model.tg_region_start, self.model.tg_region_end,
+                                   label="TG Region Guesses")
+        self.plot.keep("data", "tg")
+        self.plot.legend()
+        self.redraw()
         print("Glass Transistion Region Guess  (leave blank to accept):")
         print("Start %5.2f (°C)" % self.model.interped[temp_heading][self.model.tg_region_start])
         print("End %5.2f (°C)" % self.model.interped[temp_heading][self.model.tg_region_end])
@@ -187,16 +203,27 @@ class GTPMain():
         end = self.handle_input("TG region end (°C)->", self.model.interped[temp_heading])
         if end != "":
             self.model.tg_region_end = self.model.most_close_index(end, series=self.model.interped[temp_heading])
-        plt.clf()
-        plt.plot([self.model.interped[temp_heading][self.model.tg_region_start],
-                  self.model.interped[temp_heading][self.model.tg_region_end]],
-                 [self.model.interped[cp_heading][self.model.tg_region_start],
-                  self.model.interped[cp_heading][self.model.tg_region_end]], "g^")
-        plt.plot(self.model.interped[temp_heading], self.model.interped[cp_heading])
-        plt.draw()
+        self.draw_interped_markers("tg", self.model.tg_region_start, self.model.tg_region_end)
+        self.redraw()
+        guess = self.model.guess_fit_parameters()
+        print("Automatic guesses from %d grid combinations, error %5.5f" % (guess.combinations, guess.fun))
         self.query_fit_guesses()
-        self.model.fit_tg_model()
+        if self.model.multistart > 1:
+            self.model.fit_tg_model_multistart(starts=self.model.multistart)
+        else:
+            self.model.fit_tg_model()
         self.model.print_tg_model()
+        self.model.print_tg_statistics()
+        if self.plotting:
+            self.draw_tg_model()
+        accept = input("Accept glass transition calculations Y/N?")
+
+        if accept.upper() != "Y":
+            self.query_tg_region()
+        else:
+            quit()
+
+    def draw_tg_model(self):
         plt.clf()
         plt.title("Predicted Glass Transition for " + self.model.imported.name)
         model = self.model.apply_model(self.model.gaus_model.x)
@@ -210,18 +237,18 @@ class GTPMain():
         plt.plot(self.model.transistion_range[temp_heading], model[2], label="Cauchy Model")
         plt.legend()
         plt.draw()
-        accept = input("Accept glass transition calculations Y/N?")
 
-        if accept.upper() != "Y":
-            self.query_tg_region()
-        else:
-            quit()
+    def draw_interped_markers(self, name, start, end, **kwargs):
+        self.plot.markers(name, [self.model.interped[temp_heading][start], self.model.interped[temp_heading][end]],
+                          [self.model.interped[cp_heading][start], self.model.interped[cp_heading][end]], **kwargs)
 
     def query_fit_guesses(self):
         print("Enter Enthalpy and Glass Tansistion Guesses (leave blank to accept default)")
         print("Entahlpy guess %5.4f" % self.model.enthalpy_guess)
         print("Tg guess %5.4f" % self.model.tg_guess)
         print("Ratio between enthalpy models guess %1.2f" % self.model.ratio)
+        print("Width %5.4f, Stp %5.4f, Enthalpy width %5.4f, Max %5.4f" % (
+            self.model.width_guess, self.model.stp_guess, self.model.width_2_guess, self.model.max_guess))
         print("Between 1 and -1. 1 = 100% Guassian; -1 = 100% Cauchy; .0 == 50%-%50 split")
         try:
             e_guess = input("Enthalpy guess ->")
@@ -233,8 +260,11 @@ class GTPMain():
             ratio_guess = input("Ratio guess->")
             if ratio_guess != "":
                 self.model.ratio = float(ratio_guess)
+            starts = input("Number of multi-start fits (currently %d)->" % self.model.multistart)
+            if starts != "":
+                self.model.multistart = int(starts)
         except ValueError:
-            print("Enter valid floating point entry")
+            print("Enter valid numeric entry")
             self.query_fit_guesses()
 
     def handle_input(self, prompt, series=None):
@@ -252,4 +282,8 @@ class GTPMain():
         return ans
 
 
-app = GTPMain()
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.version:
+        print("Version 20200421")
+    app = GTPMain(args)
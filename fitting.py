@@ -0,0 +1,432 @@
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from lazy import lazy_import
+
+optimize = lazy_import("scipy.optimize")
+qmc = lazy_import("scipy.stats.qmc")
+
+magic_number = 17.72432
+parameter_names = ["t_g", "width", "stp", "enthalpy", "width_2", "max", "ratio"]
+# widths stay positive and the ratio stays between 100% Cauchy and 100% Gaussian
+default_tg_bounds = ([-np.inf, 1e-6, -np.inf, -np.inf, 1e-6, -np.inf, -1],
+                     [np.inf, np.inf, np.inf, np.inf, np.inf, np.inf, 1])
+em_squared = -math.log(.5)
+# half widths of the box multi-start points are drawn from around the guesses
+default_start_spread = [15, 5, 2, 15, 10, 2, 1]
+# bytes of chunk intermediates evaluate_batch works within when no chunk size is given
+batch_bytes = 32 * 1024 * 1024
+# the fixed starting point fits used before initial_guesses, still used when no guess search is run
+fixed_guesses = [45, 1, 1, 45, 1, 1, 0]
+default_guess_ratios = (-.8, -.4, 0, .4, .8)
+
+
+class FitCancelled(Exception):
+    pass
+
+
+class ModelWorkspace():
+    # Contiguous copies of one transition region plus scratch buffers, so that evaluating the model, the residuals
+    # or the Jacobian for a new parameter vector only writes into arrays allocated here.
+    def __init__(self, temps, observed, baseline, magic_number=magic_number):
+        self.temps = np.ascontiguousarray(temps, dtype=float)
+        self.observed = np.ascontiguousarray(observed, dtype=float)
+        self.baseline = np.ascontiguousarray(baseline, dtype=float)
+        self.magic_number = magic_number
+        n = len(self.temps)
+        if not (len(self.observed) == len(self.baseline) == n):
+            raise ValueError("temps, observed and baseline must have the same length")
+        self.size = n
+        self.z = np.empty(n)
+        self.gaus = np.empty(n)
+        self.inverse_reversed = np.zeros(n)
+        # inverse[i] = sum(gaus[i:-1]) is filled through its reversed view
+        self.inverse = self.inverse_reversed[::-1]
+        self.u = np.empty(n)
+        self.below = np.empty(n, dtype=bool)
+        self.enthalpy_distro = np.empty(n)
+        self.enthalpy_distro_2 = np.empty(n)
+        self.combined = np.empty(n)
+        self.model = np.empty(n)
+        self.residual = np.empty(n)
+        self.scratch = np.empty(n)
+        self.jacobian_buffer = np.empty((n, 7), order="F")
+        self.evaluations = 0
+        self.jacobian_evaluations = 0
+
+    def evaluate(self, guesses):
+        # Fills self.model, self.enthalpy_distro and self.enthalpy_distro_2, returns self.model
+        t_g, width, stp, enthalpy, width_2, max, ratio = guesses
+        self.evaluations += 1
+        z, gaus, u = self.z, self.gaus, self.u
+        np.subtract(self.temps, t_g, out=z)
+        z /= width
+        np.square(z, out=gaus)
+        np.negative(gaus, out=gaus)
+        np.exp(gaus, out=gaus)
+        gaus *= stp / (self.magic_number * width)
+        if self.size > 1:
+            np.cumsum(gaus[-2::-1], out=self.inverse_reversed[1:])
+
+        np.subtract(self.temps, enthalpy, out=u)
+        u /= width_2
+        np.less(self.temps, enthalpy, out=self.below)
+        np.square(u, out=self.scratch)
+        np.multiply(self.scratch, -em_squared, out=self.enthalpy_distro)
+        np.exp(self.enthalpy_distro, out=self.enthalpy_distro)
+        self.enthalpy_distro *= max
+        self.scratch += 1
+        np.divide(max, self.scratch, out=self.enthalpy_distro_2)
+
+        np.multiply(self.enthalpy_distro, 1 + ratio, out=self.combined)
+        np.multiply(self.enthalpy_distro_2, 1 - ratio, out=self.scratch)
+        np.copyto(self.combined, self.scratch, where=self.below)
+        np.subtract(self.baseline, self.inverse, out=self.model)
+        self.model += self.combined
+        return self.model
+
+    def evaluate_batch(self, parameters, chunk_rows=None, return_models=True):
+        # Evaluates every row of an (N x 7) parameter matrix at once. Returns the (N x T) model curves (None when
+        # return_models is False) and each row's error against observed, sqrt(sum(residual ** 2)) as error() gives
+        # it. The rows are broadcast chunk_rows at a time through chunk buffers that are reused, so the intermediates
+        # stay within batch_bytes. Each curve and error is bit-identical to evaluate() and error() for the same row.
+        parameters = np.atleast_2d(np.asarray(parameters, dtype=float))
+        if parameters.ndim != 2 or parameters.shape[1] != 7:
+            raise ValueError("parameters must be an (N x 7) matrix")
+        count, n = len(parameters), self.size
+        if chunk_rows is None:
+            chunk_rows = batch_bytes // (8 * 4 * n) if n else count
+        rows = min(chunk_rows, count) or 1
+        z, gaus, scratch = np.empty((rows, n)), np.empty((rows, n)), np.empty((rows, n))
+        below = np.empty((rows, n), dtype=bool)
+        models = np.empty((count, n)) if return_models else None
+        model_buffer = None if return_models else np.empty((rows, n))
+        errors = np.empty(count)
+        for start in range(0, count, rows):
+            chunk = parameters[start:start + rows]
+            k = len(chunk)
+            t_g, width, stp, enthalpy, width_2, max, ratio = (chunk[:, i, None] for i in range(0, 7))
+            z_k, gaus_k, scratch_k, below_k = z[:k], gaus[:k], scratch[:k], below[:k]
+            model = models[start:start + k] if return_models else model_buffer[:k]
+
+            np.subtract(self.temps, t_g, out=z_k)
+            z_k /= width
+            np.square(z_k, out=gaus_k)
+            np.negative(gaus_k, out=gaus_k)
+            np.exp(gaus_k, out=gaus_k)
+            gaus_k *= stp / (self.magic_number * width)
+            # model starts as the inverse cumulative Gaussian, sum(gaus[i:-1]) per row
+            model[:, -1] = 0
+            if n > 1:
+                np.cumsum(gaus_k[:, -2::-1], axis=1, out=model[:, -2::-1])
+            np.subtract(self.baseline, model, out=model)
+
+            np.subtract(self.temps, enthalpy, out=z_k)
+            z_k /= width_2
+            np.less(self.temps, enthalpy, out=below_k)
+            np.square(z_k, out=scratch_k)
+            np.multiply(scratch_k, -em_squared, out=gaus_k)
+            np.exp(gaus_k, out=gaus_k)
+            gaus_k *= max
+            gaus_k *= 1 + ratio
+            scratch_k += 1
+            np.divide(max, scratch_k, out=scratch_k)
+            scratch_k *= 1 - ratio
+            np.copyto(gaus_k, scratch_k, where=below_k)
+            model += gaus_k
+
+            np.subtract(model, self.observed, out=gaus_k)
+            # one dot product per row, summed in the same order as error() so batch and single errors can be ranked
+            for i in range(0, k):
+                errors[start + i] = math.sqrt(np.dot(gaus_k[i], gaus_k[i]))
+        self.evaluations += count
+        return models, errors
+
+    def __reduce__(self):
+        # inverse is a view of inverse_reversed, so workspaces are rebuilt rather than pickled buffer by buffer
+        return (ModelWorkspace, (self.temps, self.observed, self.baseline, self.magic_number))
+
+    def copy(self):
+        # Workspaces are not shared between threads, each concurrent fit gets its own buffers
+        return ModelWorkspace(self.temps, self.observed, self.baseline, self.magic_number)
+
+    def residuals(self, guesses):
+        np.subtract(self.evaluate(guesses), self.observed, out=self.residual)
+        return self.residual
+
+    def error(self, guesses):
+        residual = self.residuals(guesses)
+        return math.sqrt(np.dot(residual, residual))
+
+    def jacobian(self, guesses):
+        # Partial derivatives of the residuals with respect to t_g, width, stp, enthalpy, width_2, max and ratio.
+        # The switch between the Cauchy and Gaussian enthalpy terms at T = enthalpy is treated as fixed.
+        t_g, width, stp, enthalpy, width_2, max, ratio = guesses
+        self.jacobian_evaluations += 1
+        jacobian = self.jacobian_buffer
+        z, u, below, scratch = self.z, self.u, self.below, self.scratch
+        d_tg, d_width, d_stp, d_enthalpy, d_width_2, d_max, d_ratio = (jacobian[:, i] for i in range(0, 7))
+
+        np.subtract(self.temps, t_g, out=z)
+        z /= width
+        np.square(z, out=scratch)
+        np.negative(scratch, out=d_stp)
+        np.exp(d_stp, out=d_stp)
+        d_stp /= self.magic_number * width
+        np.multiply(d_stp, stp, out=d_width)
+        np.multiply(d_width, z, out=d_tg)
+        d_tg *= 2 / width
+        scratch *= 2
+        scratch -= 1
+        d_width *= scratch
+        d_width /= width
+        # the model subtracts the inverse cumulative sum of the Gaussian, and its derivative is the same sum of the
+        # Gaussian's derivatives
+        for column in (d_tg, d_width, d_stp):
+            if self.size > 1:
+                np.cumsum(column[-2::-1], out=scratch[1:])
+                np.negative(scratch[:0:-1], out=column[:-1])
+            column[-1] = 0
+
+        np.subtract(self.temps, enthalpy, out=u)
+        u /= width_2
+        np.less(self.temps, enthalpy, out=below)
+        # d_max holds the Gaussian shape and d_ratio the Lorentzian shape until they are combined below
+        np.square(u, out=scratch)
+        np.multiply(scratch, -em_squared, out=d_max)
+        np.exp(d_max, out=d_max)
+        scratch += 1
+        np.divide(1, scratch, out=d_ratio)
+        # d(model)/du for the Gaussian term, then for the Cauchy term where T < enthalpy
+        np.multiply(d_max, u, out=d_enthalpy)
+        d_enthalpy *= -2 * em_squared * max * (1 + ratio)
+        np.multiply(d_ratio, d_ratio, out=scratch)
+        scratch *= u
+        scratch *= -2 * max * (1 - ratio)
+        np.copyto(d_enthalpy, scratch, where=below)
+        np.multiply(d_enthalpy, u, out=d_width_2)
+        d_width_2 /= -width_2
+        d_enthalpy /= -width_2
+        np.multiply(d_ratio, -max, out=self.combined)
+        np.multiply(d_ratio, 1 - ratio, out=scratch)
+        np.multiply(d_max, max, out=d_ratio)
+        np.copyto(d_ratio, self.combined, where=below)
+        d_max *= 1 + ratio
+        np.copyto(d_max, scratch, where=below)
+        return jacobian
+
+
+def clip_to_bounds(guesses, bounds):
+    lower, upper = np.asarray(bounds[0], dtype=float), np.asarray(bounds[1], dtype=float)
+    # least_squares needs a strictly feasible start
+    span = np.where(np.isfinite(upper - lower), (upper - lower) * 1e-6, 1e-6)
+    return np.clip(np.asarray(guesses, dtype=float), lower + span, upper - span)
+
+
+def fit_tg_least_squares(workspace, guesses, bounds=default_tg_bounds, method="trf", callback=None, **options):
+    # Returns an OptimizeResult with x, fun (the sqrt(sum(residual ** 2)) error used by fit_tg_model),
+    # residuals, nfev, njev and wall_time.
+    # least_squares keeps the previous residuals and Jacobian while it tries a step, so it is handed copies of
+    # the workspace buffers.
+    def residuals(guesses):
+        if callback is not None:
+            callback(guesses)
+        return workspace.residuals(guesses).copy()
+
+    def jacobian(guesses):
+        return workspace.jacobian(guesses).copy()
+
+    if method == "lm":
+        bounds = (-np.inf, np.inf)
+    else:
+        guesses = clip_to_bounds(guesses, bounds)
+    start = time.perf_counter()
+    fit = optimize.least_squares(residuals, guesses, jac=jacobian, bounds=bounds, method=method, **options)
+    wall_time = time.perf_counter() - start
+    return optimize.OptimizeResult(x=fit.x, fun=float(np.sqrt(np.sum(fit.fun * fit.fun))), residuals=fit.fun,
+                                   nfev=fit.nfev, njev=fit.njev if fit.njev is not None else 0, nit=fit.nfev,
+                                   status=fit.status, success=fit.success, message=fit.message,
+                                   wall_time=wall_time, method=method)
+
+
+def fit_tg_minimize(workspace, guesses, callback=None, **options):
+    # The original scalar fit: BFGS on sqrt(sum(residual ** 2)) with finite-difference gradients
+    start = time.perf_counter()
+    fit = optimize.minimize(workspace.error, guesses, callback=callback, **options)
+    fit.wall_time = time.perf_counter() - start
+    fit.njev = fit.get("njev", 0)
+    fit.method = "minimize"
+    return fit
+
+
+def fit_statistics(fit):
+    return {"method": fit.method, "error": float(fit.fun), "nfev": int(fit.nfev), "njev": int(fit.njev),
+            "wall_s": fit.wall_time, "success": bool(fit.success)}
+
+
+def derivative_seeds(temps, residual, smooth_points=None):
+    # t_g at the steepest rise of the smoothed residual, the width from the half maximum of that rise, and the
+    # enthalpy peak at the highest residual between the rise and the steepest fall after it
+    n = len(temps)
+    smooth_points = smooth_points or max(3, (n // 25) | 1)
+    smoothed = residual
+    if n > 2 * smooth_points:
+        smoothed = np.convolve(residual, np.ones(smooth_points) / smooth_points, mode="same")
+    derivative = np.gradient(smoothed, temps)
+    # the moving average is biased where its window runs off the ends
+    edge = smooth_points // 2 if n > 2 * smooth_points else 0
+    inner = slice(edge, n - edge)
+    rise = edge + int(np.argmax(derivative[inner]))
+    fall = rise + int(np.argmin(derivative[rise:n - edge]))
+    peak = rise + int(np.argmax(smoothed[rise:fall + 1]))
+    half = derivative[rise] / 2
+    below_left = np.flatnonzero(derivative[:rise] < half)
+    below_right = np.flatnonzero(derivative[rise:] < half)
+    left = temps[below_left[-1]] if len(below_left) else temps[0]
+    right = temps[rise + below_right[0]] if len(below_right) else temps[-1]
+    # the step's derivative is exp(-((T - t_g) / width) ** 2), whose half width at half maximum is width * sqrt(ln 2)
+    width = (right - left) / (2 * math.sqrt(em_squared))
+    return temps[rise], width, temps[peak]
+
+
+def initial_guesses(workspace, grid_points=25, widths=6, ratios=default_guess_ratios):
+    # Seeds all seven parameters for a fit over the workspace's transition range. The model is linear in stp and
+    # max: it is the baseline plus stp times a step curve that depends on (t_g, width) and max times a peak curve
+    # that depends on (enthalpy, width_2, ratio). The step and peak curves of a grid over those parameters, with
+    # the derivative seeds added to it, are evaluated with evaluate_batch and every step/peak pair is solved for
+    # its best stp and max at once. Returns an OptimizeResult with x, fun (the same error fit_tg_model reports),
+    # the number of grid combinations and wall_time.
+    start = time.perf_counter()
+    temps, n = workspace.temps, workspace.size
+    if n < 4:
+        raise ValueError("At least four points are needed to guess the fit parameters")
+    residual = workspace.observed - workspace.baseline
+    span = temps[-1] - temps[0]
+    spacing = span / (n - 1)
+    tg_seed, width_seed, enthalpy_seed = derivative_seeds(temps, residual)
+    centres = np.linspace(temps[0], temps[-1], grid_points)
+    width_grid = np.geomspace(2 * spacing, span / 3, widths)
+    width_grid = np.unique(np.append(width_grid, np.clip(width_seed, width_grid[0], width_grid[-1])))
+
+    # step curves, model - baseline for stp = 1 and max = 0
+    t_g, width = (axis.ravel() for axis in np.meshgrid(np.append(centres, tg_seed), width_grid, indexing="ij"))
+    step_rows = np.column_stack((t_g, width, np.ones(len(t_g)), np.full(len(t_g), temps[0]), np.ones(len(t_g)),
+                                 np.zeros(len(t_g)), np.zeros(len(t_g))))
+    steps = workspace.evaluate_batch(step_rows)[0]
+    steps -= workspace.baseline
+    # peak curves, model - baseline for stp = 0 and max = 1
+    enthalpy, width_2, ratio = (axis.ravel() for axis in np.meshgrid(np.append(centres, enthalpy_seed), width_grid,
+                                                                      np.asarray(ratios, dtype=float), indexing="ij"))
+    peak_rows = np.column_stack((np.full(len(enthalpy), temps[0]), np.ones(len(enthalpy)), np.zeros(len(enthalpy)),
+                                 enthalpy, width_2, np.ones(len(enthalpy)), ratio))
+    peaks = workspace.evaluate_batch(peak_rows)[0]
+    peaks -= workspace.baseline
+
+    # normal equations of min |residual - stp * step - max * peak| for every step/peak pair
+    ss = np.einsum("ij,ij->i", steps, steps)[:, None]
+    pp = np.einsum("ij,ij->i", peaks, peaks)[None, :]
+    sp = steps @ peaks.T
+    sr = (steps @ residual)[:, None]
+    pr = (peaks @ residual)[None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        determinant = ss * pp - sp * sp
+        stp = (sr * pp - pr * sp) / determinant
+        max = (ss * pr - sp * sr) / determinant
+        sse = (np.dot(residual, residual) - 2 * (stp * sr + max * pr) + stp * stp * ss + 2 * stp * max * sp +
+               max * max * pp)
+    sse[~(determinant > 1e-12 * ss * pp) | ~np.isfinite(sse)] = np.inf
+    best_step, best_peak = np.unravel_index(np.argmin(sse), sse.shape)
+    guesses = np.array([t_g[best_step], width[best_step], stp[best_step, best_peak], enthalpy[best_peak],
+                        width_2[best_peak], max[best_step, best_peak], ratio[best_peak]])
+    if not np.isfinite(sse[best_step, best_peak]):
+        guesses = np.array([tg_seed, width_seed, 1, enthalpy_seed, width_seed, 1, 0], dtype=float)
+    return optimize.OptimizeResult(x=guesses, fun=workspace.error(guesses), combinations=sse.size,
+                                   seeds=np.array([tg_seed, width_seed, enthalpy_seed]),
+                                   wall_time=time.perf_counter() - start)
+
+
+def start_points(guesses, count, spread=default_start_spread, bounds=default_tg_bounds, seed=None):
+    # Latin hypercube sample of the box guesses +- spread, clipped into bounds. The guesses are the first point.
+    guesses = np.asarray(guesses, dtype=float)
+    spread = np.asarray(spread, dtype=float)
+    points = np.empty((count, len(guesses)))
+    points[0] = guesses
+    if count > 1:
+        sample = qmc.LatinHypercube(d=len(guesses), seed=seed).random(count - 1)
+        points[1:] = qmc.scale(sample, guesses - spread, guesses + spread)
+    return np.array([clip_to_bounds(point, bounds) for point in points])
+
+
+def fit_start(workspace, guesses, method="trf", bounds=default_tg_bounds, stop=None, **options):
+    def cancel_if_stopped(guesses):
+        if stop.is_set():
+            raise FitCancelled()
+
+    callback = cancel_if_stopped if stop is not None else None
+    try:
+        if method == "minimize":
+            return fit_tg_minimize(workspace, guesses, callback=callback, **options)
+        return fit_tg_least_squares(workspace, guesses, bounds=bounds, method=method, callback=callback, **options)
+    except FitCancelled:
+        return None
+
+
+def fit_tg_multistart(workspace, guesses, starts=16, workers=None, target_error=None, method="trf",
+                      bounds=default_tg_bounds, spread=default_start_spread, executor="thread", seed=None,
+                      **options):
+    # Runs a local fit from every start point concurrently and returns the best OptimizeResult, extended with
+    # the start points, every converged solution and error, and the spread of the solutions. Once a fit reaches
+    # target_error the remaining starts are cancelled.
+    points = start_points(guesses, starts, spread=spread, bounds=bounds, seed=seed)
+    start = time.perf_counter()
+    fits = []
+    failed = 0
+    stopped_early = False
+    if executor == "thread":
+        pool = ThreadPoolExecutor(max_workers=workers)
+        stop = threading.Event()
+    elif executor == "process":
+        pool = ProcessPoolExecutor(max_workers=workers)
+        stop = None
+    else:
+        raise ValueError("executor must be 'thread' or 'process'")
+    with pool:
+        pending = {pool.submit(fit_start, workspace.copy() if stop is not None else workspace, point, method,
+                               bounds, stop, **options) for point in points}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.cancelled():
+                    continue
+                if future.exception() is not None:
+                    failed += 1
+                    continue
+                if future.result() is None:
+                    continue
+                fits.append(future.result())
+                if target_error is not None and fits[-1].fun <= target_error and not stopped_early:
+                    stopped_early = True
+                    if stop is not None:
+                        stop.set()
+                    for other in pending:
+                        other.cancel()
+    if not fits:
+        raise RuntimeError("No multi-start fit completed")
+    best = min(fits, key=lambda fit: fit.fun if np.isfinite(fit.fun) else np.inf)
+    solutions = np.array([fit.x for fit in fits])
+    best.starts = points
+    best.solutions = solutions
+    best.errors = np.array([fit.fun for fit in fits])
+    best.spread = np.std(solutions, axis=0)
+    best.completed = len(fits)
+    best.failed = failed
+    best.stopped_early = stopped_early
+    best.nfev = sum(int(fit.nfev) for fit in fits)
+    best.njev = sum(int(fit.njev) for fit in fits)
+    best.wall_time = time.perf_counter() - start
+    best.method = "multistart-" + best.method
+    return best
@@ -0,0 +1,197 @@
+import contextlib
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+import baseline
+import fitting
+import processing
+from model import DSCModel
+
+# Opt-in instrumentation. enable() swaps the functions listed below for timing wrappers and disable() puts the
+# originals back, so nothing is wrapped, and nothing costs anything, while it is off.
+function_targets = [
+    (processing, ["import_dsc_data", "import_dsc_data_window", "read_dsc_header", "read_dsc_body",
+                  "stream_dsc_body", "import_dsc_data_legacy", "select_between_range", "prepare_temp_axis",
+                  "resample_temp_cp", "interp_temp_cp",
+                  "evaluate_tg_model", "evaluate_tg_model_reference", "inverse_cumulative_gaussian",
+                  "smoothed_first_deriv", "segment_signs", "bin_first_deriv", "bin_first_deriv_legacy",
+                  "split_temperature_segments", "suggest_overall_interest_regions", "suggest_linear_region",
+                  "suggest_tg_region"]),
+    (baseline, ["fit_baseline", "fit_baseline_robust", "fit_baselines"]),
+    (fitting, ["initial_guesses", "fit_tg_least_squares", "fit_tg_minimize", "fit_tg_multistart"]),
+]
+method_targets = [
+    (DSCModel, ["guess_interest_region", "accept_interest_region", "split_cycles", "interpolate", "guess_linear_region",
+                "guess_tg_region", "fit_linear_model", "prepare_tg_fit", "guess_fit_parameters", "fit_tg_model",
+                "fit_tg_model_multistart"]),
+]
+# objective evaluations are counted, and residual evaluations also append to the convergence history. error
+# computes its value through residuals, so it is not tracked itself or every error call would be recorded twice.
+# evaluate_batch is also counted per parameter set, as ModelWorkspace.evaluate_batch.rows.
+objective_targets = ["evaluate", "evaluate_batch", "residuals", "error", "jacobian"]
+
+enabled = False
+lock = threading.Lock()
+originals = {}
+events = []
+counters = {}
+history = {}
+clock_start = time.perf_counter()
+
+
+def reset():
+    global clock_start
+    with lock:
+        del events[:]
+        counters.clear()
+        history.clear()
+        clock_start = time.perf_counter()
+
+
+def count(name, amount=1):
+    if enabled:
+        with lock:
+            counters[name] = counters.get(name, 0) + amount
+
+
+def record(name, category, start, end):
+    with lock:
+        events.append((name, category, start, end, threading.get_ident()))
+        counters[name] = counters.get(name, 0) + 1
+
+
+def timed(name, category, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(name, category, start, time.perf_counter())
+    return wrapper
+
+
+def counted(name, function, track_error=False):
+    @functools.wraps(function)
+    def wrapper(workspace, *args, **kwargs):
+        result = function(workspace, *args, **kwargs)
+        count(name)
+        if name.endswith(".evaluate_batch"):
+            count(name + ".rows", len(result[1]))
+        if track_error:
+            with lock:
+                error = math.sqrt(float(result.dot(result)))
+                history.setdefault(id(workspace), []).append((time.perf_counter() - clock_start, error))
+        return result
+    return wrapper
+
+
+def enable():
+    global enabled
+    if enabled:
+        return
+    for module, names in function_targets:
+        for name in names:
+            function = getattr(module, name)
+            originals[(module, name)] = function
+            setattr(module, name, timed(module.__name__ + "." + name, module.__name__, function))
+    for owner, names in method_targets:
+        for name in names:
+            function = owner.__dict__[name]
+            originals[(owner, name)] = function
+            setattr(owner, name, timed(owner.__name__ + "." + name, "stage", function))
+    for name in objective_targets:
+        function = fitting.ModelWorkspace.__dict__[name]
+        originals[(fitting.ModelWorkspace, name)] = function
+        setattr(fitting.ModelWorkspace, name, counted("ModelWorkspace." + name, function,
+                                                      track_error=name == "residuals"))
+    enabled = True
+
+
+def disable():
+    global enabled
+    for (owner, name), function in originals.items():
+        setattr(owner, name, function)
+    originals.clear()
+    enabled = False
+
+
+@contextlib.contextmanager
+def instrumented(clear=True):
+    if clear:
+        reset()
+    enable()
+    try:
+        yield
+    finally:
+        disable()
+
+
+@contextlib.contextmanager
+def stage(name):
+    # Times a block of user code as its own stage, does nothing but the check while instrumentation is off
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, "stage", start, time.perf_counter())
+
+
+def summary():
+    with lock:
+        timings = {}
+        for name, category, start, end, thread in events:
+            timing = timings.setdefault(name, {"category": category, "calls": 0, "total_s": 0., "max_s": 0.})
+            timing["calls"] += 1
+            timing["total_s"] += end - start
+            timing["max_s"] = max(timing["max_s"], end - start)
+        convergence = [{"workspace": index, "evaluations": len(errors), "final_error": errors[-1][1],
+                        "best_error": min(error for t, error in errors),
+                        "history": [{"t_s": t, "error": error} for t, error in errors]}
+                       for index, errors in enumerate(history.values())]
+        return {"counters": dict(counters), "timings": timings, "convergence": convergence}
+
+
+def chrome_trace():
+    # Complete ("X") events in microseconds, loadable in chrome://tracing or Perfetto
+    with lock:
+        trace = [{"name": name, "cat": category, "ph": "X", "ts": (start - clock_start) * 1e6,
+                  "dur": (end - start) * 1e6, "pid": os.getpid(), "tid": thread}
+                 for name, category, start, end, thread in events]
+        for errors in history.values():
+            trace.extend({"name": "objective error", "ph": "C", "ts": t * 1e6, "pid": os.getpid(),
+                          "args": {"error": error}} for t, error in errors)
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+@contextlib.contextmanager
+def exporting(profile=None, trace=None):
+    # Instruments the block when either output is asked for and writes the outputs when it ends
+    if profile is None and trace is None:
+        yield
+        return
+    try:
+        with instrumented():
+            yield
+    finally:
+        if profile is not None:
+            export_json(profile)
+        if trace is not None:
+            export_chrome_trace(trace)
+
+
+def export_json(path):
+    with open(path, "w", encoding="utf-8") as export:
+        json.dump(summary(), export, indent=2)
+
+
+def export_chrome_trace(path):
+    with open(path, "w", encoding="utf-8") as export:
+        json.dump(chrome_trace(), export)
@@ -0,0 +1,34 @@
+import importlib
+import sys
+
+# Heavy dependencies (pandas, scipy, matplotlib) are bound through lazy_import so a module can name them at the
+# top as usual while they are only imported when a stage first uses them.
+
+
+class LazyModule():
+    # Stands in for a module until its first attribute is looked up, then imports it. Later lookups go through
+    # sys.modules, so the proxy costs one dictionary lookup per attribute once the module is loaded.
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+
+    def __getattr__(self, attribute):
+        name = self.__dict__["_name"]
+        module = sys.modules.get(name)
+        if module is None:
+            module = importlib.import_module(name)
+        return getattr(module, attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(importlib.import_module(self._name), attribute, value)
+
+    def __repr__(self):
+        return "<lazy module %r%s>" % (self._name, " (loaded)" if self._name in sys.modules else "")
+
+
+def lazy_import(name):
+    # The module itself when something already imported it, a LazyModule otherwise
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def loaded(*names):
+    return [name for name in names if name in sys.modules]
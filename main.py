@@ -1,16 +1,22 @@
 import argparse
-from processing import *
-import matplotlib.pyplot as plt
-from scipy.optimize import minimize
-import math
+import os
+
+import instrument
+import pipeline
+from store import default_store_path
 
 parser = argparse.ArgumentParser()
 
 parser.add_argument("-f", "--file", type=str, help="DSC file to parsed")
-parser.add_argument("-start", type=float, help="Temp at start of region of interest")
-parser.add_argument("-end", type=float, help="Temp at end of region of interest")
-parser.add_argument("-tg", "--tg_guess", type=float, help="DSC file to parsed")
-parser.add_argument("-eg", "--enthalpy_guess", type=float, help="Time at start of region of interest")
+parser.add_argument("-c", "--config", type=str, help="Run config (.json, .toml, .yaml) instead of the flags below")
+parser.add_argument("-start", type=float, help="Time at start of region of interest")
+parser.add_argument("-end", type=float, help="Time at end of region of interest")
+parser.add_argument("--stream", help="Apply the time range while parsing instead of after loading the whole file",
+                    action="store_true")
+parser.add_argument("-tg", "--tg_guess", type=float, help="Glass transition temperature guess")
+parser.add_argument("-eg", "--enthalpy_guess", type=float, help="Enthalpy peak temperature guess")
+parser.add_argument("-ag", "--auto_guess", help="Search for all seven Tg fit guesses instead of using -tg/-eg",
+                    action="store_true")
 parser.add_argument("-is", "--interloplation_start", type=float, help="Temperature at start of interpolation region")
 parser.add_argument("-ss", "--step_size", type=float, help="Interpolation step size")
 parser.add_argument("-s", "--steps", type=int, help="Number of data points to interpolate")
@@ -18,101 +24,66 @@ parser.add_argument("-fs", "--fit_start", type=float, help="Start of linear regi
 parser.add_argument("-fe", "--fit_end", type=float, help="End of linear region to fit")
 parser.add_argument("-ts", "--tg_start_region", type=float, help="Start of tg region to be modeled")
 parser.add_argument("-te", "--tg_end_region", type=float, help="End of tg region to be modeled")
+parser.add_argument("-rb", "--robust_baseline", help="Fit the linear region with robust reweighting",
+                    action="store_true")
+parser.add_argument("-m", "--method", choices=["trf", "dogbox", "lm", "minimize"], default="trf",
+                    help="Tg fitting method")
 parser.add_argument("-v", "--verbose", help="Turn on verbose mode", action="store_true")
-args = parser.parse_args()
-
-data_file = args.file
-start_temp = args.start
-end_temp = args.end
-interloplation_start = args.interloplation_start
-steps = args.steps
-step_size = args.step_size
-tg_guess = args.tg_guess
-enthalpy_guess = args.enthalpy_guess
-fit_start = args.fit_start
-fit_end = args.fit_end
-tg_start_region = args.tg_start_region
-tg_end_region = args.tg_end_region
-verbose = args.verbose
-
-temp_heading = "Temperature (°C)"
-cp_heading = "Heat Capacity (mJ/°C)"
-time_heading = "Time (min)"
-
-dsc_data = import_dsc_data(data_file)
-
-# Filter out relevant region and data
-
-data = select_between_range(dsc_data.data_frame, start_temp, end_temp, time_heading, verbose=verbose)[
-    [temp_heading, cp_heading]]
-# Correct for mass
-data[cp_heading] = data[cp_heading].divide(dsc_data.sample_mass)
-# Interpolate the cp values for a temp with an ordered step size
-
-interp_data = interp_temp_cp(data, interloplation_start, step_size, steps, verbose=verbose)
-# Fit a linear curve to the interpolated heat capacity
-fit_range_interp_data = select_between_range(interp_data, fit_start, fit_end, temp_heading,
-                                             verbose=verbose)  # range of data to fit the curve
-
-
-# mb is a array of [ m ,b ] of y = m * x + b. These the values that will be minimized against to fit a curve
-def objective_function(mb):
-    return math.sqrt(
-        ((mb[0] * fit_range_interp_data[temp_heading] + mb[1]) - fit_range_interp_data[cp_heading]).pow(2).sum())
-
-
-guesses = np.array([1, 1], dtype=float)
-if verbose:
-    print("Fitting c_p =m*temp + b from %5.2f to %5.2f..." % (fit_start, fit_end))
-lin_model = minimize(objective_function, guesses)
-if verbose:
-    print("m:%5.6f b:%5.2f" % (lin_model.x[0], lin_model.x[1]))
-# plt.plot(interp_data[temp_heading], (lin_model.x[0]*interp_data[temp_heading]+lin_model.x[1]))
-# plt.plot(interp_data[temp_heading], interp_data[cp_heading])
-
-transistion_range = select_between_range(interp_data, tg_start_region, tg_end_region, temp_heading, verbose=verbose)
-
-# apply linear model to the transistion range
-transistion_cp_linear_model = (lin_model.x[0] * transistion_range[temp_heading] + lin_model.x[1]).to_frame(cp_heading)
-
-# Guess the glass transition temp, width, stp
-# Minimize error between tg model and observed cp
-
-
-tg_guesses = [tg_guess, 1, 1, enthalpy_guess, 1, 1]
-magic_number = 17.72432
-
-
-def model(guesses, minimize=True):
-    if verbose == True and minimize == True:
-        print(guesses)
-    t_g = guesses[0]
-    width = guesses[1]
-    stp = guesses[2]
-    enthalpy = guesses[3]
-    width_2 = guesses[4]
-    max = guesses[5]
-    gaus = compute_gaussian(transistion_range[temp_heading], t_g, width, stp, magic_number)
-    # gaus_cumalitve = compute_cumulative_guassuan(gaus, cp_heading, verbose = True)
-    invs = inverse_cumulative_gaussian(gaus, cp_heading)
-    tg_model = transistion_cp_linear_model.reset_index()[cp_heading] - invs[cp_heading]
-    enthalpy_distro = compute_enthaply_distro(transistion_range[temp_heading], enthalpy, width_2, max)
-    enthalpy_distro_2 = compute_enthalpy_disro_2(transistion_range[temp_heading], enthalpy, width_2, max)
-    full_model = model_combonation(enthalpy, transistion_range[temp_heading], enthalpy_distro, enthalpy_distro_2,
-                                   tg_model)
-    if minimize:
-        return np.sqrt(np.sum(np.power(transistion_range[cp_heading] - full_model, 2)))
-    else:
-        return full_model
-
-
-gaus_model = minimize(model, tg_guesses)
-print("Fitted Parameters")
-print("-----------------")
-print("T g: " + str(gaus_model.x[0]))
-print("Width: " + str(gaus_model.x[1]))
-print("Stp: " + str(gaus_model.x[2]))
-print("Enthalpy: " + str(gaus_model.x[3]))
-print("Width: " + str(gaus_model.x[4]))
-print("Max: " + str(gaus_model.x[5]))
-print("Error: " + str(gaus_model.fun))
+parser.add_argument("--no-cache", help="Parse the DSC file without using the parsed-file cache", action="store_true")
+parser.add_argument("--rebuild-cache", help="Re-parse the DSC file and replace its cache entry", action="store_true")
+parser.add_argument("--store", nargs="?", const=default_store_path, default=None,
+                    help="Reuse and record fits in this SQLite fit store (default location without a path)")
+parser.add_argument("--profile", type=str, help="Write call counts, timings and fit convergence as JSON")
+parser.add_argument("--trace", type=str, help="Write a Chrome trace (chrome://tracing, Perfetto) of the run")
+
+
+def drop_unset(options):
+    # flags that were not given keep the pipeline defaults
+    return {key: drop_unset(value) if isinstance(value, dict) else value for key, value in options.items()
+            if value is not None}
+
+
+def run_from_args(args):
+    return pipeline.merge_config(pipeline.default_config, drop_unset({
+        "file": args.file,
+        "range": {"start": args.start, "end": args.end, "column": "time", "stream": args.stream},
+        "interpolation": {"start": args.interloplation_start, "step_size": args.step_size, "steps": args.steps},
+        "fit_window": {"start": args.fit_start, "end": args.fit_end, "robust": args.robust_baseline},
+        "tg_window": {"start": args.tg_start_region, "end": args.tg_end_region},
+        "guesses": {"auto": args.auto_guess, "tg": args.tg_guess, "enthalpy": args.enthalpy_guess},
+        "method": args.method,
+        "cache": {"enabled": not args.no_cache, "rebuild": args.rebuild_cache},
+        "store": {"path": args.store},
+        "measure_memory": args.verbose,
+    }))
+
+
+def print_tg_model(result):
+    if result["status"] != "ok":
+        print("Fit of %s failed at %s" % (result["file"], result["message"]))
+        return
+    parameters = result["parameters"]
+    print("Fitted Parameters")
+    print("-----------------")
+    print("T g: " + str(parameters["t_g"]))
+    print("Width: " + str(parameters["width"]))
+    print("Stp: " + str(parameters["stp"]))
+    print("Enthalpy: " + str(parameters["enthalpy"]))
+    print("Width: " + str(parameters["width_2"]))
+    print("Max: " + str(parameters["max"]))
+    print("Guassian/Caucy Model Ratios: " + str(parameters["ratio"]))
+    print("Error: " + str(result["fit"]["error"]))
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with instrument.exporting(args.profile, args.trace):
+        if args.config:
+            results = pipeline.run_config(pipeline.load_config(args.config),
+                                          base_dir=os.path.dirname(os.path.abspath(args.config)))
+        else:
+            results = [pipeline.run_file(run_from_args(args))]
+    for result in results:
+        if args.verbose:
+            pipeline.print_result(result)
+        print_tg_model(result)
@@ -1,18 +1,48 @@
+import os
+
+import baseline
+import fitting
 import processing
 import numpy as np
-import math
-from scipy.optimize import minimize
+from axis import axis_key, series_axis
+from cache import content_hash
+from channels import Channels, frame_channels
+from stages import StageCache
 
 temp_heading = "Temperature (°C)"
 cp_heading = "Heat Capacity (mJ/°C)"
 time_heading = "Time (min)"
 
 
+# time and temperature axes (full, region and interpolated) whose lookup indexes are kept
+max_axes = 8
+# a fitted Tg closer than this (°C) to either end of the Tg window, or a step below tg_min_step, is what fitting a
+# window without a transition in it gives
+tg_edge_margin = 1.
+tg_min_step = .01
+
+
 class DSCModel():
-    def __init__(self, file):
-        self.imported = processing.import_dsc_data(file)
-        self.data = self.imported.data_frame
-        self.data[cp_heading] = self.data[cp_heading].divide(self.imported.sample_mass)
+    def __init__(self, file, cache=None, store=None, rows=None):
+        # rows is (imported, channels, first row) for part of a file that was already read, such as a segment from
+        # segment_rows, and is used instead of importing the file again. The model's row indices are then rows of
+        # the part; segments handed to accept_segment and the region recorded in the fit store are full-file rows.
+        self.file = file
+        self.store = store
+        self.file_hash = None
+        self.stages = StageCache()
+        self.axes = {}
+        if rows is None:
+            self.row_offset = 0
+            self.stage_keys = {"import": (os.path.abspath(file),)}
+            self.imported, self.full_data = self.stages.get("import", self.stage_keys["import"],
+                                                            lambda: import_channels(file, cache))
+        else:
+            self.imported, self.full_data, self.row_offset = rows
+            self.stage_keys = {"import": (os.path.abspath(file), self.row_offset, len(self.full_data))}
+        # regions, fit windows and transition ranges are Spans over full_data and interped, views not copies
+        self.data = self.full_data.span(0, len(self.full_data))
+        self.stage_keys["region"] = chain_key(self.stage_keys["import"], None)
         self.cp_data = self.data[cp_heading]
         self.temp_data = self.data[temp_heading]
         self.time_data = self.data[time_heading]
@@ -22,19 +52,31 @@ class DSCModel():
         self.linear_end_index = 1
         self.enthalpy_guess = 45
         self.tg_guess = 45
+        self.width_guess = 1
+        self.stp_guess = 1
+        self.width_2_guess = 1
+        self.max_guess = 1
         self.interpolation_start = 30
         self.interpolation_end = 160
         self.interpolation_step_size = .25
         self.tg_region_start = 0
         self.tg_region_end = 1
         self.ratio = .0
+        self.multistart = 1
 
     def guess_interest_region(self):
-        binned, change_regions = processing.bin_first_deriv(self.data[cp_heading])
+        binned, change_regions = self.stages.get("segmentation", chain_key(self.stage_keys["import"], "data"),
+                                                 lambda: processing.bin_first_deriv(self.full_data[cp_heading]))
         self.region_start_index, self.region_end_index = processing.suggest_overall_interest_regions(change_regions)
 
     def accept_interest_region(self):
-        self.data = self.data.loc[self.region_start_index:  self.region_end_index, [temp_heading, cp_heading]]
+        # regions are always cut from the full data so accepting a second region does not slice the first one
+        if not 0 <= self.region_start_index < self.region_end_index < len(self.full_data):
+            raise ValueError("Region of interest rows %d to %d are inverted, empty or outside the %d rows of data" % (
+                self.region_start_index, self.region_end_index, len(self.full_data)))
+        self.stage_keys["region"] = chain_key(self.stage_keys["import"], self.region_start_index,
+                                              self.region_end_index)
+        self.data = self.full_data.span(self.region_start_index, self.region_end_index + 1)
         self.temp_data = self.data[temp_heading]
         self.cp_data = self.data[cp_heading]
 
@@ -44,23 +86,63 @@ class DSCModel():
         else:
             self.region_end_index = x_2
 
+    def split_cycles(self, min_rate=1.):
+        # heat, cool and hold segments of a multi-cycle program, found on the full data
+        self.segments = self.stages.get("cycles", chain_key(self.stage_keys["import"], "cycles", min_rate),
+                                        lambda: processing.split_temperature_segments(
+                                            self.full_data[time_heading], self.full_data[temp_heading],
+                                            min_rate=min_rate))
+        return self.segments
+
+    def segment_rows(self, segment):
+        # The rows of one segment of split_cycles as DSCModel's rows, so a worker can fit it without importing
+        # the file. The channels are views, pickling them for another process sends only the segment's samples.
+        rows = slice(segment["start"], segment["end"] + 1)
+        full = self.full_data
+        return (self.imported, Channels(None if full.time is None else full.time[rows], full.temp[rows],
+                                        full.cp[rows]), segment["start"])
+
+    def accept_segment(self, segment, margin=5.):
+        # fits one segment of split_cycles, interpolating over its temperature span less a margin at either end
+        self.region_start_index = segment["start"] - self.row_offset
+        self.region_end_index = segment["end"] - self.row_offset
+        low, high = sorted([segment["start_temp"], segment["end_temp"]])
+        self.interpolation_start = low + margin
+        self.interpolation_end = high - margin
+        self.accept_interest_region()
+
+    def axis(self, series):
+        # The AxisIndex of a time or temperature column, built on first use and kept for the last few columns
+        key = axis_key(series)
+        axis = self.axes.get(key)
+        if axis is None:
+            axis = self.axes[key] = series_axis(series)
+            while len(self.axes) > max_axes:
+                self.axes.pop(next(iter(self.axes)))
+        return axis
+
     def validate_input(self, x, series):
-        if x < series.min() or x > series.max():
-            return False
-        else:
-            return True
+        return self.axis(series).contains(x)
 
     def most_close_index(self, value, series):
-        return (series - value).abs().idxmin()
+        return self.axis(series).nearest(value)
 
     def interpolate(self):
 
         steps = int(abs(self.interpolation_end - self.interpolation_start) / self.interpolation_step_size)
-        self.interped = processing.interp_temp_cp(self.data, self.interpolation_start, self.interpolation_step_size,
-                                                  steps)
+        self.stage_keys["interpolation"] = chain_key(self.stage_keys["region"], self.interpolation_start,
+                                                     self.interpolation_step_size, steps)
+        self.interped = self.stages.get("interpolation", self.stage_keys["interpolation"],
+                                        lambda: processing.resample_temp_cp(self.data[temp_heading],
+                                                                            self.data[cp_heading],
+                                                                            self.interpolation_start,
+                                                                            self.interpolation_step_size, steps,
+                                                                            as_channels=True))
 
     def guess_linear_region(self):
-        zeros, self.inteped_zero_regions = processing.bin_first_deriv(self.interped[cp_heading])
+        zeros, self.inteped_zero_regions = self.stages.get(
+            "segmentation", chain_key(self.stage_keys["interpolation"], "interped"),
+            lambda: processing.bin_first_deriv(self.interped[cp_heading], final_run=True))
         if len(self.inteped_zero_regions) == 0:
             return False
         longest_region = processing.suggest_linear_region(self.inteped_zero_regions)
@@ -72,72 +154,166 @@ class DSCModel():
         if len(self.inteped_zero_regions) == 0:
             return False
         tg_suggestion = processing.suggest_tg_region(self.inteped_zero_regions)
+        if tg_suggestion is None:
+            return False
 
         self.tg_region_end = tg_suggestion[1]
         self.tg_region_start = tg_suggestion[0]
         return True
 
-    def fit_linear_model(self):
-        fit_range_interp_data = self.interped.loc[self.linear_start_index:  self.linear_end_index,
-                                [temp_heading, cp_heading]]
+    def fit_linear_model(self, robust=False, weights=None):
+        fit_range_interp_data = self.interped.span(self.linear_start_index, self.linear_end_index + 1)
 
-        # mb is a array of [ m ,b ] of y = m * x + b. These the values that will be minimized against to fit a curve
-        def objective_function(mb):
-            return math.sqrt(
-                ((mb[0] * fit_range_interp_data[temp_heading] + mb[1]) - fit_range_interp_data[cp_heading]).pow(
-                    2).sum())
+        def fit():
+            if robust:
+                return baseline.fit_baseline_robust(fit_range_interp_data[temp_heading],
+                                                    fit_range_interp_data[cp_heading], weights=weights)
+            return baseline.fit_baseline(fit_range_interp_data[temp_heading], fit_range_interp_data[cp_heading],
+                                         weights=weights) + (None,)
 
-        guesses = np.array([1, 1], dtype=float)
-        lin_model = minimize(objective_function, guesses)
-        self.lin_model_error = lin_model.fun
-        self.lin_model_params = lin_model.x
+        self.stage_keys["baseline"] = chain_key(self.stage_keys["interpolation"], self.linear_start_index,
+                                                self.linear_end_index, robust) if weights is None else None
+        self.lin_model_params, self.lin_model_error, self.lin_model_weights = self.stages.get(
+            "baseline", self.stage_keys["baseline"], fit)
 
-    def apply_lin_model(self, series):
-        return (self.lin_model_params[0] * series + self.lin_model_params[1]).to_frame(cp_heading)
+    def apply_lin_model(self, temps):
+        return self.lin_model_params[0] * np.asarray(temps) + self.lin_model_params[1]
 
     def print_linear_fit(self):
         print("Error %5.5f" % self.lin_model_error)
         print("%5.5f*x + %5.5f" % (self.lin_model_params[0], self.lin_model_params[1]))
 
-    def fit_tg_model(self):
-        self.transistion_range = self.interped.loc[self.tg_region_start:  self.tg_region_end,
-                                 [temp_heading, cp_heading]]
-        self.transistion_cp_linear_model = (
-                    self.lin_model_params[0] * self.transistion_range[temp_heading] + self.lin_model_params[
-                1]).to_frame(
-            cp_heading)
+    def prepare_tg_fit(self):
+        self.magic_number = fitting.magic_number
+
+        def transition():
+            transistion_range = self.interped.span(self.tg_region_start, self.tg_region_end + 1)
+            transistion_cp_linear_model = self.apply_lin_model(transistion_range[temp_heading])
+            # the transition range is contiguous, so the workspace reads it in place
+            workspace = fitting.ModelWorkspace(transistion_range[temp_heading], transistion_range[cp_heading],
+                                               transistion_cp_linear_model, self.magic_number)
+            return transistion_range, transistion_cp_linear_model, workspace
+
+        self.stage_keys["transition"] = chain_key(self.stage_keys["baseline"], self.tg_region_start,
+                                                  self.tg_region_end)
+        self.transistion_range, self.transistion_cp_linear_model, self.workspace = self.stages.get(
+            "transition", self.stage_keys["transition"], transition)
 
         # Guess the glass transition temp, width, stp
         # Minimize error between tg model and observed cp
+        return [self.tg_guess, self.width_guess, self.stp_guess, self.enthalpy_guess, self.width_2_guess,
+                self.max_guess, self.ratio]
+
+    def guess_fit_parameters(self):
+        # Replaces all seven starting guesses with fitting.initial_guesses over the transition range
+        self.prepare_tg_fit()
+        self.guess_result = self.stages.get("guesses", chain_key(self.stage_keys["transition"]),
+                                            lambda: fitting.initial_guesses(self.workspace))
+        (self.tg_guess, self.width_guess, self.stp_guess, self.enthalpy_guess, self.width_2_guess, self.max_guess,
+         self.ratio) = (float(value) for value in self.guess_result.x)
+        return self.guess_result
+
+    def fit_inputs(self, tg_guesses, method, bounds):
+        # Everything a Tg fit depends on, as the request recorded in the fit store
+        if self.file_hash is None:
+            self.file_hash = content_hash(self.file)
+        temps = self.interped[temp_heading]
+        return {"file_hash": self.file_hash, "name": self.imported.name, "method": method,
+                "region": [int(self.region_start_index + self.row_offset),
+                           int(self.region_end_index + self.row_offset)],
+                "interpolation": [float(self.interpolation_start), float(self.interpolation_step_size), len(temps)],
+                "linear_window": [int(self.linear_start_index), int(self.linear_end_index)],
+                "tg_window": [float(temps[self.tg_region_start]), float(temps[self.tg_region_end])],
+                "guesses": [float(value) for value in tg_guesses], "bounds": bounds_key(bounds)}
 
-        tg_guesses = [self.tg_guess, 1, 1, self.enthalpy_guess, 1, 1, self.ratio]
-        self.magic_number = 17.72432
-
-        def model(guesses, minimize=True):
-
-            t_g = guesses[0]
-            width = guesses[1]
-            stp = guesses[2]
-            enthalpy = guesses[3]
-            width_2 = guesses[4]
-            max = guesses[5]
-            ratio = guesses[6]
-            gaus = processing.compute_gaussian(self.transistion_range[temp_heading], t_g, width, stp, self.magic_number)
-            invs = processing.inverse_cumulative_gaussian(gaus, cp_heading)
-            tg_model = self.transistion_cp_linear_model.reset_index()[cp_heading] - invs[cp_heading]
-            enthalpy_distro = processing.compute_enthaply_distro(self.transistion_range[temp_heading], enthalpy,
-                                                                 width_2, max)
-            enthalpy_distro_2 = processing.compute_enthalpy_disro_2(self.transistion_range[temp_heading], enthalpy,
-                                                                    width_2, max)
-            full_model = processing.model_combonation(enthalpy, self.transistion_range[temp_heading], enthalpy_distro,
-                                                      enthalpy_distro_2,
-                                                      tg_model, ratio)
-            if minimize:
-                return np.sqrt(np.sum(np.power(self.transistion_range[cp_heading] - full_model, 2)))
+    def fit_tg_model(self, method="trf", bounds=fitting.default_tg_bounds, warm_start=True, callback=None):
+        tg_guesses = self.prepare_tg_fit()
+        inputs = self.fit_inputs(tg_guesses, method, bounds) if self.store is not None else None
+
+        # method is "trf" or "dogbox" for bounded least squares with the analytic Jacobian, "lm" for unbounded
+        # Levenberg-Marquardt, or "minimize" for the original finite-difference BFGS fit. With a fit store an
+        # identical earlier request is returned as stored, otherwise the closest stored fit of the same file or
+        # material replaces the guesses when warm_start is set. callback is called with each parameter vector the
+        # fit tries, raising fitting.FitCancelled from it abandons the fit. Only fresh fits that ran to the end are
+        # memoized: stored and warm started results depend on what the store holds, and a fit whose callback raised
+        # (minimize turns StopIteration into an early return) is not the result later callers ask for.
+        interrupted = []
+
+        def watched(parameters):
+            try:
+                return callback(parameters)
+            except BaseException:
+                interrupted.append(True)
+                raise
+
+        fit_callback = watched if callback is not None else None
+
+        def fit():
+            guesses = tg_guesses
+            nearest = None
+            if inputs is not None:
+                stored = self.store.lookup(inputs)
+                if stored is not None:
+                    return stored
+                nearest = self.store.nearest(inputs) if warm_start else None
+                if nearest is not None:
+                    guesses = nearest.x
+            if method == "minimize":
+                result = fitting.fit_tg_minimize(self.workspace, guesses, callback=fit_callback)
             else:
-                return full_model
+                result = fitting.fit_tg_least_squares(self.workspace, guesses, bounds=bounds, method=method,
+                                                      callback=fit_callback)
+            result.source = "fit" if nearest is None else "warm"
+            if interrupted:
+                result.source = "interrupted"
+            elif inputs is not None:
+                self.store.record(inputs, result)
+            return result
+
+        self.stage_keys["tg_fit"] = chain_key(self.stage_keys["transition"], tuple(tg_guesses), method,
+                                              bounds_key(bounds), warm_start)
+        self.gaus_model = self.stages.get("tg_fit", self.stage_keys["tg_fit"], fit,
+                                          keep=lambda result: result.get("source") == "fit")
+
+    def fit_tg_model_multistart(self, starts=16, workers=None, target_error=None, method="trf",
+                                bounds=fitting.default_tg_bounds, executor="thread", seed=None):
+        tg_guesses = self.prepare_tg_fit()
+        # without a seed every call draws new start points, so the result is not memoized
+        self.stage_keys["tg_fit"] = chain_key(self.stage_keys["transition"], tuple(tg_guesses), "multistart",
+                                              starts, target_error, method, bounds_key(bounds),
+                                              seed) if seed is not None else None
+        self.gaus_model = self.stages.get("tg_fit", self.stage_keys["tg_fit"], lambda: fitting.fit_tg_multistart(
+            self.workspace, tg_guesses, starts=starts, workers=workers, target_error=target_error, method=method,
+            bounds=bounds, executor=executor, seed=seed))
+
+    def check_tg_fit(self, edge_margin=tg_edge_margin, min_step=tg_min_step):
+        # Why the Tg fit does not describe a transition inside the Tg window, or None when it does
+        temps = self.transistion_range[temp_heading]
+        t_g, stp = self.gaus_model.x[0], self.gaus_model.x[2]
+        if not temps[0] + edge_margin < t_g < temps[-1] - edge_margin:
+            return "Fitted Tg %5.2f is at or past the edge of the Tg window %5.2f to %5.2f" % (t_g, temps[0],
+                                                                                             temps[-1])
+        if stp < min_step:
+            return "Fitted step %5.4f is too small for a glass transition" % stp
+        return None
 
-        self.gaus_model = minimize(model, tg_guesses)
+    def print_tg_statistics(self):
+        statistics = fitting.fit_statistics(self.gaus_model)
+        print("Fit method %s: %d function and %d Jacobian evaluations in %5.4f s" % (
+            statistics["method"], statistics["nfev"], statistics["njev"], statistics["wall_s"]))
+        if self.gaus_model.get("source") == "stored":
+            print("Returned from the fit store (%s), the counts are those of the stored fit" % self.gaus_model.message)
+        elif self.gaus_model.get("source") == "warm":
+            print("Warm started from the closest stored fit")
+        if "solutions" in self.gaus_model:
+            print("Converged %d of %d starts%s" % (self.gaus_model.completed, len(self.gaus_model.starts),
+                                                 ", stopped early" if self.gaus_model.stopped_early else ""))
+            print("Spread of solutions: " + ", ".join("%s %5.4f" % (name, value) for name, value in
+                                                      zip(fitting.parameter_names, self.gaus_model.spread)))
+
+    def print_stage_statistics(self):
+        for stage, statistics in self.stages.statistics().items():
+            print("%-13s hits %4d misses %4d" % (stage, statistics["hits"], statistics["misses"]))
 
     def print_tg_model(self):
         print("Fitted Parameters")
@@ -152,23 +328,31 @@ class DSCModel():
         print("Error: " + str(self.gaus_model.fun))
 
     def apply_model(self, guesses):
+        full_model = self.workspace.evaluate(guesses)
+        return (full_model.copy(), self.workspace.enthalpy_distro.copy(), self.workspace.enthalpy_distro_2.copy())
+
+    def apply_model_batch(self, parameters, chunk_rows=None, return_models=True):
+        # (N x 7) parameter sets in, (N x T) model curves over the transition range and per-row errors out, the
+        # same sqrt(sum(residual ** 2)) as workspace.error
+        return self.workspace.evaluate_batch(parameters, chunk_rows=chunk_rows, return_models=return_models)
+
+
+def import_channels(file, cache=None):
+    # The parsed file's time, temperature and mass-normalised cp as Channels, the parsed frame (every column of
+    # the export) is dropped once they are copied out
+    imported = processing.import_dsc_data(file, cache=cache)
+    channels = frame_channels(imported.data_frame, imported.sample_mass)
+    imported.data_frame = None
+    return imported, channels
+
+
+def chain_key(upstream, *inputs):
+    # A stage key is its upstream key plus its own inputs. Inputs that could not be keyed upstream (None)
+    # make every downstream stage uncacheable too.
+    if upstream is None:
+        return None
+    return (upstream,) + inputs
+
 
-        t_g = guesses[0]
-        width = guesses[1]
-        stp = guesses[2]
-        enthalpy = guesses[3]
-        width_2 = guesses[4]
-        max = guesses[5]
-        ratio = guesses[6]
-        gaus = processing.compute_gaussian(self.transistion_range[temp_heading], t_g, width, stp, self.magic_number)
-        invs = processing.inverse_cumulative_gaussian(gaus, cp_heading)
-        tg_model = self.transistion_cp_linear_model.reset_index()[cp_heading] - invs[cp_heading]
-        enthalpy_distro = processing.compute_enthaply_distro(self.transistion_range[temp_heading], enthalpy, width_2,
-                                                             max)
-        enthalpy_distro_2 = processing.compute_enthalpy_disro_2(self.transistion_range[temp_heading], enthalpy, width_2,
-                                                                max)
-        full_model = processing.model_combonation(enthalpy, self.transistion_range[temp_heading], enthalpy_distro,
-                                                  enthalpy_distro_2,
-                                                  tg_model, ratio)
-
-        return (full_model, enthalpy_distro, enthalpy_distro_2)
+def bounds_key(bounds):
+    return tuple(tuple(float(value) for value in np.atleast_1d(side)) for side in bounds)
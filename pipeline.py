@@ -0,0 +1,267 @@
+import argparse
+import copy
+import glob
+import json
+import os
+import time
+import tracemalloc
+
+import baseline
+import fitting
+import instrument
+import processing
+from cache import cache_from_args, content_hash
+from store import store_from_args
+
+temp_heading = "Temperature (°C)"
+cp_heading = "Heat Capacity (mJ/°C)"
+time_heading = "Time (min)"
+range_columns = {"time": time_heading, "temperature": temp_heading}
+
+# Every run starts from these settings, then the config file's top level, then the run's own entries
+default_config = {
+    "range": {"start": None, "end": None, "column": "time", "stream": False},
+    "interpolation": {"start": 30, "end": 160, "step_size": .25, "steps": None},
+    "fit_window": {"start": None, "end": None, "robust": False},
+    "tg_window": {"start": None, "end": None},
+    "guesses": {"auto": False, "tg": 45, "enthalpy": 45, "ratio": 0},
+    "method": "trf",
+    "cache": {"enabled": True, "rebuild": False, "dir": None},
+    "store": {"path": None, "warm_start": True},
+    "measure_memory": True,
+}
+run_keys = ["range", "interpolation", "fit_window", "tg_window", "guesses", "method", "cache", "store",
+            "measure_memory"]
+
+
+def load_config(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".json":
+        with open(path, "r", encoding="utf-8") as config_file:
+            return json.load(config_file)
+    if extension == ".toml":
+        import tomllib
+        with open(path, "rb") as config_file:
+            return tomllib.load(config_file)
+    if extension in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("PyYAML is needed to read YAML run configs, use JSON or TOML otherwise")
+        with open(path, "r", encoding="utf-8") as config_file:
+            return yaml.safe_load(config_file)
+    raise ValueError("Run configs must be .json, .toml, .yaml or .yml files")
+
+
+def merge_config(base, overrides):
+    merged = copy.deepcopy(base)
+    for key, value in (overrides or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def expand_runs(config, base_dir="."):
+    # A config lists "files" (paths or glob patterns sharing the top level settings) and/or "runs" (one dict per
+    # file with its own overrides). Relative paths are taken from the config file's directory.
+    shared = merge_config(default_config, {key: config[key] for key in run_keys if key in config})
+    runs = []
+    for pattern in config.get("files", []):
+        pattern = os.path.join(base_dir, pattern)
+        for file in sorted(glob.glob(pattern)) or [pattern]:
+            runs.append(merge_config(shared, {"file": file}))
+    for run in config.get("runs", []):
+        run = merge_config(shared, run)
+        run["file"] = os.path.join(base_dir, run["file"])
+        runs.append(run)
+    return runs
+
+
+def run_stage(stages, name, function, *args, measure_memory=True, **kwargs):
+    # Runs one stage and appends its wall time and peak traced memory above the memory in use before it started
+    record = {"stage": name}
+    stages.append(record)
+    if measure_memory:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        with instrument.stage("pipeline." + name):
+            return function(*args, **kwargs)
+    except Exception:
+        record["failed"] = True
+        raise
+    finally:
+        record["wall_s"] = time.perf_counter() - start
+        if measure_memory:
+            record["peak_bytes"] = tracemalloc.get_traced_memory()[1] - before
+
+
+def import_stage(file, cache_config, range_config):
+    if range_config["stream"]:
+        # the range is applied while parsing, time only increases so reading stops past its end
+        window = None
+        if range_config["start"] is not None or range_config["end"] is not None:
+            window = (range_columns[range_config["column"]], bound(range_config["start"], -float("inf")),
+                      bound(range_config["end"], float("inf")))
+        return processing.import_dsc_data_window(file, columns=[time_heading, temp_heading, cp_heading],
+                                                 window=window, stop_past_end=range_config["column"] == "time")
+    cache = cache_from_args(not cache_config["enabled"], cache_config["rebuild"], cache_config["dir"])
+    return processing.import_dsc_data(file, cache=cache)
+
+
+def bound(value, default):
+    return value if value is not None else default
+
+
+def select_region(dsc_data, range_config):
+    data = dsc_data.data_frame
+    if not range_config["stream"] and (range_config["start"] is not None or range_config["end"] is not None):
+        data = processing.select_between_range(data, bound(range_config["start"], -float("inf")),
+                                               bound(range_config["end"], float("inf")),
+                                               range_columns[range_config["column"]])
+    data = data[[temp_heading, cp_heading]]
+    # Correct for mass
+    return data.assign(**{cp_heading: data[cp_heading].divide(dsc_data.sample_mass)})
+
+
+def interpolate(data, interpolation_config):
+    steps = interpolation_config["steps"]
+    if steps is None:
+        steps = int(abs(interpolation_config["end"] - interpolation_config["start"]) /
+                    interpolation_config["step_size"])
+    return processing.resample_temp_cp(data[temp_heading], data[cp_heading], interpolation_config["start"],
+                                       interpolation_config["step_size"], steps, as_frame=True)
+
+
+def window(data, window_config, name):
+    if window_config["start"] is None or window_config["end"] is None:
+        raise ValueError("The run config needs a start and end for " + name)
+    return processing.select_between_range(data, window_config["start"], window_config["end"], temp_heading)
+
+
+def fit_linear_region(interped, fit_config):
+    fit_range = window(interped, fit_config, "fit_window")
+    if fit_config.get("robust"):
+        return baseline.fit_baseline_robust(fit_range[temp_heading], fit_range[cp_heading])[:2]
+    return baseline.fit_baseline(fit_range[temp_heading], fit_range[cp_heading])
+
+
+def transition_workspace(interped, tg_config, lin_model_params):
+    transistion_range = window(interped, tg_config, "tg_window")
+    linear_model = lin_model_params[0] * transistion_range[temp_heading] + lin_model_params[1]
+    return fitting.ModelWorkspace(transistion_range[temp_heading], transistion_range[cp_heading], linear_model)
+
+
+def transition_guesses(workspace, guesses):
+    # "auto" searches for all seven starting values, otherwise tg, enthalpy and ratio are used as given
+    if guesses["auto"]:
+        return [float(value) for value in fitting.initial_guesses(workspace).x]
+    return [guesses["tg"], 1, 1, guesses["enthalpy"], 1, 1, guesses["ratio"]]
+
+
+def fit_transition(workspace, tg_guesses, method, fit_store=None, inputs=None, warm_start=True):
+    # With a fit store an identical request is returned as stored and otherwise the closest stored fit of the
+    # same file or material is the starting point, see DSCModel.fit_tg_model
+    nearest = None
+    if fit_store is not None:
+        stored = fit_store.lookup(inputs)
+        if stored is not None:
+            return stored
+        nearest = fit_store.nearest(inputs) if warm_start else None
+        if nearest is not None:
+            tg_guesses = nearest.x
+    if method == "minimize":
+        fit = fitting.fit_tg_minimize(workspace, tg_guesses)
+    else:
+        fit = fitting.fit_tg_least_squares(workspace, tg_guesses, method=method)
+    fit.source = "fit" if nearest is None else "warm"
+    if fit_store is not None:
+        fit_store.record(inputs, fit)
+    return fit
+
+
+def fit_inputs(run, name, tg_guesses):
+    # The settings a pipeline fit depends on, as the request recorded in the fit store
+    return {"file_hash": content_hash(run["file"]), "name": name, "method": run["method"],
+            "range": run["range"], "interpolation": run["interpolation"], "fit_window": run["fit_window"],
+            "tg_window": [run["tg_window"]["start"], run["tg_window"]["end"]],
+            "guesses": [float(value) for value in tg_guesses]}
+
+
+def run_file(run):
+    # Runs the main.py stages for one file and returns a JSON serializable result with per-stage timings
+    stages = []
+    measure_memory = run["measure_memory"]
+    started_tracing = measure_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    result = {"file": run["file"], "status": "ok", "message": "", "stages": stages}
+    start = time.perf_counter()
+    try:
+        dsc_data = run_stage(stages, "import", import_stage, run["file"], run["cache"], run["range"],
+                             measure_memory=measure_memory)
+        data = run_stage(stages, "region", select_region, dsc_data, run["range"], measure_memory=measure_memory)
+        interped = run_stage(stages, "interpolation", interpolate, data, run["interpolation"],
+                             measure_memory=measure_memory)
+        lin_model_params, lin_model_error = run_stage(stages, "baseline", fit_linear_region, interped,
+                                                      run["fit_window"], measure_memory=measure_memory)
+        workspace = run_stage(stages, "transition", transition_workspace, interped, run["tg_window"],
+                              lin_model_params, measure_memory=measure_memory)
+        tg_guesses = run_stage(stages, "guesses", transition_guesses, workspace, run["guesses"],
+                               measure_memory=measure_memory)
+        fit_store = store_from_args(run["store"]["path"])
+        inputs = fit_inputs(run, dsc_data.name, tg_guesses) if fit_store is not None else None
+        fit = run_stage(stages, "tg_fit", fit_transition, workspace, tg_guesses, run["method"], fit_store, inputs,
+                        run["store"]["warm_start"], measure_memory=measure_memory)
+        result["name"] = dsc_data.name
+        result["linear_model"] = {"m": float(lin_model_params[0]), "b": float(lin_model_params[1]),
+                                  "error": float(lin_model_error)}
+        result["guesses"] = dict(zip(fitting.parameter_names, tg_guesses))
+        result["parameters"] = dict(zip(fitting.parameter_names, (float(value) for value in fit.x)))
+        result["fit"] = fitting.fit_statistics(fit)
+        result["fit"]["source"] = fit.get("source", "fit")
+    except Exception as error:
+        result["status"] = "failed"
+        result["message"] = "%s: %s: %s" % (stages[-1]["stage"], type(error).__name__, error)
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    result["total_s"] = time.perf_counter() - start
+    return result
+
+
+def run_config(config, base_dir="."):
+    return [run_file(run) for run in expand_runs(config, base_dir)]
+
+
+def print_result(result):
+    if result["status"] != "ok":
+        print("%s failed at %s" % (result["file"], result["message"]))
+        return
+    print("%s: Tg %5.2f error %5.5f (%s)" % (result["file"], result["parameters"]["t_g"], result["fit"]["error"],
+                                             result["fit"]["source"]))
+    for stage in result["stages"]:
+        print("  %-13s %8.4f s %12s" % (stage["stage"], stage["wall_s"],
+                                        "%d B" % stage["peak_bytes"] if "peak_bytes" in stage else ""))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", type=str, help="Run config (.json, .toml, .yaml)")
+    parser.add_argument("-o", "--output", type=str, help="Write the structured results as JSON to this file")
+    parser.add_argument("-q", "--quiet", help="Only write the JSON output", action="store_true")
+    parser.add_argument("--profile", type=str, help="Write call counts, timings and fit convergence as JSON")
+    parser.add_argument("--trace", type=str, help="Write a Chrome trace (chrome://tracing, Perfetto) of the run")
+    args = parser.parse_args()
+
+    with instrument.exporting(args.profile, args.trace):
+        results = run_config(load_config(args.config), base_dir=os.path.dirname(os.path.abspath(args.config)))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
+    if not args.quiet:
+        for result in results:
+            print_result(result)
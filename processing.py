@@ -1,17 +1,24 @@
-import pandas as pd
 import csv
 import codecs
 import math
 import numpy as np
-from scipy import signal, stats
 import os
 
+from axis import series_axis
+from channels import Channels
+from lazy import lazy_import
+
+pd = lazy_import("pandas")
+signal = lazy_import("scipy.signal")
+stats = lazy_import("scipy.stats")
+
 header_names = ["Sig1", "Sig2", "Sig3", "Sig4", "Sig5"]
 sample_mass_line = "Size"
 data_start_line = "StartOfData"
 temp_heading = "Temperature (°C)"
 cp_heading = "Heat Capacity (mJ/°C)"
 time_heading = "Time (min)"
+stream_chunk_rows = 200000
 
 
 class DSCDataFrame():
@@ -19,15 +26,103 @@ class DSCDataFrame():
         self.sample_mass = float(0)
         self.name = os.path.basename(name).split(".")[0]
 
-    def create_data_frame(self, data, headers):
-        self.data_frame = pd.DataFrame(data, columns=headers, dtype=float)
+    def create_data_frame(self, data, headers, copy=None):
+        self.data_frame = pd.DataFrame(data, columns=headers, dtype=float, copy=copy)
+
 
+def read_dsc_header(data_file):
+    # Reads the header block up to and including the StartOfData line, leaving data_file at the first data row
+    sample_mass = float(0)
+    data_header_names = []
+    for line in data_file:
+        header_row = line.rstrip("\r\n").split("\t")
+        if header_row[0] == data_start_line:
+            return sample_mass, data_header_names
+        if header_row[0] == sample_mass_line:
+            sample_mass = float(header_row[1])
+        elif header_row[0] in header_names:
+            data_header_names.append(header_row[1])
+    raise ValueError("No " + data_start_line + " line found in DSC file")
+
+
+def read_dsc_body(data_file, data_header_names):
+    # Decodes the whole tab separated body into a (rows x columns) float array in one pass
+    body = pd.read_csv(data_file, sep="\t", header=None, usecols=range(len(data_header_names)), dtype=float,
+                       engine="c")
+    return body.to_numpy(dtype=float)
+
+
+def stream_dsc_body(data_file, data_header_names, columns=None, window=None, stop_past_end=False,
+                    chunk_rows=stream_chunk_rows):
+    # Decodes the body chunk_rows at a time, keeping only the named columns and, for window=(column, start, end),
+    # only the rows strictly inside it as select_between_range does, so memory follows the kept rows rather than
+    # the file. stop_past_end stops reading after the first chunk ending past end, for columns that only increase.
+    columns = list(columns or data_header_names)
+    wanted = columns + ([window[0]] if window is not None else [])
+    missing = [column for column in wanted if column not in data_header_names]
+    if missing:
+        raise ValueError("Columns not in DSC file: " + ", ".join(missing))
+    indices = [data_header_names.index(column) for column in columns]
+    reader = pd.read_csv(data_file, sep="\t", header=None, dtype=float, engine="c", chunksize=chunk_rows,
+                         usecols=sorted(set(data_header_names.index(column) for column in wanted)))
+    kept = []
+    with reader:
+        for chunk in reader:
+            values = chunk[indices].to_numpy(dtype=float)
+            if window is None:
+                kept.append(values)
+                continue
+            key = chunk[data_header_names.index(window[0])].to_numpy(dtype=float)
+            inside = (key > window[1]) & (key < window[2])
+            if inside.any():
+                kept.append(values[inside])
+            if stop_past_end and len(key) and key[-1] >= window[2]:
+                break
+    if not kept:
+        return np.empty((0, len(columns)))
+    return np.concatenate(kept) if len(kept) > 1 else kept[0]
 
-def import_dsc_data(file, verbose=False):
+
+def import_dsc_data_window(file, columns=None, window=None, stop_past_end=False, chunk_rows=stream_chunk_rows,
+                           verbose=False):
+    # Streaming import, the data frame only holds the requested columns inside the window, see stream_dsc_body
+    data = DSCDataFrame(file)
+    with open(file, "r", encoding="utf-16", newline="") as data_file:
+        if verbose:
+            print("Loading headers from data file...")
+        data.sample_mass, data_header_names = read_dsc_header(data_file)
+        if verbose:
+            print("Streaming data from data file...")
+        values = stream_dsc_body(data_file, data_header_names, columns=columns, window=window,
+                                 stop_past_end=stop_past_end, chunk_rows=chunk_rows)
+    data.create_data_frame(values, list(columns or data_header_names), copy=False)
+    if verbose:
+        print("Kept %d rows from data file..." % len(values))
+    return data
+
+
+def import_dsc_data(file, verbose=False, cache=None):
+    if cache is not None:
+        return cache.load(file, verbose=verbose)
+    data = DSCDataFrame(file)
+    with open(file, "r", encoding="utf-16", newline="") as data_file:
+        if verbose:
+            print("Loading headers from data file...")
+        data.sample_mass, data_header_names = read_dsc_header(data_file)
+        if verbose:
+            print("Loading data from data file...")
+        values = read_dsc_body(data_file, data_header_names)
+    data.create_data_frame(values, data_header_names, copy=False)
+    if verbose:
+        print("Finished loading data from data file...")
+    return data
+
+
+def import_dsc_data_legacy(file, verbose=False):
     data = DSCDataFrame(file)
     data_header_names = []
     data_list = []
-    with codecs.open(file, "rU", "utf-16") as data_file:
+    with codecs.open(file, "r", "utf-16") as data_file:
         reader = csv.reader(data_file, delimiter="\t")
         header_row = next(reader)
         if verbose:
@@ -58,11 +153,14 @@ def import_dsc_data(file, verbose=False):
     return data
 
 
-def select_between_range(dsc_df, start, end, col, verbose=False):
+def select_between_range(dsc_df, start, end, col, verbose=False, axis=None):
+    # Rows with start < col < end. When col increases, as time and interpolated temperatures do, the rows are
+    # found by binary search and returned as a slice of dsc_df; pass an AxisIndex of col to reuse its sort order.
     if verbose:
         print("Selecting data from " + str(start) + " to " + str(end) + " from column [" + col + "]...")
-    d = dsc_df[(dsc_df[col] > start) & (dsc_df[col] < end)]
-    return d
+    if axis is None:
+        axis = series_axis(dsc_df[col], sort=False)
+    return axis.select(dsc_df, start, end)
 
 
 def compute_gaussian(X, t_g, width, stp, magic_number, verbose=False):
@@ -119,6 +217,61 @@ def compute_enthalpy_disro_2(X, enthalpy, width, max, verbose=False):
     return max / (1 + ((X - enthalpy) / width).pow(2))
 
 
+def compute_gaussian_array(X, t_g, width, stp, magic_number):
+    X = np.asarray(X, dtype=float)
+    return (stp / (magic_number * width)) * np.exp(-np.square((X - t_g) / width))
+
+
+def inverse_cumulative_gaussian_array(gaussian):
+    # Same sums as inverse_cumulative_gaussian, sum(gaussian[i:-1]), from one reversed cumulative sum
+    gaussian = np.asarray(gaussian, dtype=float)
+    inverse = np.zeros(len(gaussian))
+    if len(gaussian) > 1:
+        inverse[:-1] = np.cumsum(gaussian[-2::-1])[::-1]
+    return inverse
+
+
+def compute_enthalpy_distro_array(X, enthalpy, width, max):
+    X = np.asarray(X, dtype=float)
+    em = math.sqrt(-math.log(.5))
+    return max * np.exp(-np.square((em * (X - enthalpy)) / width))
+
+
+def compute_enthalpy_distro_2_array(X, enthalpy, width, max):
+    X = np.asarray(X, dtype=float)
+    return max / (1 + np.square((X - enthalpy) / width))
+
+
+def model_combination_array(enthalpy, temp_range, enthalpy_distro, enthalpy_distro_2, tg_model, ratio):
+    temp_range = np.asarray(temp_range, dtype=float)
+    return np.where(temp_range < enthalpy, tg_model + np.asarray(enthalpy_distro_2) * (1 - ratio),
+                    tg_model + np.asarray(enthalpy_distro) * (1 + ratio))
+
+
+def evaluate_tg_model(temp_range, baseline, guesses, magic_number):
+    # Full glass transition model on plain arrays, returns (full_model, enthalpy_distro, enthalpy_distro_2)
+    t_g, width, stp, enthalpy, width_2, max, ratio = guesses
+    gaus = compute_gaussian_array(temp_range, t_g, width, stp, magic_number)
+    tg_model = np.asarray(baseline, dtype=float) - inverse_cumulative_gaussian_array(gaus)
+    enthalpy_distro = compute_enthalpy_distro_array(temp_range, enthalpy, width_2, max)
+    enthalpy_distro_2 = compute_enthalpy_distro_2_array(temp_range, enthalpy, width_2, max)
+    full_model = model_combination_array(enthalpy, temp_range, enthalpy_distro, enthalpy_distro_2, tg_model, ratio)
+    return full_model, enthalpy_distro, enthalpy_distro_2
+
+
+def evaluate_tg_model_reference(temp_range, baseline, guesses, magic_number):
+    # Original Series based evaluation, kept to validate evaluate_tg_model against
+    t_g, width, stp, enthalpy, width_2, max, ratio = guesses
+    temp_range = pd.Series(np.asarray(temp_range, dtype=float))
+    gaus = compute_gaussian(temp_range, t_g, width, stp, magic_number)
+    invs = inverse_cumulative_gaussian(gaus, cp_heading)
+    tg_model = pd.Series(np.asarray(baseline, dtype=float)) - invs[cp_heading]
+    enthalpy_distro = compute_enthaply_distro(temp_range, enthalpy, width_2, max)
+    enthalpy_distro_2 = compute_enthalpy_disro_2(temp_range, enthalpy, width_2, max)
+    full_model = model_combonation(enthalpy, temp_range, enthalpy_distro, enthalpy_distro_2, tg_model, ratio)
+    return full_model, enthalpy_distro, enthalpy_distro_2
+
+
 def interp_temp_cp(df, start, step_size, max_step, verbose=False):
     if verbose:
         print("Interpolating data based on following parameters...")
@@ -153,6 +306,64 @@ def interp_temp_cp(df, start, step_size, max_step, verbose=False):
     return pd.DataFrame(data_list)
 
 
+def prepare_temp_axis(temp, cp, wobble="sort"):
+    # Returns a strictly increasing temperature axis and matching cp values.
+    # wobble="sort" orders all samples by temperature, wobble="drop" discards samples that do not exceed every
+    # earlier temperature (cooling-back during a heat). Repeated temperatures are averaged in both cases.
+    temp = np.asarray(temp, dtype=float)
+    cp = np.asarray(cp, dtype=float)
+    keep = ~(np.isnan(temp) | np.isnan(cp))
+    temp = temp[keep]
+    cp = cp[keep]
+    if len(temp) > 1 and np.all(np.diff(temp) > 0):
+        return temp, cp
+    if wobble == "drop":
+        forward = np.ones(len(temp), dtype=bool)
+        forward[1:] = temp[1:] > np.maximum.accumulate(temp)[:-1]
+        temp = temp[forward]
+        cp = cp[forward]
+    elif wobble == "sort":
+        order = np.argsort(temp, kind="stable")
+        temp = temp[order]
+        cp = cp[order]
+    else:
+        raise ValueError("wobble must be 'sort' or 'drop'")
+    unique_temp, inverse, counts = np.unique(temp, return_inverse=True, return_counts=True)
+    if len(unique_temp) != len(temp):
+        cp = np.bincount(inverse, weights=cp) / counts
+    return unique_temp, cp
+
+
+def resample_temp_cp(temp, cp, start, step_size, max_step, edges="extrapolate", wobble="sort", as_frame=False,
+                     as_channels=False, verbose=False):
+    # Resamples cp onto start + i * step_size for i < max_step with one searchsorted pass.
+    # edges="extrapolate" extends the first/last segment like interp_temp_cp, "clamp" holds the edge cp and
+    # "nan" marks output temperatures outside the measured range.
+    if verbose:
+        print("Resampling data based on following parameters...")
+        print("%5.2f, %5.2f, %d" % (start, step_size, max_step))
+    temp, cp = prepare_temp_axis(temp, cp, wobble=wobble)
+    if len(temp) < 2:
+        raise ValueError("At least two distinct temperatures are needed to resample")
+    steps = start + np.arange(max_step, dtype=float) * step_size
+    right = np.clip(np.searchsorted(temp, steps, side="right"), 1, len(temp) - 1)
+    left = right - 1
+    fraction = (steps - temp[left]) / (temp[right] - temp[left])
+    resampled = cp[left] + (cp[right] - cp[left]) * fraction
+    if edges == "clamp":
+        resampled[steps <= temp[0]] = cp[0]
+        resampled[steps >= temp[-1]] = cp[-1]
+    elif edges == "nan":
+        resampled[(steps < temp[0]) | (steps > temp[-1])] = np.nan
+    elif edges != "extrapolate":
+        raise ValueError("edges must be 'extrapolate', 'clamp' or 'nan'")
+    if as_frame:
+        return pd.DataFrame({cp_heading: resampled, temp_heading: steps})
+    if as_channels:
+        return Channels(temp=steps, cp=resampled)
+    return steps, resampled
+
+
 def model_combonation(enthalpy, temp_range, enthalpy_distro, enthalpy_distro_2, tg_model, ratio, verbose=False):
     if verbose:
         print("Adding distribution models...")
@@ -175,7 +386,69 @@ def scale(X):
     return np.divide(X, np.absolute(X).max())
 
 
-def bin_first_deriv(X, smooth_interations=10, to_zero_tol=.005, parition_size=10):
+def smoothed_first_deriv(X, smooth_interations=10):
+    smoothed = signal.savgol_filter(np.asarray(X, dtype=float), 9, 4, 0)
+    first = signal.savgol_filter(smoothed, 9, 4, 1)
+    for i in range(0, smooth_interations):
+        first = signal.savgol_filter(first, 9, 4, 0)
+    return first
+
+
+def partition_modes(parts):
+    # Row wise scipy.stats.mode: the most frequent value of each row, ties going to the smallest value
+    rows, width = parts.shape
+    ordered = np.sort(parts, axis=1).ravel()
+    run_start = np.ones(len(ordered), dtype=bool)
+    run_start[1:] = ordered[1:] != ordered[:-1]
+    run_start[::width] = True
+    run_index = np.flatnonzero(run_start)
+    run_lengths = np.diff(np.append(run_index, len(ordered)))
+    run_rows = run_index // width
+    row_first_run = np.searchsorted(run_rows, np.arange(rows))
+    longest = np.maximum.reduceat(run_lengths, row_first_run)
+    candidates = np.where(run_lengths == longest[run_rows], np.arange(len(run_index)), len(run_index))
+    return ordered[run_index[np.minimum.reduceat(candidates, row_first_run)]]
+
+
+def segment_signs(f, to_zero_tol=.005, parition_size=10, final_run=False):
+    # Classifies each partition as -1, 0 or 1 and lists the runs between sign changes as (sign, (start, end))
+    # tuples, matching the partition loop of bin_first_deriv_legacy. That loop never lists the run after the last
+    # change, final_run adds it (ending on the last sample). f is not modified.
+    f = np.asarray(f, dtype=float)
+    l = len(f)
+    number_of_spilts = l // parition_size
+    scaled = np.zeros(l)
+    if number_of_spilts == 0:
+        return (scaled, [])
+    f = np.where(np.absolute(f) < to_zero_tol, 0, f)
+    parts = f[0:number_of_spilts * parition_size].reshape(number_of_spilts, parition_size)
+    signs = np.where(parts.mean(axis=1) < 0, -1, 1)
+    signs[partition_modes(parts) == 0] = 0
+    scaled[0:number_of_spilts * parition_size] = np.repeat(signs, parition_size)
+
+    change_points = np.flatnonzero(signs[1:] != signs[:-1]) + 1
+    changes = []
+    last_change_index = 0
+    for i in change_points.tolist():
+        if i == (len(signs) - 1):
+            changes.append((int(signs[i]), (0, i * parition_size)))
+        else:
+            changes.append((int(signs[i - 1]), (last_change_index, i * parition_size)))
+        last_change_index = i * parition_size
+    if final_run and len(change_points):
+        changes.append((int(signs[-1]), (last_change_index, l - 1)))
+    return (scaled, changes)
+
+
+def bin_first_deriv(X, smooth_interations=10, to_zero_tol=.005, parition_size=10, final_run=False):
+    return segment_signs(smoothed_first_deriv(X, smooth_interations), to_zero_tol, parition_size, final_run)
+
+
+def bin_pos_neg(X, to_zero_tol=.005, parition_size=10):
+    return segment_signs(X, to_zero_tol, parition_size)
+
+
+def bin_first_deriv_legacy(X, smooth_interations=10, to_zero_tol=.005, parition_size=10):
     smoothed = signal.savgol_filter(X, 9, 4, 0)
     first = signal.savgol_filter(smoothed, 9, 4, 1)
     for i in range(0, smooth_interations):
@@ -218,7 +491,7 @@ def bin_first_deriv(X, smooth_interations=10, to_zero_tol=.005, parition_size=10
     return (scaled, changes)
 
 
-def bin_pos_neg(X, to_zero_tol=.005, parition_size=10):
+def bin_pos_neg_legacy(X, to_zero_tol=.005, parition_size=10):
     l = (len(X))
     trim_length = l - (l % parition_size)
     f = X
@@ -257,6 +530,52 @@ def bin_pos_neg(X, to_zero_tol=.005, parition_size=10):
     return (scaled, changes)
 
 
+def split_temperature_segments(time, temp, min_rate=1., smooth_points=25, min_points=50, min_span=10.):
+    # Splits a temperature program into heating, cooling and hold segments from the smoothed dT/dt. Samples
+    # heating or cooling faster than min_rate (°C per time unit) are heat or cool, the rest hold. Runs shorter
+    # than min_points join the run before them, and heats or cools spanning less than min_span °C become holds.
+    # Returns dicts with kind, number (1 for the first heat, 2 for the second...), start and end row (inclusive),
+    # their temperatures and the mean rate, in time order.
+    time = np.asarray(time, dtype=float)
+    temp = np.asarray(temp, dtype=float)
+    if len(temp) < 2:
+        return []
+    rate = np.gradient(temp, time)
+    if len(rate) > smooth_points:
+        rate = np.convolve(rate, np.ones(smooth_points) / smooth_points, mode="same")
+    kinds = np.where(rate > min_rate, 1, np.where(rate < -min_rate, -1, 0))
+    starts = np.flatnonzero(np.diff(kinds)) + 1
+    runs = [[int(kind), int(start), int(end)] for kind, start, end in
+            zip(kinds[np.append(0, starts)], np.append(0, starts), np.append(starts, len(kinds)))]
+    merged = []
+    for run in runs:
+        short = run[2] - run[1] < min_points
+        if merged and (short or merged[-1][0] == run[0]):
+            merged[-1][2] = run[2]
+        else:
+            merged.append(run)
+    segments = []
+    counts = {}
+    names = {1: "heat", -1: "cool", 0: "hold"}
+    for kind, start, end in merged:
+        end -= 1
+        if kind != 0 and abs(temp[end] - temp[start]) < min_span:
+            kind = 0
+        if segments and segments[-1]["kind"] == names[kind]:
+            segment = segments[-1]
+        else:
+            counts[kind] = counts.get(kind, 0) + 1
+            segment = {"kind": names[kind], "number": counts[kind], "start": start}
+            segments.append(segment)
+        segment["end"] = end
+    for segment in segments:
+        start, end = segment["start"], segment["end"]
+        segment["start_temp"] = float(temp[start])
+        segment["end_temp"] = float(temp[end])
+        segment["rate"] = float((temp[end] - temp[start]) / (time[end] - time[start])) if end > start else 0.
+    return segments
+
+
 def suggest_overall_interest_regions(change_list):
     zero_regions = []
 
@@ -266,28 +585,53 @@ def suggest_overall_interest_regions(change_list):
     if len(zero_regions) == 1:
         return zero_regions[0]
     if len(zero_regions) > 1:
-        top_two = sorted(zero_regions, reverse=True, key=lambda region: region[1] - region[0])[0:2]
+        # the two longest flat runs, in time order so the region runs from the earlier one to the later one
+        top_two = sorted(sorted(zero_regions, reverse=True, key=lambda region: region[1] - region[0])[0:2])
         return (top_two[0][0], top_two[1][1])
     else:
         return (change_list[0][1][0], change_list[-1][1][1])
 
 
+def find_transition(change_list):
+    # Positions in change_list of the glass transition's rise in cp (the step and the leading edge of the enthalpy
+    # overshoot) and of the fall after it (the overshoot's trailing edge), which may be separated by a flat run at
+    # the top of the overshoot. A rise without a fall, as on a cool, ends where the next flat run starts. None
+    # when there is no rise.
+    for i, pair in enumerate(change_list):
+        if pair[0] != 1:
+            continue
+        j = i + 1
+        if j + 1 < len(change_list) and change_list[j][0] == 0 and change_list[j + 1][0] == -1:
+            j += 1
+        if j < len(change_list) and change_list[j][0] == -1:
+            return (i, j)
+        return (i, i)
+    return None
+
+
 def suggest_linear_region(change_list):
     zero_regions = []
     for pair in change_list:
         if pair[0] == 0:
             zero_regions.append(pair[1])
+    transition = find_transition(change_list)
+    if transition is not None:
+        # the Tg model steps down from the baseline below Tg, so the baseline is the liquid above the transition
+        after = [pair[1] for pair in change_list[transition[1] + 1:] if pair[0] == 0]
+        zero_regions = after or zero_regions
     return sorted(zero_regions, reverse=True, key=lambda region: region[1] - region[0])[0]
 
 
 def suggest_tg_region(change_list):
-    for i, pair in enumerate(change_list):
-        if i != len(change_list):
-            # print(pair[0])
-            # print(change_list[i+1][0])
-            try:
-                if pair[0] == 1 and change_list[i + 1][0] == -1:
-                    return (pair[1][0], change_list[i + 2][1][1])
-            except:
-                return change_list[0][1]
-    return change_list[0][1]
+    # From the start of the transition, moved back into the glass by the transition's own length so the fit sees
+    # the glass level, to the end of the run after it. None when no transition is found, the window is then
+    # left to the user rather than guessed.
+    transition = find_transition(change_list)
+    if transition is None:
+        return None
+    i, j = transition
+    start = change_list[i][1][0]
+    if i > 0:
+        start = max(change_list[i - 1][1][0], start - (change_list[j][1][1] - start))
+    end = change_list[j + 1][1][1] if j + 1 < len(change_list) else change_list[j][1][1]
+    return (start, end)
@@ -0,0 +1,188 @@
+import numpy as np
+
+# Level of detail plotting for long traces. A LevelOfDetail keeps, for buckets of base, 2 * base, 4 * base, ...
+# samples, the index of each bucket's minimum and maximum, so any x range can be drawn with about two points per
+# pixel column without touching every sample. Drawn that way a trace keeps its envelope, peaks and spikes.
+default_base = 4
+# below this many samples per pixel column the raw samples are drawn
+raw_per_pixel = 2
+
+
+def bucket_extremes(values, indices, bucket, extreme):
+    # For consecutive groups of bucket entries of indices, the index whose value is extreme (np.argmin/np.argmax)
+    count = -(-len(indices) // bucket)
+    padded = np.empty(count * bucket, dtype=indices.dtype)
+    padded[:len(indices)] = indices
+    padded[len(indices):] = indices[-1]
+    groups = padded.reshape(count, bucket)
+    return groups[np.arange(count), extreme(values[groups], axis=1)]
+
+
+def first_extremes(values, bucket, extreme):
+    # bucket_extremes over every sample, reshaping values instead of gathering them
+    count = -(-len(values) // bucket)
+    padded = np.concatenate((values, np.repeat(values[-1:], count * bucket - len(values))))
+    return extreme(padded.reshape(count, bucket), axis=1) + np.arange(0, count * bucket, bucket)
+
+
+class LevelOfDetail():
+    def __init__(self, x, y, base=default_base):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        if len(self.x) != len(self.y):
+            raise ValueError("x and y must have the same length")
+        # searchsorted can only find the visible samples of an increasing x, others are always drawn whole
+        self.sorted = len(self.x) < 2 or bool(np.all(np.diff(self.x) >= 0))
+        # NaNs never win a bucket, an all-NaN bucket keeps its first sample and draws as a gap
+        low = np.where(np.isnan(self.y), np.inf, self.y)
+        high = np.where(np.isnan(self.y), -np.inf, self.y)
+        self.levels = []
+        if len(self.y) <= base:
+            return
+        minima = first_extremes(low, base, np.argmin)
+        maxima = first_extremes(high, base, np.argmax)
+        bucket = base
+        while True:
+            self.levels.append((bucket, minima, maxima))
+            if len(minima) <= 1:
+                break
+            # a bucket twice as wide takes the lower minimum and the higher maximum of a pair of buckets
+            minima = bucket_extremes(low, minima, 2, np.argmin)
+            maxima = bucket_extremes(high, maxima, 2, np.argmax)
+            bucket *= 2
+
+    def visible(self, x_min, x_max):
+        # Sample index range [start, end) covering x_min to x_max plus one sample either side, so lines reach the
+        # edges of the axes
+        if not self.sorted:
+            return 0, len(self.x)
+        start = max(int(np.searchsorted(self.x, x_min, side="left")) - 1, 0)
+        end = min(int(np.searchsorted(self.x, x_max, side="right")) + 1, len(self.x))
+        return start, end
+
+    def view(self, x_min=-np.inf, x_max=np.inf, pixels=1000):
+        # (x, y) to draw the range x_min to x_max at the given width, the raw slice (a view) when it is short enough
+        start, end = self.visible(x_min, x_max)
+        count = end - start
+        if count <= raw_per_pixel * max(pixels, 1) or not self.levels:
+            return self.x[start:end], self.y[start:end]
+        target = count / max(pixels, 1)
+        level = next((level for level in self.levels if level[0] >= target), self.levels[-1])
+        bucket, minima, maxima = level
+        first, last = start // bucket, -(-end // bucket)
+        lows, highs = minima[first:last], maxima[first:last]
+        # each bucket is drawn as its extremes in sample order, plus the first and last visible samples
+        indices = np.empty(2 * len(lows) + 2, dtype=lows.dtype)
+        indices[0] = start
+        indices[1:-1:2] = np.minimum(lows, highs)
+        indices[2:-1:2] = np.maximum(lows, highs)
+        indices[-1] = end - 1
+        indices = np.clip(indices, start, end - 1)
+        return self.x[indices], self.y[indices]
+
+
+class DecimatedLine():
+    # A Line2D drawn from a LevelOfDetail, re-decimated whenever its axes' x limits or the figure size change
+    def __init__(self, axes, x, y, *args, **kwargs):
+        self.axes = axes
+        self.lod = LevelOfDetail(x, y)
+        self.line, = axes.plot(*self.lod.view(pixels=self.pixels()), *args, **kwargs)
+        self.limits_callback = axes.callbacks.connect("xlim_changed", self.update)
+        self.resize_callback = axes.figure.canvas.mpl_connect("resize_event", self.update)
+
+    def pixels(self):
+        return int(self.axes.bbox.width) or 1000
+
+    def set_data(self, x, y):
+        self.lod = LevelOfDetail(x, y)
+        self.line.set_data(*self.lod.view(pixels=self.pixels()))
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.update()
+
+    def update(self, *event):
+        x_min, x_max = sorted(self.axes.get_xlim())
+        self.line.set_data(*self.lod.view(x_min, x_max, self.pixels()))
+        self.axes.figure.canvas.draw_idle()
+
+    def remove(self):
+        self.axes.callbacks.disconnect(self.limits_callback)
+        self.axes.figure.canvas.mpl_disconnect(self.resize_callback)
+        self.line.remove()
+
+
+def same_buffer(a, b):
+    a, b = np.asarray(a), np.asarray(b)
+    if a.shape != b.shape or a.dtype != b.dtype:
+        return False
+    return a.size == 0 or a.__array_interface__["data"] == b.__array_interface__["data"]
+
+
+class TracePlot():
+    # Named traces and marker sets on one axes that are updated in place. trace() only rebuilds a trace's pyramid
+    # when it is handed different arrays, markers() only moves the markers, and keep() removes everything else,
+    # so stepping through the prompts redraws what changed instead of clearing the figure.
+    def __init__(self, figure):
+        self.figure = figure
+        self.axes = None
+        self.artists = {}
+
+    def ensure_axes(self):
+        # something else cleared the figure, start over on a fresh axes
+        if self.axes is None or self.axes not in self.figure.axes:
+            self.figure.clf()
+            self.axes = self.figure.add_subplot(1, 1, 1)
+            self.artists = {}
+        return self.axes
+
+    def title(self, title):
+        self.ensure_axes().set_title(title)
+
+    def trace(self, name, x, y, **kwargs):
+        axes = self.ensure_axes()
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        current = self.artists.get(name)
+        if isinstance(current, tuple) and same_buffer(current[1], x) and same_buffer(current[2], y):
+            return
+        if current is None:
+            line = DecimatedLine(axes, x, y, **kwargs)
+        else:
+            line = current[0]
+            line.line.set(**kwargs)
+            line.set_data(x, y)
+        self.artists[name] = (line, x, y)
+
+    def markers(self, name, x, y, fmt="g^", **kwargs):
+        axes = self.ensure_axes()
+        if name in self.artists:
+            self.artists[name].set_data(x, y)
+            self.artists[name].set(**kwargs)
+        else:
+            self.artists[name], = axes.plot(x, y, fmt, **kwargs)
+
+    def keep(self, *names):
+        for name in [name for name in self.artists if name not in names]:
+            artist = self.artists.pop(name)
+            (artist[0] if isinstance(artist, tuple) else artist).remove()
+
+    def legend(self):
+        if any(artist.get_label()[:1] != "_" for artist in self.ensure_axes().get_lines()):
+            self.axes.legend()
+
+
+class NullPlot():
+    # TracePlot's interface for console-only runs, nothing is drawn and matplotlib is never imported
+    def title(self, title):
+        pass
+
+    def trace(self, name, x, y, **kwargs):
+        pass
+
+    def markers(self, name, x, y, fmt="g^", **kwargs):
+        pass
+
+    def keep(self, *names):
+        pass
+
+    def legend(self):
+        pass
@@ -0,0 +1,42 @@
+from collections import OrderedDict
+
+stage_names = ["import", "region", "segmentation", "cycles", "interpolation", "baseline", "transition", "guesses",
+               "tg_fit"]
+
+
+class StageCache():
+    # Memoizes stage outputs by a key made of the stage's own inputs and the key of the stage it reads from,
+    # so changing an upstream input gives every downstream stage a new key. The last max_entries results of
+    # each stage are kept, which makes switching back to an earlier setting a hit as well.
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = dict.fromkeys(stage_names, 0)
+        self.misses = dict.fromkeys(stage_names, 0)
+
+    def get(self, stage, key, compute, keep=None):
+        # a key of None marks inputs that cannot be hashed, the stage is then always recomputed. keep can turn
+        # down a computed value that must not be handed to later callers, it is returned but not stored.
+        entries = self.entries.setdefault(stage, OrderedDict())
+        if key is not None and key in entries:
+            entries.move_to_end(key)
+            self.hits[stage] = self.hits.get(stage, 0) + 1
+            return entries[key]
+        self.misses[stage] = self.misses.get(stage, 0) + 1
+        value = compute()
+        if key is not None and (keep is None or keep(value)):
+            entries[key] = value
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        return value
+
+    def invalidate(self, stage=None):
+        if stage is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(stage, None)
+
+    def statistics(self):
+        return {stage: {"hits": self.hits.get(stage, 0), "misses": self.misses.get(stage, 0),
+                        "entries": len(self.entries.get(stage, ()))}
+                for stage in list(dict.fromkeys(stage_names + list(self.hits)))}
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from cache import default_cache_dir
+from lazy import lazy_import
+
+optimize = lazy_import("scipy.optimize")
+
+default_store_path = os.path.join(default_cache_dir, "fits.sqlite")
+# warm starts only come from stored fits whose Tg window ends each moved less than this many degrees
+default_max_shift = 10.
+schema = """
+CREATE TABLE IF NOT EXISTS fits (
+    id INTEGER PRIMARY KEY,
+    request TEXT UNIQUE NOT NULL,
+    file_hash TEXT NOT NULL,
+    name TEXT,
+    method TEXT,
+    tg_start REAL,
+    tg_end REAL,
+    inputs TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    error REAL,
+    nfev INTEGER,
+    njev INTEGER,
+    wall_s REAL,
+    success INTEGER,
+    created REAL
+);
+CREATE INDEX IF NOT EXISTS fits_file ON fits (file_hash, method);
+CREATE INDEX IF NOT EXISTS fits_name ON fits (name, method);
+"""
+
+
+def request_key(inputs):
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=float).encode("utf-8")).hexdigest()
+
+
+class FitStore():
+    # Fitted Tg models in an SQLite file, one row per fit request. inputs is a JSON serializable dict describing
+    # the request, it needs "file_hash", "name", "method" and "tg_window" ([start, end] in °C) and may hold
+    # anything else the result depends on (regions, interpolation settings, guesses, bounds). Identical inputs
+    # are an exact hit, fits of the same file or material with a nearby Tg window are warm-start candidates.
+    def __init__(self, path=default_store_path, max_shift=default_max_shift):
+        self.path = path
+        self.max_shift = max_shift
+        self.hits = 0
+        self.warm_starts = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # batch workers write to the same file, so wait for their locks rather than failing
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.executescript(schema)
+
+    def __reduce__(self):
+        return (FitStore, (self.path, self.max_shift))
+
+    def lookup(self, inputs):
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM fits WHERE request = ?", (request_key(inputs),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return stored_fit(row, "stored")
+
+    def nearest(self, inputs):
+        # The stored fit of the same file, or failing that the same material, whose Tg window is closest
+        start, end = inputs["tg_window"]
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM fits WHERE method = ? AND (file_hash = ? OR name = ?) AND success = 1 "
+                "AND abs(tg_start - ?) <= ? AND abs(tg_end - ?) <= ? "
+                "ORDER BY file_hash != ?, abs(tg_start - ?) + abs(tg_end - ?), error LIMIT 1",
+                (inputs["method"], inputs["file_hash"], inputs["name"], start, self.max_shift, end, self.max_shift,
+                 inputs["file_hash"], start, end)).fetchone()
+        if row is None:
+            return None
+        self.warm_starts += 1
+        return stored_fit(row, "warm")
+
+    def record(self, inputs, fit):
+        start, end = inputs["tg_window"]
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO fits (request, file_hash, name, method, tg_start, tg_end, inputs, parameters, "
+                "error, nfev, njev, wall_s, success, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (request_key(inputs), inputs["file_hash"], inputs["name"], inputs["method"], float(start), float(end),
+                 json.dumps(inputs, sort_keys=True, default=float), json.dumps([float(value) for value in fit.x]),
+                 float(fit.fun), int(fit.nfev), int(fit.get("njev", 0) or 0), float(fit.wall_time),
+                 int(bool(fit.success)), time.time()))
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute("SELECT count(*) FROM fits").fetchone()[0]
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM fits")
+
+    def close(self):
+        self.connection.close()
+
+
+def stored_fit(row, source):
+    # A stored row as the OptimizeResult the fits return. source is "stored" for an exact hit and "warm" for a
+    # warm-start candidate; the evaluation counts and wall time are those of the original fit.
+    (id, request, file_hash, name, method, tg_start, tg_end, inputs, parameters, error, nfev, njev, wall_s, success,
+     created) = row
+    return optimize.OptimizeResult(x=np.array(json.loads(parameters)), fun=error, nfev=nfev, njev=njev,
+                                   nit=nfev, success=bool(success), status=0, message="Stored fit %d" % id,
+                                   wall_time=wall_s, method=method, source=source, store_id=id,
+                                   inputs=json.loads(inputs))
+
+
+def store_from_args(path=None):
+    # --store without a path uses default_store_path through the flag's const
+    if not path:
+        return None
+    return FitStore(path)
@@ -0,0 +1,165 @@
+import argparse
+import json
+
+import numpy as np
+from scipy.special import erf
+
+import processing
+
+temp_heading = "Temperature (°C)"
+cp_heading = "Heat Capacity (mJ/°C)"
+time_heading = "Time (min)"
+chunk_rows = 1000000
+
+
+def generate_trace(rows=10000, tg=80., width=2., step_height=.3, overshoot=.2, overshoot_offset=2.,
+                   overshoot_width=2., baseline_slope=.002, baseline_intercept=1., noise=.0003, start_temp=25.,
+                   end_temp=170., heating_rate=10., hold_fraction=.1, edge_rows=10, sample_mass=10., seed=None):
+    # A heat between two isothermal holds. During the heat cp per mass follows the linear liquid baseline above
+    # tg and sits step_height below it in the glass, with a smoothed step of the given width and a Gaussian
+    # enthalpy overshoot just above tg, the shape fit_tg_model describes. During the holds
+    # the heat capacity signal is zero, rising and falling over edge_rows samples at the ends of the heat.
+    # Returns (time, temperature, cp) arrays in the units of an export and the ground truth.
+    rng = np.random.default_rng(seed)
+    hold_rows = int(rows * hold_fraction)
+    ramp_rows = rows - 2 * hold_rows
+    if ramp_rows < 2 * edge_rows + 2:
+        raise ValueError("Too few rows for the requested holds")
+    temp = np.empty(rows)
+    temp[:hold_rows] = start_temp
+    temp[hold_rows:hold_rows + ramp_rows] = np.linspace(start_temp, end_temp, ramp_rows)
+    temp[hold_rows + ramp_rows:] = end_temp
+    ramp_minutes = (end_temp - start_temp) / heating_rate
+    time = np.arange(rows) * (ramp_minutes / (ramp_rows - 1))
+
+    cp = transition_cp(temp, tg, width, step_height, overshoot, overshoot_offset, overshoot_width, baseline_slope,
+                       baseline_intercept)
+    index = np.arange(rows)
+    envelope = np.clip((index - hold_rows) / float(edge_rows), 0, 1)
+    envelope *= np.clip((hold_rows + ramp_rows - index) / float(edge_rows), 0, 1)
+    cp *= envelope
+    cp += rng.normal(0, noise, rows)
+    cp *= sample_mass
+
+    transition_half_width = 4 * max(width, overshoot_width) + abs(overshoot_offset)
+    truth = {"rows": rows, "tg": tg, "width": width, "step_height": step_height, "overshoot": overshoot,
+             "overshoot_temp": tg + overshoot_offset, "overshoot_width": overshoot_width,
+             "baseline_slope": baseline_slope, "baseline_intercept": baseline_intercept, "noise": noise,
+             "sample_mass": sample_mass, "start_temp": start_temp, "end_temp": end_temp,
+             "region": [hold_rows + edge_rows, hold_rows + ramp_rows - edge_rows - 1],
+             "linear_window": [tg + transition_half_width, end_temp - 5],
+             "tg_window": [tg - transition_half_width, min(tg + transition_half_width, end_temp - 5)]}
+    return time, temp, cp, truth
+
+
+def transition_cp(temp, tg, width, step_height, overshoot, overshoot_offset, overshoot_width, baseline_slope,
+                  baseline_intercept):
+    cp = baseline_slope * temp + baseline_intercept
+    cp -= step_height * .5 * (1 - erf((temp - tg) / width))
+    cp += overshoot * np.exp(-np.square((temp - tg - overshoot_offset) / overshoot_width))
+    return cp
+
+
+def generate_cycle_trace(cycles=2, rows=30000, tg=80., width=2., step_height=.3, overshoot=.2,
+                         overshoot_offset=2., overshoot_width=2., baseline_slope=.002, baseline_intercept=1.,
+                         noise=.0003, start_temp=25., end_temp=170., rate=10., hold_fraction=.05, edge_rows=10,
+                         sample_mass=10., seed=None):
+    # Heat-cool-heat... with cycles heats, every ramp between isothermal holds. Ramps carry the same cp as
+    # generate_trace, cools without the enthalpy overshoot, and the signal is zero in the holds. The truth lists
+    # every ramp's kind, number and rows (without the edge rows) in the order they are run.
+    rng = np.random.default_rng(seed)
+    kinds = ["heat" if i % 2 == 0 else "cool" for i in range(0, 2 * cycles - 1)]
+    hold_rows = int(rows * hold_fraction)
+    ramp_rows = (rows - (len(kinds) + 1) * hold_rows) // len(kinds)
+    if ramp_rows < 2 * edge_rows + 2:
+        raise ValueError("Too few rows for the requested cycles")
+    temp = []
+    cp = []
+    ramps = []
+    counts = {}
+    position = 0
+    for kind in kinds:
+        hold_temp = start_temp if kind == "heat" else end_temp
+        temp.append(np.full(hold_rows, hold_temp))
+        cp.append(np.zeros(hold_rows))
+        position += hold_rows
+        ramp = np.linspace(start_temp, end_temp, ramp_rows)
+        if kind == "cool":
+            ramp = ramp[::-1]
+        ramp_cp = transition_cp(ramp, tg, width, step_height, overshoot if kind == "heat" else 0, overshoot_offset,
+                                overshoot_width, baseline_slope, baseline_intercept)
+        index = np.arange(ramp_rows)
+        ramp_cp *= np.clip(np.minimum(index, ramp_rows - 1 - index) / float(edge_rows), 0, 1)
+        temp.append(ramp)
+        cp.append(ramp_cp)
+        counts[kind] = counts.get(kind, 0) + 1
+        ramps.append({"kind": kind, "number": counts[kind],
+                      "rows": [position + edge_rows, position + ramp_rows - edge_rows - 1]})
+        position += ramp_rows
+    temp.append(np.full(hold_rows, end_temp if kinds[-1] == "heat" else start_temp))
+    cp.append(np.zeros(hold_rows))
+    temp = np.concatenate(temp)
+    cp = (np.concatenate(cp) + rng.normal(0, noise, len(temp))) * sample_mass
+    time = np.arange(len(temp)) * ((end_temp - start_temp) / rate / (ramp_rows - 1))
+    truth = {"rows": len(temp), "cycles": cycles, "tg": tg, "width": width, "step_height": step_height,
+             "overshoot_temp": tg + overshoot_offset, "sample_mass": sample_mass, "start_temp": start_temp,
+             "end_temp": end_temp, "rate": rate, "ramps": ramps}
+    return time, temp, cp, truth
+
+
+def format_rows(time, temp, cp):
+    return "".join("%.5f\t%.4f\t%.6f\r\n" % row for row in zip(time.tolist(), temp.tolist(), cp.tolist()))
+
+
+def write_dsc_export(path, time, temp, cp, sample_mass, name="synthetic"):
+    # Writes the UTF-16 tab separated layout import_dsc_data reads: header lines, Sig1..Sig3 and StartOfData
+    with open(path, "w", encoding="utf-16", newline="") as export:
+        export.write("Filename\t%s.001\r\n" % name)
+        export.write("Sample\t%s\r\n" % name)
+        export.write("%s\t%.4f\tmg\r\n" % (processing.sample_mass_line, sample_mass))
+        for heading_name, heading in zip(processing.header_names, [time_heading, temp_heading, cp_heading]):
+            export.write("%s\t%s\r\n" % (heading_name, heading))
+        export.write(processing.data_start_line + "\r\n")
+        for start in range(0, len(time), chunk_rows):
+            end = start + chunk_rows
+            export.write(format_rows(time[start:end], temp[start:end], cp[start:end]))
+
+
+def generate_dsc_file(path, name="synthetic", **options):
+    time, temp, cp, truth = generate_trace(**options)
+    write_dsc_export(path, time, temp, cp, truth["sample_mass"], name=name)
+    return truth
+
+
+def generate_cycle_file(path, name="synthetic", **options):
+    time, temp, cp, truth = generate_cycle_trace(**options)
+    write_dsc_export(path, time, temp, cp, truth["sample_mass"], name=name)
+    return truth
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", type=str, help="DSC export to write")
+    parser.add_argument("-r", "--rows", type=int, default=10000, help="Number of data rows")
+    parser.add_argument("-tg", "--tg", type=float, default=80., help="Glass transition temperature")
+    parser.add_argument("-w", "--width", type=float, default=2., help="Width of the glass transition step")
+    parser.add_argument("-sh", "--step_height", type=float, default=.3, help="Drop in cp per mass across Tg")
+    parser.add_argument("-o", "--overshoot", type=float, default=.2, help="Height of the enthalpy overshoot")
+    parser.add_argument("-n", "--noise", type=float, default=.0003, help="Standard deviation of cp noise")
+    parser.add_argument("-bs", "--baseline_slope", type=float, default=.002, help="Slope of the cp baseline")
+    parser.add_argument("-m", "--sample_mass", type=float, default=10., help="Sample mass in mg")
+    parser.add_argument("-s", "--seed", type=int, help="Random seed for the noise")
+    parser.add_argument("-c", "--cycles", type=int, default=1, help="Heats in a heat-cool-heat... program")
+    args = parser.parse_args()
+
+    if args.cycles > 1:
+        truth = generate_cycle_file(args.file, cycles=args.cycles, rows=args.rows, tg=args.tg, width=args.width,
+                                    step_height=args.step_height, overshoot=args.overshoot, noise=args.noise,
+                                    baseline_slope=args.baseline_slope, sample_mass=args.sample_mass,
+                                    seed=args.seed)
+        print(json.dumps(truth, indent=2))
+        raise SystemExit()
+    truth = generate_dsc_file(args.file, rows=args.rows, tg=args.tg, width=args.width, step_height=args.step_height,
+                              overshoot=args.overshoot, noise=args.noise, baseline_slope=args.baseline_slope,
+                              sample_mass=args.sample_mass, seed=args.seed)
+    print(json.dumps(truth, indent=2))
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# the modules live in the repository root and are imported by name, as the scripts import each other
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def export(tmp_path):
+    # A single-heat synthetic export with Tg at 80 °C and its ground truth
+    import synthetic
+
+    path = str(tmp_path / "export.txt")
+    return path, synthetic.generate_dsc_file(path, rows=10000, tg=80., seed=1)
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+import baseline
+
+
+def test_exact_fit_matches_batched_windows():
+    rng = np.random.default_rng(0)
+    temp = np.linspace(90, 160, 300)
+    cp = .004 * temp + 1.2 + rng.normal(0, .002, len(temp))
+    windows = [(0, 299), (10, 50), (120, 121), (200, 290)]
+    params, errors = baseline.fit_baselines(temp, cp, windows)
+    for (start, end), window_params, error in zip(windows, params, errors):
+        exact_params, exact_error = baseline.fit_baseline(temp[start:end + 1], cp[start:end + 1])
+        assert np.allclose(window_params, exact_params, rtol=1e-8, atol=1e-8)
+        # prefix sums leave about sqrt(machine epsilon) of cancellation in the error of an exact fit
+        assert error == pytest.approx(exact_error, rel=1e-6, abs=1e-6)
+
+
+def test_degenerate_windows_are_rejected_by_both():
+    for temp in ([80.1], [.1, .1, .1], [80.3] * 4):
+        cp = [3.] * len(temp)
+        with pytest.raises(ValueError):
+            baseline.fit_baseline(temp, cp)
+        params, errors = baseline.fit_baselines(temp, cp, [(0, len(temp) - 1)])
+        assert np.isnan(params).all() and np.isnan(errors).all()
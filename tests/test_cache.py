@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+
+import processing
+from cache import DSCCache
+
+
+def test_cache_round_trip(export, tmp_path):
+    path, _ = export
+    cache = DSCCache(cache_dir=str(tmp_path / "cache"))
+    parsed = processing.import_dsc_data(path)
+    first = cache.load(path)
+    second = cache.load(path)
+    assert (cache.misses, cache.hits) == (1, 1)
+    for data in (first, second):
+        assert (data.name, data.sample_mass) == (parsed.name, parsed.sample_mass)
+        assert list(data.data_frame.columns) == list(parsed.data_frame.columns)
+        assert np.array_equal(data.data_frame.to_numpy(dtype=float), parsed.data_frame.to_numpy(dtype=float))
+
+
+def test_cache_follows_the_file_contents(export, tmp_path):
+    path, _ = export
+    cache = DSCCache(cache_dir=str(tmp_path / "cache"))
+    cache.load(path)
+    # touched but unchanged: the content hash keeps the entry
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cache.load(path)
+    assert (cache.misses, cache.hits) == (1, 1)
+    # rewritten with other data of the same size: parsed again
+    with open(path, "r+b") as export_file:
+        contents = export_file.read()
+        export_file.seek(0)
+        export_file.write(contents.replace("25.0000".encode("utf-16-le"), "26.0000".encode("utf-16-le")))
+    data = cache.load(path)
+    assert (cache.misses, cache.hits) == (2, 1)
+    assert data.data_frame[processing.temp_heading].iloc[0] == 26.
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import fitting
+import processing
+from benchmark import synthetic_transition
+
+# off the temperature grid, so no sample sits on the switch between the enthalpy terms
+guesses = np.array([79.3, 2.6, .45, 84.0123, 3.7, .06, .15])
+
+
+@pytest.fixture
+def workspace():
+    temps, observed, linear_model = synthetic_transition(400, np.random.default_rng(0))
+    return fitting.ModelWorkspace(temps, observed, linear_model)
+
+
+def test_evaluate_matches_reference(workspace):
+    reference = processing.evaluate_tg_model_reference(workspace.temps, workspace.baseline, guesses,
+                                                       workspace.magic_number)[0]
+    assert np.allclose(workspace.evaluate(guesses), reference, rtol=1e-12, atol=1e-12)
+
+
+def test_jacobian_matches_finite_differences(workspace):
+    jacobian = workspace.jacobian(guesses).copy()
+    differences = np.empty_like(jacobian)
+    for column in range(0, len(guesses)):
+        step = 1e-6 * max(1, abs(guesses[column]))
+        up, down = guesses.copy(), guesses.copy()
+        up[column] += step
+        down[column] -= step
+        differences[:, column] = (workspace.residuals(up).copy() - workspace.residuals(down).copy()) / (2 * step)
+    assert np.allclose(jacobian, differences, rtol=1e-5, atol=1e-7)
+
+
+def test_evaluate_batch_matches_single_evaluations(workspace):
+    parameters = guesses + np.random.default_rng(1).normal(0, .3, (25, 7))
+    models, errors = workspace.evaluate_batch(parameters, chunk_rows=7)
+    for row, parameter_set in enumerate(parameters):
+        assert np.array_equal(models[row], workspace.evaluate(parameter_set))
+        assert errors[row] == workspace.error(parameter_set)
+
+
+def test_fits_from_initial_guesses_recover_tg(workspace):
+    # the generating Tg of synthetic_transition is 80
+    start = fitting.initial_guesses(workspace).x
+    for method in ["trf", "lm", "minimize"]:
+        if method == "minimize":
+            fit = fitting.fit_tg_minimize(workspace, list(start))
+        else:
+            fit = fitting.fit_tg_least_squares(workspace, start, method=method)
+        assert abs(fit.x[0] - 80) < .5, method
@@ -0,0 +1,65 @@
+import pytest
+
+import batch
+import synthetic
+from model import DSCModel
+from store import FitStore
+
+# the model's step sits about .25 °C below the generator's erf midpoint
+tg_tolerance = .5
+
+
+def fit_unattended(model, method="trf"):
+    model.guess_interest_region()
+    model.accept_interest_region()
+    model.interpolate()
+    assert model.guess_linear_region()
+    model.fit_linear_model()
+    assert model.guess_tg_region()
+    model.guess_fit_parameters()
+    model.fit_tg_model(method=method)
+    return model
+
+
+@pytest.mark.parametrize("tg", [40., 80., 120.])
+def test_unattended_fit_recovers_tg(tmp_path, tg):
+    path = str(tmp_path / "export.txt")
+    truth = synthetic.generate_dsc_file(path, rows=10000, tg=tg, seed=2)
+    model = fit_unattended(DSCModel(path))
+    temps = model.interped[synthetic.temp_heading]
+    assert temps[model.tg_region_start] < tg < temps[model.tg_region_end]
+    assert abs(model.gaus_model.x[0] - truth["tg"]) < tg_tolerance
+    assert model.check_tg_fit() is None
+
+
+def test_window_without_a_transition_is_rejected(export):
+    path, _ = export
+    model = fit_unattended(DSCModel(path))
+    temps = model.interped[synthetic.temp_heading]
+    model.tg_region_start, model.tg_region_end = model.most_close_index(35, temps), model.most_close_index(70, temps)
+    model.fit_tg_model()
+    assert model.check_tg_fit() is not None
+
+
+def test_every_cycle_segment_recovers_tg(tmp_path):
+    path = str(tmp_path / "cycles.txt")
+    synthetic.generate_cycle_file(path, cycles=2, rows=20000, tg=90., seed=3)
+    segments, failed = batch.split_file(path, {"no_cache": True})
+    assert failed is None
+    assert [batch.segment_label(segment) for segment in segments] == ["heat 1", "cool 1", "heat 2"]
+    for segment in segments:
+        row = batch.fit_file(path, {"no_cache": True}, segment)
+        assert row["status"] == "ok", row["message"]
+        assert abs(row["t_g"] - 90.) < tg_tolerance
+
+
+def test_store_returns_an_identical_request(export, tmp_path):
+    path, _ = export
+    store = FitStore(str(tmp_path / "fits.sqlite"))
+    first = fit_unattended(DSCModel(path, store=store)).gaus_model
+    second = fit_unattended(DSCModel(path, store=store)).gaus_model
+    assert (first.source, second.source) == ("fit", "stored")
+    assert (store.hits, store.count()) == (1, 1)
+    assert list(second.x) == list(first.x)
+    assert second.fun == first.fun
+    store.close()
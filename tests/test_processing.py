@@ -0,0 +1,37 @@
+import numpy as np
+
+import processing
+from processing import cp_heading, temp_heading, time_heading
+
+
+def test_importer_matches_legacy(export):
+    path, truth = export
+    legacy = processing.import_dsc_data_legacy(path)
+    data = processing.import_dsc_data(path)
+    assert (data.name, data.sample_mass) == (legacy.name, legacy.sample_mass)
+    assert list(data.data_frame.columns) == list(legacy.data_frame.columns)
+    # the legacy loop appends every row once per column, the columnar importer keeps each row once
+    columns = len(legacy.data_frame.columns)
+    assert np.array_equal(data.data_frame.to_numpy(dtype=float),
+                          legacy.data_frame.iloc[::columns].to_numpy(dtype=float))
+    assert len(data.data_frame) == truth["rows"]
+
+
+def test_streamed_window_matches_select_between_range(export):
+    path, _ = export
+    data = processing.import_dsc_data(path).data_frame
+    expected = processing.select_between_range(data, 2., 9., time_heading)
+    columns = [time_heading, temp_heading, cp_heading]
+    for stop_past_end in (False, True):
+        streamed = processing.import_dsc_data_window(path, columns=columns, window=(time_heading, 2., 9.),
+                                                     stop_past_end=stop_past_end, chunk_rows=1000).data_frame
+        assert np.array_equal(streamed.to_numpy(dtype=float), expected[columns].to_numpy(dtype=float))
+
+
+def test_segmentation_matches_legacy(export):
+    path, _ = export
+    cp = processing.import_dsc_data(path).data_frame[cp_heading].to_numpy(dtype=float)
+    scaled, changes = processing.bin_first_deriv(cp)
+    legacy_scaled, legacy_changes = processing.bin_first_deriv_legacy(cp.copy())
+    assert np.array_equal(scaled, legacy_scaled)
+    assert changes == legacy_changes
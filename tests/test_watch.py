@@ -0,0 +1,145 @@
+import csv
+import os
+import shutil
+import subprocess
+import sys
+
+from batch import ResultWriter
+from watch import Watcher, recorded_hashes
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+settle = 2.
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+# attempts per file name, fits run in the test process with workers=1
+attempts = {}
+
+
+def fake_fit(file, options):
+    # fits every file, except that a file named flaky* fails like a locked file on its first attempt
+    name = os.path.basename(file)
+    attempts[name] = attempts.get(name, 0) + 1
+    if name.startswith("flaky") and attempts[name] == 1:
+        return {"file": file, "name": name, "status": "failed", "message": "import: OSError: file is locked"}
+    return {"file": file, "name": name, "status": "ok", "message": "", "t_g": 80.}
+
+
+def watcher(directory, output, clock, **options):
+    attempts.clear()
+    writer = ResultWriter(str(output), append=True)
+    return writer, Watcher([str(directory)], writer, workers=1, settle=settle, clock=clock, fit=fake_fit,
+                           seen=recorded_hashes(str(output)), **options)
+
+
+def rows(output):
+    with open(output, newline="", encoding="utf-8") as table:
+        return list(csv.DictReader(table))
+
+
+def poll_at(watcher, clock, now):
+    clock.now = now
+    watcher.poll()
+
+
+def test_file_is_fitted_once_it_settles(tmp_path):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    clock = Clock()
+    writer, watch = watcher(inbox, tmp_path / "results.csv", clock)
+    export = inbox / "a.txt"
+    export.write_bytes(b"first half")
+    poll_at(watch, clock, 0.)
+    poll_at(watch, clock, settle - .5)
+    assert watch.counts["fitted"] == 0
+    # still being written: the settle time starts again from the new size
+    with open(export, "ab") as partial:
+        partial.write(b" and the rest")
+    poll_at(watch, clock, settle + .5)
+    poll_at(watch, clock, 2 * settle)
+    assert watch.counts["fitted"] == 0
+    poll_at(watch, clock, 2 * settle + 1.)
+    writer.close()
+    assert watch.counts["fitted"] == 1
+    assert watch.idle()
+
+
+def test_same_content_is_fitted_once(tmp_path):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    output = tmp_path / "results.csv"
+    (inbox / "a.txt").write_bytes(b"one export")
+    shutil.copy(inbox / "a.txt", inbox / "b.txt")
+    clock = Clock()
+    writer, watch = watcher(inbox, output, clock)
+    poll_at(watch, clock, 0.)
+    poll_at(watch, clock, settle)
+    writer.close()
+    assert (watch.counts["fitted"], watch.counts["skipped"]) == (1, 1)
+    # after a restart the hash is read back from the table, a copy under a new name is skipped too
+    shutil.copy(inbox / "a.txt", inbox / "c.txt")
+    writer, watch = watcher(inbox, output, clock)
+    poll_at(watch, clock, 10.)
+    poll_at(watch, clock, 10. + settle)
+    writer.close()
+    assert (watch.counts["fitted"], watch.counts["skipped"]) == (0, 3)
+    assert len(rows(output)) == 1
+
+
+def test_transient_failure_is_retried(tmp_path):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    output = tmp_path / "results.csv"
+    (inbox / "flaky.txt").write_bytes(b"locked at first")
+    clock = Clock()
+    writer, watch = watcher(inbox, output, clock, retries=2, retry_delay=1.)
+    poll_at(watch, clock, 0.)
+    poll_at(watch, clock, settle)
+    assert watch.counts["retried"] == 1
+    assert not watch.idle()
+    poll_at(watch, clock, settle + .5)
+    assert watch.counts["fitted"] == 0
+    poll_at(watch, clock, settle + 1.)
+    writer.close()
+    assert watch.counts["fitted"] == 1
+    [row] = rows(output)
+    assert (row["status"], row["attempts"]) == ("ok", "2")
+
+
+def test_empty_file_does_not_keep_the_watcher_busy(tmp_path):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    (inbox / "empty.txt").write_bytes(b"")
+    clock = Clock()
+    writer, watch = watcher(inbox, tmp_path / "results.csv", clock)
+    poll_at(watch, clock, 0.)
+    poll_at(watch, clock, settle)
+    assert watch.idle()
+    # written to later, it is fitted like any other file
+    (inbox / "empty.txt").write_bytes(b"now an export")
+    poll_at(watch, clock, 2 * settle)
+    poll_at(watch, clock, 3 * settle)
+    writer.close()
+    assert watch.counts["fitted"] == 1
+
+
+def test_once_exits_when_the_directory_is_done(tmp_path):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    (inbox / "empty.txt").write_bytes(b"")
+    (inbox / "junk.txt").write_bytes(b"not a DSC export")
+    output = tmp_path / "results.csv"
+    finished = subprocess.run([sys.executable, "watch.py", str(inbox), "-o", str(output), "--once", "-j", "1",
+                               "--settle", ".1", "--interval", ".1", "--retries", "0", "--no-cache"],
+                              cwd=root, capture_output=True, text=True, timeout=60)
+    assert finished.returncode == 0, finished.stderr
+    assert "1 failed" in finished.stdout
+    [row] = rows(output)
+    assert row["name"] == "junk.txt" and row["status"] == "failed"
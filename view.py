@@ -1,39 +1,337 @@
+import argparse
+import queue
+import threading
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import filedialog
+
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.figure import Figure
 import numpy as np
 
+import fitting
+from cache import cache_from_args
+from model import DSCModel
+from render import DecimatedLine
+
+temp_heading = "Temperature (°C)"
+cp_heading = "Heat Capacity (mJ/°C)"
+time_heading = "Time (min)"
+# how often the Tk loop drains worker messages, in ms
+poll_interval = 40
+# pixels within which a press grabs a boundary line
+grab_tolerance = 8
+
+
+def load_model(file, cache, stop, report):
+    model = DSCModel(file, cache=cache)
+    report("loaded", {"model": model, "time": model.full_data[time_heading], "cp": model.full_data[cp_heading]})
+
+
+def analyse(model, settings, stop, report):
+    # The controller.py steps without the prompts, run on the worker thread. settings["region"] (indices) and
+    # settings["tg_window"] (°C) are guessed when None. The model's stage cache makes the steps whose inputs
+    # did not change hits, so dragging the Tg window only refits the transition.
+    def checkpoint():
+        if stop.is_set():
+            raise fitting.FitCancelled()
+
+    if settings["region"] is None:
+        model.guess_interest_region()
+    else:
+        model.region_start_index, model.region_end_index = settings["region"]
+    report("region", (int(model.region_start_index), int(model.region_end_index)))
+    checkpoint()
+    model.accept_interest_region()
+    model.interpolate()
+    checkpoint()
+    if not model.guess_linear_region():
+        raise ValueError("No linear region found")
+    model.fit_linear_model()
+    checkpoint()
+    temps = model.interped[temp_heading]
+    if settings["tg_window"] is None:
+        if not model.guess_tg_region():
+            raise ValueError("No glass transition region found")
+    else:
+        model.tg_region_start, model.tg_region_end = (model.most_close_index(value, temps)
+                                                      for value in settings["tg_window"])
+    model.guess_fit_parameters()
+    report("transition", {"interped_temp": temps.copy(), "interped_cp": model.interped[cp_heading].copy(),
+                          "linear_model": model.lin_model_params.copy(),
+                          "tg_window": (float(temps[model.tg_region_start]), float(temps[model.tg_region_end])),
+                          "workspace": model.workspace.copy(), "guesses": np.array(model.prepare_tg_fit())})
+    checkpoint()
+
+    def progress(guesses):
+        checkpoint()
+        report("progress", np.array(guesses, dtype=float))
+
+    model.fit_tg_model(method=settings["method"], callback=progress)
+    report("fitted", model.gaus_model)
+
+
+class AnalysisWorker():
+    # Runs jobs on one background thread and hands their messages to the Tk loop through a queue. Submitting a
+    # job cancels the one in flight, and messages from any job but the latest are dropped when drained.
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.messages = queue.Queue()
+        self.job = 0
+        self.stop = threading.Event()
+
+    def submit(self, function, *args):
+        self.cancel()
+        self.job += 1
+        job = self.job
+        stop = self.stop = threading.Event()
+
+        def report(kind, value):
+            self.messages.put((job, kind, value))
+
+        def run():
+            try:
+                function(*args, stop, report)
+            except fitting.FitCancelled:
+                report("cancelled", None)
+            except Exception as error:
+                report("error", "%s: %s" % (type(error).__name__, error))
+
+        self.executor.submit(run)
+
+    def cancel(self):
+        self.stop.set()
+
+    def drain(self):
+        # (kind, value) of the latest job's messages, only the last progress message of a burst is kept
+        drained = []
+        while True:
+            try:
+                job, kind, value = self.messages.get_nowait()
+            except queue.Empty:
+                return drained
+            if job != self.job:
+                continue
+            if kind == "progress" and drained and drained[-1][0] == "progress":
+                drained[-1] = (kind, value)
+            else:
+                drained.append((kind, value))
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
+
 
 class MainFrame(tk.Frame):
-    def __init__(self, master=None):
+    def __init__(self, master=None, file=None, cache=None):
         tk.Frame.__init__(self, master)
-        self.plot = DataPlot(self)
+        self.cache = cache
+        self.model = None
+        self.settings = {"region": None, "tg_window": None, "method": "trf"}
+        self.worker = AnalysisWorker()
+        self.preview = None
+
+        button_frame = tk.Frame(self)
+        self.open_button = tk.Button(button_frame, text="Open", command=self.open_file)
+        self.fit_button = tk.Button(button_frame, text="Refit", command=self.refit, state=tk.DISABLED)
+        self.cancel_button = tk.Button(button_frame, text="Cancel", command=self.cancel)
+        self.method = tk.StringVar(self, value="trf")
+        self.method_menu = tk.OptionMenu(button_frame, self.method, "trf", "dogbox", "lm", "minimize",
+                                         command=self.change_method)
+        self.status = tk.StringVar(self, value="Open a DSC file")
+        self.status_label = tk.Label(button_frame, textvariable=self.status, anchor="w")
+        self.open_button.grid(row=0, column=0)
+        self.fit_button.grid(row=0, column=1)
+        self.cancel_button.grid(row=0, column=2)
+        self.method_menu.grid(row=0, column=3)
+        self.status_label.grid(row=0, column=4, sticky="w")
+        button_frame.pack(fill=tk.X)
+
+        self.plot = DataPlot(self, on_moved=self.boundary_moved, on_grabbed=self.cancel)
         self.plot.draw()
-        self.plot.get_tk_widget().pack()
+        self.plot.get_tk_widget().pack(fill=tk.BOTH, expand=True)
         self.tool_bar = NavigationToolbar2Tk(self.plot, self)
         self.tool_bar.update()
-        self.plot.get_tk_widget().pack()
-
-        # button_frame = tk.Label(self)
-        # self.param_1_label = tk.Label(button_frame, text = "Parameter 1")
-        # self.param_1_box = tk.Entry(button_frame)
-        # self.param_2_label = tk.Label(button_frame, text="Parameter 2")
-        # self.param_2_box = tk.Entry(button_frame)
-        # self.accept_button = tk.Button(button_frame, text = "Accept Paramters")
-        #
-        #
-        # self.param_1_label.grid(row=0, column =0)
-        # self.param_1_box.grid(row=1, column =0)
-        # self.param_2_label.grid(row=2, column =0)
-        # self.param_2_box.grid(row=3, column =0)
-        # self.accept_button.grid(row=3, column =1)
-        # button_frame.pack()
-        self.grid()
+        self.pack(fill=tk.BOTH, expand=True)
+        self.after(poll_interval, self.poll)
+        if file is not None:
+            self.load(file)
+
+    def open_file(self):
+        file = filedialog.askopenfilename(parent=self, title="Open DSC export")
+        if file:
+            self.load(file)
+
+    def load(self, file):
+        self.model = None
+        self.fit_button.config(state=tk.DISABLED)
+        self.settings["region"] = None
+        self.settings["tg_window"] = None
+        self.status.set("Loading " + file + "...")
+        self.worker.submit(load_model, file, self.cache)
+
+    def refit(self):
+        if self.model is None:
+            return
+        self.status.set("Fitting...")
+        self.worker.submit(analyse, self.model, dict(self.settings))
+
+    def cancel(self):
+        self.worker.cancel()
+
+    def change_method(self, method):
+        self.settings["method"] = method
+        self.refit()
+
+    def boundary_moved(self, axes, index, x):
+        # Dragging the region on the time trace keeps a dragged Tg window, the Tg window is dragged in °C
+        if self.model is None:
+            return
+        if axes == "region":
+            region = list(self.settings["region"] or self.plot.region_indices())
+            region[index] = int(np.clip(np.searchsorted(self.plot.time, x), 0, len(self.plot.time) - 1))
+            self.settings["region"] = (min(region), max(region))
+        else:
+            window = list(self.settings["tg_window"] or self.plot.tg_window())
+            window[index] = float(x)
+            self.settings["tg_window"] = (min(window), max(window))
+        self.refit()
+
+    def poll(self):
+        # Runs on the Tk loop, so it only ever updates artists from finished work
+        for kind, value in self.worker.drain():
+            if kind == "loaded":
+                self.model = value["model"]
+                self.plot.show_trace(value["time"], value["cp"], self.model.imported.name)
+                self.fit_button.config(state=tk.NORMAL)
+                self.refit()
+            elif kind == "region":
+                self.plot.show_region(*value)
+            elif kind == "transition":
+                self.preview = value["workspace"]
+                self.plot.show_transition(value["interped_temp"], value["interped_cp"], value["linear_model"],
+                                          value["tg_window"], self.preview.temps)
+                self.plot.show_model(self.preview.evaluate(value["guesses"]))
+                self.status.set("Fitting...")
+            elif kind == "progress":
+                self.plot.show_model(self.preview.evaluate(value))
+            elif kind == "fitted":
+                self.plot.show_model(self.preview.evaluate(value.x))
+                self.status.set("Tg %5.2f °C, error %5.5f (%d evaluations)" % (value.x[0], value.fun, value.nfev))
+            elif kind == "cancelled":
+                self.status.set("Cancelled")
+            elif kind == "error":
+                self.status.set(value)
+        self.after(poll_interval, self.poll)
+
+    def destroy(self):
+        self.worker.shutdown()
+        tk.Frame.destroy(self)
 
 
 class DataPlot(FigureCanvasTkAgg):
-    def __init__(self, master):
+    # The time trace with draggable region boundaries on top, the interpolated transition with the baseline,
+    # draggable Tg window boundaries and the model below. Artists are created once and updated in place.
+    def __init__(self, master, on_moved=None, on_grabbed=None):
         self.figure = Figure()
         FigureCanvasTkAgg.__init__(self, self.figure, master=master)
-        self.ax = self.figure.add_subplot(1, 1, 1)
+        self.ax = self.figure.add_subplot(2, 1, 1)
         self.ax.set_autoscaley_on(True)  # Y fixed
+        self.ax.set_xlabel(time_heading)
+        self.transition_ax = self.figure.add_subplot(2, 1, 2)
+        self.transition_ax.set_xlabel(temp_heading)
+        self.figure.tight_layout()
+        self.on_moved = on_moved
+        self.on_grabbed = on_grabbed
+        self.time = np.empty(0)
+        # the time trace can be millions of samples, it is drawn decimated to the axes width
+        self.trace = DecimatedLine(self.ax, [], [])
+        self.region_lines = [self.ax.axvline(0, color="g", visible=False) for i in range(0, 2)]
+        self.interped_line, = self.transition_ax.plot([], [], label="Interpolated Heat Capicity")
+        self.linear_line, = self.transition_ax.plot([], [], label="Linear Fit")
+        self.model_line, = self.transition_ax.plot([], [], label="Glass Transition Model")
+        self.tg_lines = [self.transition_ax.axvline(0, color="g", visible=False) for i in range(0, 2)]
+        self.grabbed = None
+        self.mpl_connect("button_press_event", self.press)
+        self.mpl_connect("motion_notify_event", self.motion)
+        self.mpl_connect("button_release_event", self.release)
+
+    def show_trace(self, time, cp, name):
+        self.time = time
+        self.ax.set_title("DSC data for " + name)
+        for line in self.region_lines + self.tg_lines:
+            line.set_visible(False)
+        for line in (self.interped_line, self.linear_line, self.model_line):
+            line.set_data([], [])
+        self.trace.set_data(time, cp)
+
+    def show_region(self, start, end):
+        for line, index in zip(self.region_lines, (start, end)):
+            line.set_xdata([self.time[index]] * 2)
+            line.set_visible(True)
+        self.draw_idle()
+
+    def show_transition(self, temps, cps, linear_model, tg_window, model_temps):
+        self.interped_line.set_data(temps, cps)
+        self.linear_line.set_data(temps, linear_model[0] * temps + linear_model[1])
+        self.model_line.set_data(model_temps, np.zeros(len(model_temps)))
+        for line, x in zip(self.tg_lines, tg_window):
+            line.set_xdata([x, x])
+            line.set_visible(True)
+        self.rescale(self.transition_ax)
+        self.transition_ax.legend(loc="best")
+        self.draw_idle()
+
+    def show_model(self, curve):
+        self.model_line.set_ydata(curve)
+        self.draw_idle()
+
+    def rescale(self, axes):
+        axes.relim(visible_only=True)
+        axes.autoscale_view()
+
+    def region_indices(self):
+        return tuple(int(np.searchsorted(self.time, line.get_xdata()[0])) for line in self.region_lines)
+
+    def tg_window(self):
+        return tuple(float(line.get_xdata()[0]) for line in self.tg_lines)
+
+    def press(self, event):
+        # Grabs the boundary line within grab_tolerance pixels of the press, unless the toolbar is zooming/panning
+        if event.inaxes is None or self.toolbar is not None and self.toolbar.mode:
+            return
+        lines = self.region_lines if event.inaxes is self.ax else self.tg_lines
+        for index, line in enumerate(lines):
+            x = event.inaxes.transData.transform((line.get_xdata()[0], 0))[0]
+            if line.get_visible() and abs(x - event.x) <= grab_tolerance:
+                self.grabbed = ("region" if lines is self.region_lines else "tg_window", index, line)
+                if self.on_grabbed is not None:
+                    self.on_grabbed()
+                return
+
+    def motion(self, event):
+        if self.grabbed is None or event.xdata is None:
+            return
+        self.grabbed[2].set_xdata([event.xdata] * 2)
+        self.draw_idle()
+
+    def release(self, event):
+        if self.grabbed is None:
+            return
+        axes, index, line = self.grabbed
+        self.grabbed = None
+        if self.on_moved is not None:
+            self.on_moved(axes, index, line.get_xdata()[0])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--file", type=str, help="DSC file to open")
+    parser.add_argument("--no-cache", help="Parse the DSC file without using the parsed-file cache",
+                        action="store_true")
+    args = parser.parse_args()
+
+    root = tk.Tk()
+    root.title("TgFinder")
+    app = MainFrame(root, file=args.file, cache=cache_from_args(args.no_cache))
+    root.mainloop()
@@ -0,0 +1,274 @@
+import argparse
+import csv
+import fnmatch
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from batch import ResultWriter, fit_file, handle_row
+from cache import content_hash
+from store import default_store_path
+
+# Watches directories for new DSC exports and fits them as they land. A file is only taken once its size and
+# modification time have stayed the same for settle seconds, so exports still being written are left alone. The
+# content hash of every finished file is written to the results table with its row, which makes reprocessing
+# idempotent: a file whose contents are already in the table, under any name, is skipped, also after a restart.
+# Files that failed are recorded with the reason and skipped too, unless the watcher is started with retry_failed
+# (--retry-failed), e.g. after the fitting code was fixed.
+default_settle = 2.
+default_interval = 1.
+default_retries = 3
+# seconds before the first retry, doubled for every further attempt
+default_retry_delay = 5.
+# failures in these stages can go away on their own (a file that was still being copied, locked by the instrument
+# software or on a share that dropped out), later stages fail the same way every time
+transient_stages = ["import", "worker"]
+
+
+def recorded_hashes(output, format="csv", retry_failed=False):
+    # Content hashes already in a results table, mapped to "" for fitted files and the failure message for failed
+    # ones. With retry_failed only fitted files are returned, so failed ones are fitted again.
+    if not os.path.exists(output):
+        return {}
+    recorded = {}
+    with open(output, newline="", encoding="utf-8") as table:
+        if format == "csv":
+            rows = csv.DictReader(table)
+        else:
+            rows = (json.loads(line) for line in table if line.strip())
+        for row in rows:
+            if not row.get("file_hash"):
+                continue
+            if row.get("status") == "ok":
+                recorded[row["file_hash"]] = ""
+            elif not retry_failed:
+                recorded.setdefault(row["file_hash"], row.get("message") or "failed")
+    return recorded
+
+
+def transient(row):
+    return row["status"] != "ok" and row["message"].split(":")[0] in transient_stages
+
+
+class Watcher():
+    # poll() does one round: scan the directories, queue the files that have settled, start queued fits while
+    # workers are free and write the rows of finished fits. Queued plus running files are capped at max_pending;
+    # once the cap is reached settled files wait in the directory, unhashed, until a fit finishes. clock can be
+    # replaced to test the debounce and retry timing and fit by another module level function taking (file,
+    # options) and returning a row like batch.fit_file. With workers=1 every fit runs in the calling process.
+    def __init__(self, directories, writer, pattern="*", workers=None, max_pending=None, settle=default_settle,
+                 retries=default_retries, retry_delay=default_retry_delay, options=None, seen=None, ignore=(),
+                 clock=time.monotonic, fit=fit_file, verbose=False):
+        self.directories = list(directories)
+        self.writer = writer
+        self.pattern = pattern
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.settle = settle
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.options = options or {}
+        # content hash -> "" once fitted, the failure message once failed
+        self.seen = dict(seen) if isinstance(seen, dict) else dict.fromkeys(seen or (), "")
+        self.ignore = {os.path.abspath(path) for path in ignore}
+        self.clock = clock
+        self.fit = fit
+        self.verbose = verbose
+        # path -> (size, mtime_ns) and when that signature was first seen, for files not yet settled
+        self.candidates = {}
+        # path -> signature of the version already queued or handled, so unchanged files are not hashed again
+        self.handled = {}
+        self.queue = []
+        self.running = {}
+        self.active_hashes = set()
+        self.counts = {"fitted": 0, "failed": 0, "skipped": 0, "retried": 0}
+        self.executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+    def pending(self):
+        return len(self.queue) + len(self.running)
+
+    def idle(self):
+        return not (self.candidates or self.queue or self.running)
+
+    def scan(self):
+        now = self.clock()
+        present = set()
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                # a share that is briefly unavailable is scanned again next round
+                continue
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                path = os.path.abspath(entry.path)
+                if path in self.ignore or not fnmatch.fnmatch(entry.name, self.pattern):
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                present.add(path)
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if self.handled.get(path) == signature:
+                    continue
+                candidate = self.candidates.get(path)
+                if candidate is None or candidate[0] != signature:
+                    self.candidates[path] = (signature, now)
+                elif now - candidate[1] >= self.settle and signature[0] == 0:
+                    # an empty file is left alone until it is written to, so it does not keep the watcher busy
+                    del self.candidates[path]
+                    self.handled[path] = signature
+                elif now - candidate[1] >= self.settle and self.pending() < self.max_pending:
+                    del self.candidates[path]
+                    self.settled(path, signature)
+        for path in [path for path in self.candidates if path not in present]:
+            del self.candidates[path]
+
+    def settled(self, path, signature):
+        try:
+            file_hash = content_hash(path)
+        except OSError:
+            return
+        self.handled[path] = signature
+        if file_hash in self.seen or file_hash in self.active_hashes:
+            self.counts["skipped"] += 1
+            if self.verbose:
+                reason = self.seen.get(file_hash)
+                print("%s: %s, skipped" % (path, "failed before (%s)" % reason if reason else "already fitted"))
+            return
+        self.active_hashes.add(file_hash)
+        self.queue.append({"file": path, "hash": file_hash, "signature": signature, "attempt": 1,
+                           "not_before": self.clock()})
+
+    def dispatch(self):
+        now = self.clock()
+        for job in [job for job in self.queue if job["not_before"] <= now]:
+            if self.executor is None:
+                self.queue.remove(job)
+                self.finish(job, self.fit(job["file"], self.options))
+            elif len(self.running) < self.workers:
+                self.queue.remove(job)
+                self.running[self.executor.submit(self.fit, job["file"], self.options)] = job
+
+    def collect(self, timeout=0):
+        if not self.running:
+            return
+        done, _ = wait(self.running, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            job = self.running.pop(future)
+            try:
+                row = future.result()
+            except Exception as error:
+                # the worker itself died, e.g. out of memory
+                row = {"file": job["file"], "name": os.path.basename(job["file"]), "status": "failed",
+                       "message": "worker: %s: %s" % (type(error).__name__, error)}
+            self.finish(job, row)
+
+    def finish(self, job, row):
+        if self.changed(job):
+            # written to again after it settled (a copy that stalled), the row is of a partial file and is dropped,
+            # the new version goes through the debounce as a new file
+            self.handled.pop(job["file"], None)
+            self.active_hashes.discard(job["hash"])
+            return
+        if transient(row) and job["attempt"] <= self.retries:
+            self.counts["retried"] += 1
+            job["not_before"] = self.clock() + self.retry_delay * 2 ** (job["attempt"] - 1)
+            job["attempt"] += 1
+            self.queue.append(job)
+            if self.verbose:
+                print("%s: %s, retrying (attempt %d)" % (job["file"], row["message"], job["attempt"]))
+            return
+        row["file_hash"] = job["hash"]
+        row["attempts"] = job["attempt"]
+        handle_row(row, self.writer, self.verbose)
+        self.counts["fitted" if row["status"] == "ok" else "failed"] += 1
+        self.seen[job["hash"]] = "" if row["status"] == "ok" else row["message"]
+        self.active_hashes.discard(job["hash"])
+
+    def changed(self, job):
+        try:
+            stat = os.stat(job["file"])
+        except OSError:
+            return True
+        return (stat.st_size, stat.st_mtime_ns) != job["signature"]
+
+    def poll(self):
+        self.scan()
+        self.dispatch()
+        self.collect()
+
+    def run(self, interval=default_interval, until_idle=False):
+        # Polls every interval seconds, waiting on running fits in between, until interrupted or, with
+        # until_idle, until nothing is left settling, queued or running
+        try:
+            while True:
+                self.poll()
+                if until_idle and self.idle():
+                    break
+                if self.running:
+                    self.collect(timeout=interval)
+                else:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+        return self.counts
+
+    def close(self):
+        # fits already running are finished and written, queued files are picked up again on the next start
+        while self.running:
+            self.collect(timeout=None)
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("directories", nargs="+", help="Directories the instrument exports into")
+    parser.add_argument("-o", "--output", type=str, default="results.csv", help="Results table to append to")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv", help="CSV rows or JSON lines")
+    parser.add_argument("-p", "--pattern", type=str, default="*", help="Pattern of the files to fit")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="Files queued or fitting at once before new files are left waiting (default: 2 per "
+                             "worker)")
+    parser.add_argument("--settle", type=float, default=default_settle,
+                        help="Seconds a file must stay unchanged before it is fitted")
+    parser.add_argument("--interval", type=float, default=default_interval, help="Seconds between scans")
+    parser.add_argument("--retries", type=int, default=default_retries,
+                        help="Retries of a file that fails to import")
+    parser.add_argument("--retry-delay", type=float, default=default_retry_delay,
+                        help="Seconds before the first retry, doubled for each further one")
+    parser.add_argument("--retry-failed", help="Fit files again whose earlier attempts are recorded as failed",
+                        action="store_true")
+    parser.add_argument("--once", help="Fit what is in the directories, then exit", action="store_true")
+    parser.add_argument("-m", "--method", choices=["trf", "dogbox", "lm", "minimize"], default="trf",
+                        help="Tg fitting method")
+    parser.add_argument("-rb", "--robust_baseline", help="Fit the linear region with robust reweighting",
+                        action="store_true")
+    parser.add_argument("--store", nargs="?", const=default_store_path, default=None,
+                        help="Reuse and record fits in this SQLite fit store (default location without a path)")
+    parser.add_argument("--no-cache", help="Parse DSC files without using the parsed-file cache", action="store_true")
+    parser.add_argument("-v", "--verbose", help="Print a line per finished file", action="store_true")
+    args = parser.parse_args()
+
+    options = {"method": args.method, "robust_baseline": args.robust_baseline, "auto_guess": True,
+               "no_cache": args.no_cache, "store": args.store}
+    writer = ResultWriter(args.output, args.format, append=True)
+    watcher = Watcher(args.directories, writer, pattern=args.pattern, workers=args.workers,
+                      max_pending=args.max_pending, settle=args.settle, retries=args.retries,
+                      retry_delay=args.retry_delay, options=options,
+                      seen=recorded_hashes(args.output, args.format, args.retry_failed), ignore=[args.output],
+                      verbose=args.verbose)
+    try:
+        counts = watcher.run(interval=args.interval, until_idle=args.once)
+    finally:
+        writer.close()
+    print("Fitted %d files, %d failed, %d skipped as recorded before, %d retries, results in %s" % (
+        counts["fitted"], counts["failed"], counts["skipped"], counts["retried"], args.output))